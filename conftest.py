@@ -0,0 +1,30 @@
+"""
+pytest公共夹具
+
+运行: python -m pytest -q test_*.py
+"""
+
+import importlib
+import os
+import sys
+
+import pytest
+
+# 需要先启动服务端的手动测试脚本，不作为pytest用例收集
+collect_ignore = ['quick_cache_test.py']
+
+
+@pytest.fixture(scope='session')
+def server(tmp_path_factory):
+    """在临时目录中导入simple_server（历史数据目录相对于当前目录），并停止后台采集线程"""
+    cwd = os.getcwd()
+    os.chdir(tmp_path_factory.mktemp('data'))
+    sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+    try:
+        module = importlib.import_module('simple_server')
+        module.server_monitor.stop_background_update()
+        yield module
+        # 数据目录是相对路径：测试写入的历史数据全部落盘后再切回原目录
+        module.server_monitor.persistence.close()
+    finally:
+        os.chdir(cwd)
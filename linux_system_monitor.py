@@ -2,16 +2,24 @@
 """
 Linux服务器CPU和内存监控工具
 监控5分钟内的系统资源使用情况并记录数据
+使用 --agent 参数时作为推送agent长期运行，把采样数据推送到监控服务器
 """
 
 import psutil
 import time
 import json
 import csv
+import gzip
+import uuid
 import threading
+import urllib.request
+import urllib.error
 from datetime import datetime, timedelta
 import os
 import sys
+import signal
+
+from metric_counters import counter_delta
 
 class LinuxSystemMonitor:
     def __init__(self, monitor_duration=300, sample_interval=1):
@@ -270,6 +278,207 @@ class LinuxSystemMonitor:
         print(f"  最大: {max(load_1min):.2f}")
 
 
+class MetricsPushAgent:
+    """推送模式agent：在本机用psutil采样，按批推送到监控服务器的 /api/ingest
+
+    每个样本带单调递增的序号。一批样本先以gzip压缩的NDJSON写入本地spool
+    目录，再按顺序推送，服务器确认后才删除，因此服务器不可达或agent重启
+    都不会丢数据；服务器按序号去重，重发是安全的。
+    """
+
+    def __init__(self, server_url, server_id=None, sample_interval=10, batch_interval=60,
+                 spool_dir='./agent_spool', token=None, max_spool_files=10000, timeout=10):
+        """
+        :param server_url: 监控服务器地址，如 http://monitor:5000
+        :param server_id: 在监控服务器上的服务器ID，默认为主机名
+        :param sample_interval: 采样间隔(秒)
+        :param batch_interval: 推送间隔(秒)，每次推送这段时间内的全部样本
+        :param spool_dir: 本地缓存目录，保存未确认的批次和序号状态
+        :param token: 服务器设置了 INGEST_TOKEN 时需要提供
+        :param max_spool_files: 本地最多缓存的批次数，超出时丢弃最旧的批次
+        """
+        self.ingest_url = server_url.rstrip('/') + '/api/ingest'
+        self.server_id = server_id or os.uname().nodename
+        self.sample_interval = sample_interval
+        self.batch_interval = batch_interval
+        self.spool_dir = spool_dir
+        self.token = token
+        self.max_spool_files = max_spool_files
+        self.timeout = timeout
+        self.is_running = False
+
+        self.pending = []  # 尚未写入spool的样本
+        self._last_disk_io = None
+        self._last_network = None
+        self._last_sample_time = None
+
+        os.makedirs(self.spool_dir, exist_ok=True)
+        self.state_file = os.path.join(self.spool_dir, 'agent_state.json')
+        self.state = self._load_state()
+
+    def _load_state(self):
+        """读取序号状态；首次运行时生成agent_id"""
+        try:
+            with open(self.state_file, 'r', encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {'agent_id': uuid.uuid4().hex, 'seq': 0, 'batch_seq': 0}
+
+    def _save_state(self):
+        tmp_file = self.state_file + '.tmp'
+        with open(tmp_file, 'w', encoding='utf-8') as f:
+            json.dump(self.state, f)
+        os.replace(tmp_file, self.state_file)
+
+    def sample(self):
+        """采集一个样本，磁盘读写和网络收发均为两次采样之间的字节/秒
+
+        与服务端相同，计数器差值用 counter_delta 计算（处理32/64位回绕）。
+        启动后的第一次采样，以及任一计数器被判断为重置时，本次只作为新的
+        基准（warmup），返回None且不消耗序号，避免在历史中留下一个假的0值。
+        """
+        now = time.time()
+        disk_io = psutil.disk_io_counters()
+        network = psutil.net_io_counters()
+        previous = (self._last_sample_time, self._last_disk_io, self._last_network)
+        self._last_disk_io = disk_io
+        self._last_network = network
+        self._last_sample_time = now
+
+        last_time, last_disk_io, last_network = previous
+        if not last_time or now <= last_time:
+            return None
+        elapsed = now - last_time
+        pairs = [(last_network.bytes_sent, network.bytes_sent), (last_network.bytes_recv, network.bytes_recv)]
+        if disk_io and last_disk_io:
+            pairs += [(last_disk_io.read_bytes, disk_io.read_bytes), (last_disk_io.write_bytes, disk_io.write_bytes)]
+        deltas = [counter_delta(then, current) for then, current in pairs]
+        if None in deltas:
+            return None
+        network_sent, network_recv = deltas[0] / elapsed, deltas[1] / elapsed
+        disk_read, disk_write = (deltas[2] / elapsed, deltas[3] / elapsed) if len(deltas) == 4 else (0.0, 0.0)
+
+        self.state['seq'] += 1
+        return {
+            'seq': self.state['seq'],
+            'ts': int(now),
+            'cpu': psutil.cpu_percent(interval=None),
+            'memory': psutil.virtual_memory().percent,
+            'disk_read': round(disk_read, 1),
+            'disk_write': round(disk_write, 1),
+            'network_sent': round(network_sent, 1),
+            'network_recv': round(network_recv, 1),
+            'load_avg': os.getloadavg()[0],
+        }
+
+    def spool_batch(self):
+        """把待发送样本写成一个压缩批次文件（先写临时文件再rename）"""
+        if not self.pending:
+            return None
+        self.state['batch_seq'] += 1
+        header = {
+            'server_id': self.server_id,
+            'agent_id': self.state['agent_id'],
+            'batch_seq': self.state['batch_seq'],
+            'count': len(self.pending),
+        }
+        lines = [json.dumps(header)] + [json.dumps(sample, separators=(',', ':')) for sample in self.pending]
+        path = os.path.join(self.spool_dir, f"batch_{self.state['batch_seq']:012d}.ndjson.gz")
+        with open(path + '.tmp', 'wb') as f:
+            f.write(gzip.compress('\n'.join(lines).encode('utf-8')))
+        os.replace(path + '.tmp', path)
+        self._save_state()
+        self.pending = []
+        self._trim_spool()
+        return path
+
+    def _spooled_batches(self):
+        return sorted(
+            os.path.join(self.spool_dir, name) for name in os.listdir(self.spool_dir)
+            if name.startswith('batch_') and name.endswith('.ndjson.gz')
+        )
+
+    def _trim_spool(self):
+        batches = self._spooled_batches()
+        for path in batches[:max(len(batches) - self.max_spool_files, 0)]:
+            os.remove(path)
+            print(f"⚠️  本地缓存已满，丢弃最旧的批次: {os.path.basename(path)}")
+
+    def _post(self, body):
+        headers = {'Content-Type': 'application/x-ndjson', 'Content-Encoding': 'gzip'}
+        if self.token:
+            headers['Authorization'] = f"Bearer {self.token}"
+        req = urllib.request.Request(self.ingest_url, data=body, headers=headers, method='POST')
+        with urllib.request.urlopen(req, timeout=self.timeout) as response:
+            return json.loads(response.read().decode('utf-8'))
+
+    def flush_spool(self):
+        """按顺序推送本地缓存的批次，遇到服务器不可达时停止，返回推送成功的批次数"""
+        sent = 0
+        for path in self._spooled_batches():
+            with open(path, 'rb') as f:
+                body = f.read()
+            try:
+                result = self._post(body)
+            except urllib.error.HTTPError as e:
+                if e.code == 400:
+                    # 服务器无法解析的批次重发也不会成功，丢弃
+                    print(f"❌ 服务器拒绝批次 {os.path.basename(path)}: {e.read().decode('utf-8', 'replace')}")
+                    os.remove(path)
+                    continue
+                print(f"⚠️  推送失败 (HTTP {e.code})，稍后重试")
+                break
+            except (urllib.error.URLError, OSError) as e:
+                print(f"⚠️  服务器不可达，批次保留在本地: {e}")
+                break
+            if not result.get('success'):
+                print(f"⚠️  推送失败: {result.get('error')}，稍后重试")
+                break
+            os.remove(path)
+            sent += 1
+        return sent
+
+    def _handle_sigterm(self, signum, frame):
+        """收到SIGTERM（如systemd停止服务）时退出主循环，剩余样本写入本地缓存"""
+        self.is_running = False
+
+    def run(self):
+        """持续采样并按批推送，直到被中断"""
+        print(f"🚀 推送agent已启动: {self.server_id} -> {self.ingest_url}")
+        print(f"   采样间隔: {self.sample_interval}秒, 推送间隔: {self.batch_interval}秒, 本地缓存: {self.spool_dir}")
+        self.is_running = True
+        signal.signal(signal.SIGTERM, self._handle_sigterm)
+        psutil.cpu_percent(interval=None)  # 第一次调用只建立基准
+        next_sample = time.monotonic()
+        next_batch = next_sample + self.batch_interval
+
+        try:
+            while self.is_running:
+                now = time.monotonic()
+                if now >= next_sample:
+                    try:
+                        sample = self.sample()
+                        if sample is not None:
+                            self.pending.append(sample)
+                    except Exception as e:
+                        print(f"采样错误: {e}")
+                    next_sample += self.sample_interval
+                if now >= next_batch:
+                    self.spool_batch()
+                    sent = self.flush_spool()
+                    if sent:
+                        print(f"📤 已推送 {sent} 个批次")
+                    next_batch += self.batch_interval
+                time.sleep(max(min(next_sample, next_batch) - time.monotonic(), 0))
+        except KeyboardInterrupt:
+            print("\n用户中断，保存未发送的样本...")
+        finally:
+            self.is_running = False
+            self.spool_batch()
+            self.flush_spool()
+
+
+
 def main():
     """主函数"""
     import argparse
@@ -285,8 +494,32 @@ def main():
                        help='输出目录，默认./monitoring_data')
     parser.add_argument('--no-summary', action='store_true',
                        help='不显示摘要报告')
+    parser.add_argument('--agent', action='store_true',
+                       help='以推送agent模式长期运行，把数据推送到监控服务器')
+    parser.add_argument('--server', default='http://localhost:5000',
+                       help='agent模式: 监控服务器地址，默认http://localhost:5000')
+    parser.add_argument('--server-id', default=None,
+                       help='agent模式: 在监控服务器上的服务器ID，默认为主机名')
+    parser.add_argument('--batch-interval', type=float, default=60,
+                       help='agent模式: 推送间隔(秒)，默认60秒')
+    parser.add_argument('--spool-dir', default='./agent_spool',
+                       help='agent模式: 服务器不可达时的本地缓存目录，默认./agent_spool')
+    parser.add_argument('--token', default=os.environ.get('INGEST_TOKEN'),
+                       help='agent模式: 服务器的INGEST_TOKEN，默认读取同名环境变量')
     
     args = parser.parse_args()
+
+    if args.agent:
+        agent = MetricsPushAgent(
+            server_url=args.server,
+            server_id=args.server_id,
+            sample_interval=args.interval,
+            batch_interval=args.batch_interval,
+            spool_dir=args.spool_dir,
+            token=args.token
+        )
+        agent.run()
+        return
     
     # 检查权限
     if os.geteuid() != 0:
@@ -0,0 +1,26 @@
+#!/usr/bin/env python3
+"""
+单调计数器工具
+监控服务器（simple_server.py）和推送agent（linux_system_monitor.py）共用，
+保证两种采集方式对计数器回绕和重置的处理完全一致。不依赖任何第三方库，
+部署agent时与 linux_system_monitor.py 放在同一目录即可。
+"""
+
+COUNTER_32_MAX = 2 ** 32
+COUNTER_64_MAX = 2 ** 64
+
+
+def counter_delta(previous, current):
+    """单调计数器的增量，处理32/64位回绕；判断为计数器重置时返回None
+
+    计数变小时，若旧值在32位范围内且按32位回绕得到的增量小于半个量程，
+    视为32位回绕；64位计数器同理。其余情况（接口重建、驱动重载、
+    主机重启）视为重置。
+    """
+    if current >= previous:
+        return current - previous
+    for limit in (COUNTER_32_MAX, COUNTER_64_MAX):
+        if previous < limit:
+            wrapped = current + limit - previous
+            return wrapped if wrapped < limit // 2 else None
+    return None
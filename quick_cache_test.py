@@ -2,12 +2,41 @@
 """
 快速缓存测试脚本
 验证缓存优化效果
+
+命中情况以服务端 /api/cache/stats 的计数器增量为准并做断言（不满足时抛出
+AssertionError）。后台线程检查缓存时不计入统计，但其他客户端的请求会，
+运行时请关闭前端页面。
 """
 
 import requests
 import time
 import json
 
+# 命中缓存的请求依次查找历史数据、实时数据、进程列表三个键
+CACHED_LOOKUPS = 3
+
+def get_cache_stats(base_url):
+    """获取服务端缓存统计，失败时返回None"""
+    try:
+        response = requests.get(f"{base_url}/api/cache/stats", timeout=5)
+        data = response.json()
+        return data['data'] if data.get('success') else None
+    except Exception:
+        return None
+
+def stats_delta(before, after):
+    """两次缓存统计之间的命中/过期命中/未命中增量"""
+    return {name: after[name] - before[name] for name in ('hits', 'stale_hits', 'misses')}
+
+def get_collector_stats(base_url):
+    """获取后台采集统计，失败时返回None"""
+    try:
+        response = requests.get(f"{base_url}/api/collector/stats", timeout=5)
+        data = response.json()
+        return data['data'] if data.get('success') else None
+    except Exception:
+        return None
+
 def test_cache_performance():
     """测试缓存性能"""
     base_url = "http://localhost:5000"
@@ -38,10 +67,15 @@ def test_cache_performance():
     print(f"📋 参数: {params}")
     print("-" * 50)
     
+    start_stats = get_cache_stats(base_url)
+    assert start_stats is not None, "无法获取 /api/cache/stats"
+    warm_hits = warm_lookups = 0
+    
     # 进行5次测试
     for i in range(5):
         print(f"\n第 {i+1} 次请求:")
         
+        before_stats = get_cache_stats(base_url)
         start_time = time.time()
         try:
             response = requests.get(endpoint, params=params, timeout=30)
@@ -52,17 +86,30 @@ def test_cache_performance():
             if response.status_code == 200:
                 data = response.json()
                 if data.get('success'):
-                    # 检查缓存信息
-                    cache_info = data.get('data', {}).get('cache_info', {})
-                    cache_hit = cache_info.get('cache_hit', False)
-                    cache_age = cache_info.get('cache_age', 'N/A')
+                    print(f"   ✅ 响应时间: {response_time:.1f}ms")
                     
-                    cache_status = "🔥 缓存命中" if cache_hit else "🐌 缓存未命中"
+                    # 用服务端计数器的增量判断命中情况（同时包含实时数据和进程缓存的查找）
+                    after_stats = get_cache_stats(base_url)
+                    delta = stats_delta(before_stats, after_stats)
+                    hits = delta['hits'] + delta['stale_hits']
+                    lookups = hits + delta['misses']
+                    cache_status = "🔥 缓存命中" if lookups and not delta['misses'] else "🐌 缓存未命中"
+                    print(f"   📊 状态: {cache_status} (命中 {hits} / 查找 {lookups}, 过期命中 {delta['stale_hits']})")
+                    assert lookups >= 1, "请求没有查找缓存"
+                    if i > 0:
+                        # 第一次请求之后缓存必然已填充（过期数据在宽限期内也算命中）
+                        assert delta['misses'] == 0, f"第 {i+1} 次请求出现 {delta['misses']} 次缓存未命中"
+                        assert hits == CACHED_LOOKUPS, f"第 {i+1} 次请求命中 {hits} 次，预期 {CACHED_LOOKUPS} 次"
+                        warm_hits += hits
+                        warm_lookups += lookups
                     
-                    print(f"   ✅ 响应时间: {response_time:.1f}ms")
-                    print(f"   📊 状态: {cache_status}")
-                    if cache_hit:
-                        print(f"   ⏰ 缓存年龄: {cache_age}")
+                    metrics_key = f"{server_id}_metrics_{params['timeRange']}"
+                    entry = next((info for info in after_stats['keys'] if info['key'] == metrics_key), None)
+                    assert entry is not None, f"缓存中没有 {metrics_key}"
+                    assert entry['size'] > 0
+                    assert entry['age'] <= after_stats['ttl'] + after_stats['stale_grace']
+                    print(f"   ⏰ 缓存年龄: {entry['age']:.1f}s | 剩余TTL: {entry['ttl_remaining']:.1f}s"
+                          f" | 大小: {entry['size']/1024:.1f}KB | 命中次数: {entry['hits']}")
                     
                     # 显示数据大小
                     content_length = len(response.content)
@@ -75,12 +122,12 @@ def test_cache_performance():
                         print(f"   📈 数据点数量: {data_points}")
                     
                 else:
-                    print(f"   ❌ API错误: {data.get('error', '未知错误')}")
+                    raise AssertionError(f"API错误: {data.get('error', '未知错误')}")
             else:
-                print(f"   ❌ HTTP错误: {response.status_code}")
+                raise AssertionError(f"HTTP错误: {response.status_code}")
                 
-        except Exception as e:
-            print(f"   ❌ 请求失败: {e}")
+        except requests.RequestException as e:
+            raise AssertionError(f"请求失败: {e}")
         
         # 等待一段时间再进行下次测试
         if i < 4:  # 最后一次不需要等待
@@ -89,6 +136,28 @@ def test_cache_performance():
     
     print("\n" + "=" * 50)
     print("🎯 测试完成！")
+    
+    end_stats = get_cache_stats(base_url)
+    assert end_stats is not None, "无法获取 /api/cache/stats"
+    delta = stats_delta(start_stats, end_stats)
+    print(f"\n📊 服务端缓存统计 (本次测试期间):")
+    print(f"   • 命中: {delta['hits']} | 过期命中: {delta['stale_hits']} | 未命中: {delta['misses']}")
+    print(f"   • 最近1分钟命中率: {end_stats['windows']['1m']['hit_rate']*100:.1f}%")
+    print(f"   • 缓存条目: {end_stats['entries']} | 估算大小: {end_stats['bytes']/1024:.1f}KB"
+          f" | 淘汰: {end_stats['evictions']}")
+    # 5次请求：第1次最多1次未命中，其余全部命中
+    assert delta['misses'] <= 1, f"测试期间出现 {delta['misses']} 次缓存未命中"
+    assert delta['hits'] + delta['stale_hits'] >= 4 * CACHED_LOOKUPS
+    warm_rate = warm_hits / warm_lookups
+    print(f"   • 第2-5次请求命中率: {warm_rate*100:.1f}% (预期 >80%)")
+    assert warm_rate > 0.8
+    
+    collector_stats = get_collector_stats(base_url)
+    assert collector_stats is not None, "无法获取 /api/collector/stats"
+    status = collector_stats['servers'].get(server_id, {})
+    print(f"   • 采集线程利用率p95: {collector_stats['fleet_fit']['p95_utilization']*100:.0f}%"
+          f" | 最近成功采集: {status.get('last_success') or 'N/A'}")
+    print("\n✅ 所有断言通过")
     print("\n💡 预期结果:")
     print("   • 第1次请求: 较慢 (需要获取真实数据)")
     print("   • 第2-5次请求: 快速 (缓存命中)")
@@ -1,5 +1,5 @@
 #!/usr/bin/env python3
-from flask import Flask, request, jsonify, render_template_string, render_template
+from flask import Flask, Response, request, jsonify, render_template_string, render_template, stream_with_context
 from flask_cors import CORS
 import io
 import sys
@@ -8,12 +8,26 @@ import os
 import numpy as np
 import sqlite3
 import threading
+import queue
+import zlib
+import hmac
+import math
+import heapq
+import random
+import concurrent.futures
 import time
 import socket
+import atexit
 import re
+import bisect
+import mmap
+import struct
 from datetime import datetime, timedelta
+from collections import OrderedDict, deque
 from contextlib import redirect_stdout, redirect_stderr
 
+from metric_counters import COUNTER_32_MAX, COUNTER_64_MAX, counter_delta
+
 # 尝试导入paramiko，如果没有安装则提示
 try:
     import paramiko
@@ -23,12 +37,1077 @@ except ImportError:
     print("⚠️  警告: paramiko库未安装，SSH连接功能将被禁用")
     print("   安装命令: pip install paramiko")
 
+# 历史数据记录格式：epoch时间戳 + 7个指标，定长小端二进制行
+HISTORY_FIELDS = ('cpu', 'memory', 'disk_read', 'disk_write', 'network_sent', 'network_recv', 'load_avg')
+RECORD_DTYPE = np.dtype([('ts', '<i8')] + [(field, '<f8') for field in HISTORY_FIELDS])
+
+# 分设备序列: 类别 -> 每个设备一条记录的字段
+# disk: 每秒读/写完成次数、读/写字节数、平均等待时间(ms)、利用率(%)
+# net: 每个网络接口每秒收/发字节数、包数、错误数、丢包数
+DEVICE_FIELDS = {
+    'disk': ('reads', 'writes', 'read_bytes', 'write_bytes', 'await', 'util'),
+    'net': ('rx_bytes', 'tx_bytes', 'rx_packets', 'tx_packets', 'rx_errors', 'tx_errors', 'rx_drops', 'tx_drops'),
+}
+DEVICE_DTYPES = {
+    kind: np.dtype([('ts', '<i8')] + [(field, '<f8') for field in fields])
+    for kind, fields in DEVICE_FIELDS.items()
+}
+
+# 前端时间范围参数对应的秒数
+TIME_RANGE_SECONDS = {
+    '5m': 5 * 60,
+    '15m': 15 * 60,
+    '1h': 3600,
+    '6h': 6 * 3600,
+    '24h': 24 * 3600,
+    '7d': 7 * 24 * 3600,
+}
+
+# 降采样层级: (名称, 桶宽秒数, 保留秒数)，按从细到粗排列
+ROLLUP_TIERS = (
+    ('1m', 60, 7 * 24 * 3600),
+    ('5m', 300, 30 * 24 * 3600),
+    ('1h', 3600, 365 * 24 * 3600),
+)
+RAW_RETENTION_SECONDS = 48 * 3600  # 原始数据保留48小时
+ROLLUP_AGGREGATES = ('min', 'max', 'avg', 'last')
+ROLLUP_DTYPE = np.dtype(
+    [('ts', '<i8'), ('count', '<i8')]
+    + [(f'{field}_{agg}', '<f8') for field in HISTORY_FIELDS for agg in ROLLUP_AGGREGATES]
+)
+
+# 旧版JSON文本文件中各指标的存放位置: 文件后缀 -> {记录字段: JSON键}
+LEGACY_METRIC_FILES = {
+    'cpu': {'cpu': 'values'},
+    'memory': {'memory': 'values'},
+    'disk_io': {'disk_read': 'disk_read', 'disk_write': 'disk_write'},
+    'network': {'network_sent': 'network_sent', 'network_recv': 'network_recv'},
+}
+
+
+def _safe_join(base_dir, *parts):
+    """把服务器ID等外部输入拼成数据目录下的路径
+
+    每一级中的特殊字符替换为下划线；'.'、'..' 和空名称，或拼接后不在
+    base_dir 之下的路径抛出ValueError。
+    """
+    names = [re.sub(r'[^\w.-]', '_', str(part)) for part in parts]
+    for name in names:
+        if name in ('', '.', '..'):
+            raise ValueError(f"非法的路径名称: {name!r}")
+    root = os.path.realpath(base_dir)
+    path = os.path.join(root, *names)
+    if os.path.commonpath([root, os.path.realpath(path)]) != root:
+        raise ValueError(f"路径不在数据目录内: {path}")
+    return os.path.join(base_dir, *names)
+
+
+def _to_epoch(value, reference=None):
+    """把各种时间表示统一转换为epoch秒（int）
+
+    旧数据只有'%H:%M:%S'，没有日期，按reference所在日期补全，
+    若补全后比reference晚超过1分钟则视为前一天的数据。
+    """
+    if isinstance(value, (int, float, np.integer, np.floating)):
+        return int(value)
+    if isinstance(value, datetime):
+        return int(value.timestamp())
+
+    reference = reference or datetime.now()
+    text = str(value).strip()
+    for fmt in ('%Y-%m-%d %H:%M:%S', '%Y-%m-%dT%H:%M:%S'):
+        try:
+            return int(datetime.strptime(text, fmt).timestamp())
+        except ValueError:
+            pass
+
+    clock = datetime.strptime(text, '%H:%M:%S').time()
+    full_time = datetime.combine(reference.date(), clock)
+    if full_time > reference + timedelta(minutes=1):
+        full_time -= timedelta(days=1)
+    return int(full_time.timestamp())
+
+
+def _downsample_records(records, start_ts, max_points):
+    """按固定时间桶对记录做平均降采样，每个桶的时间戳取桶内最后一条"""
+    if max_points is None or len(records) <= max_points:
+        return records
+    span = int(records['ts'][-1]) - start_ts + 1
+    bucket_seconds = max(1, -(-span // max_points))  # 向上取整
+
+    bucket_ids = (records['ts'] - start_ts) // bucket_seconds
+    starts = np.flatnonzero(np.concatenate(([True], np.diff(bucket_ids) != 0)))
+    counts = np.diff(np.append(starts, len(records)))
+
+    result = np.zeros(len(starts), dtype=records.dtype)
+    result['ts'] = records['ts'][starts + counts - 1]
+    for field in records.dtype.names:
+        if field != 'ts':
+            result[field] = np.add.reduceat(records[field], starts) / counts
+    return result
+
+
+def _zigzag(values):
+    """有符号int64映射为无符号，使绝对值小的负数也只占很少的varint字节"""
+    values = values.astype(np.int64)
+    return ((values << 1) ^ (values >> 63)).astype(np.uint64)
+
+
+def _unzigzag(values):
+    return ((values >> np.uint64(1)).astype(np.int64)) ^ -(values & np.uint64(1)).astype(np.int64)
+
+
+def _encode_varints(values):
+    """向量化LEB128编码：每字节7位数据，最高位表示后面还有字节"""
+    values = values.astype(np.uint64)
+    shifts = np.arange(10, dtype=np.uint64) * np.uint64(7)
+    groups = values[:, None] >> shifts
+    lengths = 1 + np.count_nonzero(groups[:, 1:], axis=1)
+    columns = np.arange(10)
+    out = (groups & np.uint64(0x7f)).astype(np.uint8)
+    out[columns < (lengths - 1)[:, None]] |= 0x80
+    return out[columns < lengths[:, None]].tobytes()
+
+
+def _decode_varints(data, count):
+    """_encode_varints的逆运算，返回前count个uint64"""
+    raw = np.frombuffer(data, dtype=np.uint8)
+    if not count:
+        return np.empty(0, dtype=np.uint64)
+    ends = np.flatnonzero(raw < 0x80)[:count]
+    starts = np.concatenate(([0], ends[:-1] + 1))
+    raw = raw[:ends[-1] + 1]
+    positions = np.arange(len(raw)) - np.repeat(starts, ends - starts + 1)
+    parts = (raw & 0x7f).astype(np.uint64) << (positions.astype(np.uint64) * np.uint64(7))
+    return np.add.reduceat(parts, starts)  # 各字节的位不重叠，求和即按位或
+
+
+class SegmentCodec:
+    """Gorilla风格的列式分段压缩
+
+    每列独立编码：时间戳用delta-of-delta，整数列和全为整数值的浮点列
+    （如网络、磁盘累计字节数）用增量+zigzag varint，其余浮点列与前一个值
+    异或后只保存中间的非零字节（字节对齐版的Gorilla XOR压缩）。
+    编解码全部是NumPy向量运算，没有逐条记录的Python循环。
+
+    文件格式: MAGIC | uint32 记录数 | 每列 (uint8 编码方式, uint32 长度, 数据)
+    """
+
+    # 原始分段的前8字节是小端int64时间戳，最高字节必为0，不会与魔数冲突
+    MAGIC = b'\x89HSZ\r\n\x1a\n'
+    DOD, DELTA, XOR, INT_DELTA = 1, 2, 3, 4  # INT_DELTA: 整数值的浮点列
+
+    def __init__(self, dtype):
+        self.dtype = dtype
+
+    @classmethod
+    def is_encoded(cls, data):
+        return data[:len(cls.MAGIC)] == cls.MAGIC
+
+    # 文件头长度：魔数 + 记录数
+    HEADER_SIZE = len(MAGIC) + 4
+
+    @classmethod
+    def record_count(cls, header):
+        """从文件头读取记录数，不解码数据"""
+        return struct.unpack_from('<I', header, len(cls.MAGIC))[0]
+
+    def encode(self, records):
+        """把结构化记录数组编码为bytes"""
+        parts = [self.MAGIC, struct.pack('<I', len(records))]
+        for name in self.dtype.names:
+            column = records[name]
+            if name == 'ts':
+                method, payload = self.DOD, self._encode_dod(column)
+            elif column.dtype.kind == 'i':
+                method, payload = self.DELTA, self._encode_delta(column)
+            elif self._is_integral(column):
+                method, payload = self.INT_DELTA, self._encode_delta(column.astype(np.int64))
+            else:
+                method, payload = self.XOR, self._encode_xor(column)
+            parts.append(struct.pack('<BI', method, len(payload)))
+            parts.append(payload)
+        return b''.join(parts)
+
+    def decode(self, data):
+        """解码encode产生的bytes，返回结构化记录数组"""
+        offset = len(self.MAGIC)
+        count, = struct.unpack_from('<I', data, offset)
+        offset += 4
+        records = np.zeros(count, dtype=self.dtype)
+        for name in self.dtype.names:
+            method, length = struct.unpack_from('<BI', data, offset)
+            offset += 5
+            payload = data[offset:offset + length]
+            offset += length
+            if method == self.DOD:
+                records[name] = self._decode_dod(payload, count)
+            elif method in (self.DELTA, self.INT_DELTA):
+                records[name] = self._decode_delta(payload, count)
+            elif method == self.XOR:
+                records[name] = self._decode_xor(payload, count)
+            else:
+                raise ValueError(f"未知的列编码方式: {method}")
+        return records
+
+    @staticmethod
+    def _is_integral(column):
+        return bool(np.all(np.isfinite(column)) and np.all(column == np.trunc(column))
+                    and np.all(np.abs(column) < 2 ** 53))
+
+    @staticmethod
+    def _encode_delta(column):
+        return _encode_varints(_zigzag(np.diff(column, prepend=0)))
+
+    @staticmethod
+    def _decode_delta(payload, count):
+        return np.cumsum(_unzigzag(_decode_varints(payload, count)))
+
+    @staticmethod
+    def _encode_dod(column):
+        # [t0, t1-t0, (t2-t1)-(t1-t0), ...]：采样间隔固定时几乎全是0，每个只占1字节
+        deltas = np.diff(column, prepend=0)
+        dod = np.concatenate((deltas[:2], np.diff(deltas[1:])))
+        return _encode_varints(_zigzag(dod))
+
+    @staticmethod
+    def _decode_dod(payload, count):
+        dod = _unzigzag(_decode_varints(payload, count))
+        deltas = np.concatenate((dod[:1], np.cumsum(dod[1:])))
+        return np.cumsum(deltas)
+
+    @staticmethod
+    def _byte_mask(header):
+        """由每个值的头字节（高4位前导零字节数，低4位尾随零字节数）得到有效字节掩码"""
+        leading = (header >> 4).astype(np.int64)
+        trailing = (header & 0x0f).astype(np.int64)
+        columns = np.arange(8)
+        return (columns >= leading[:, None]) & (columns < (8 - trailing)[:, None])
+
+    def _encode_xor(self, column):
+        bits = column.astype('<f8').view('<u8')
+        xored = bits ^ np.concatenate((np.zeros(1, dtype='<u8'), bits[:-1]))
+        as_bytes = xored.astype('>u8').view(np.uint8).reshape(-1, 8)  # 第0列为最高字节
+        nonzero = as_bytes != 0
+        any_set = nonzero.any(axis=1)
+        leading = np.where(any_set, nonzero.argmax(axis=1), 8)
+        trailing = np.where(any_set, nonzero[:, ::-1].argmax(axis=1), 0)
+        header = ((leading << 4) | trailing).astype(np.uint8)
+        return header.tobytes() + as_bytes[self._byte_mask(header)].tobytes()
+
+    def _decode_xor(self, payload, count):
+        header = np.frombuffer(payload, dtype=np.uint8, count=count)
+        mask = self._byte_mask(header)
+        as_bytes = np.zeros((count, 8), dtype=np.uint8)
+        as_bytes[mask] = np.frombuffer(payload, dtype=np.uint8, offset=count)
+        xored = as_bytes.view('>u8').reshape(count).astype('<u8')
+        return np.bitwise_xor.accumulate(xored).view('<f8')
+
+
+class SegmentStore:
+    """追加写的二进制分段存储
+
+    每个序列（如 default/raw）对应一个目录，目录下是若干分段文件，
+    文件名为该段第一条记录的epoch时间戳。记录定长且按时间递增，新记录
+    直接追加到未写满的末尾分段，写满后新建分段，每次提交的磁盘写入量只与
+    新记录数有关。内存中为每个序列维护有序的分段
+    起点数组，范围查询先用bisect定位分段，再在段内二分定位记录。
+    已读过的分段按 (inode, mtime, size) 校验缓存在内存中，未变化的分段
+    不会重复读盘。末尾分段保持定长格式便于追加，已封存的分段由后台压缩
+    线程用SegmentCodec重写为压缩格式，读取时按文件头自动识别。
+    """
+
+    def __init__(self, base_dir, dtype=RECORD_DTYPE, segment_max_records=1024, cache_max_bytes=64 * 1024 * 1024):
+        self.base_dir = base_dir
+        self.dtype = dtype
+        self.segment_max_records = segment_max_records
+        self.codec = SegmentCodec(dtype)
+        self._lock = threading.Lock()
+        self._last_ts = {}  # 序列 -> 最后一条记录的时间戳
+        self._starts = {}  # 序列 -> 有序的分段起点时间戳（分段索引）
+        self.cache_max_bytes = cache_max_bytes
+        self._cache = OrderedDict()  # 路径 -> (文件签名, 只读记录数组)，按最近使用排序
+        self._cache_bytes = 0
+        self._cache_lock = threading.Lock()
+        self.cache_stats = {'hits': 0, 'misses': 0, 'evictions': 0}
+
+    def series_dir(self, series):
+        """获取序列目录（服务器ID中的特殊字符替换为下划线，不允许跳出数据目录）"""
+        return _safe_join(self.base_dir, *series.split('/'))
+
+    def _segment_starts(self, series):
+        """获取序列的分段起点索引，首次访问时扫描目录建立"""
+        starts = self._starts.get(series)
+        if starts is None:
+            directory = self.series_dir(series)
+            starts = []
+            if os.path.isdir(directory):
+                starts = sorted(int(name.split('.')[0]) for name in os.listdir(directory) if name.endswith('.seg'))
+            self._starts[series] = starts
+        return starts
+
+    def _segment_path(self, series, start):
+        return os.path.join(self.series_dir(series), f"{start}.seg")
+
+    def list_segments(self, series):
+        """按时间顺序列出序列的所有分段文件"""
+        return [self._segment_path(series, start) for start in list(self._segment_starts(series))]
+
+    @staticmethod
+    def _file_signature(path):
+        """文件签名：rename会换inode，追加会改变大小和mtime"""
+        stat = os.stat(path)
+        return (stat.st_ino, stat.st_mtime_ns, stat.st_size)
+
+    def _read_segment(self, path):
+        """读取单个分段文件，忽略末尾不完整的记录；文件未变化时直接返回缓存"""
+        signature = self._file_signature(path)
+        with self._cache_lock:
+            entry = self._cache.get(path)
+            if entry and entry[0] == signature:
+                self._cache.move_to_end(path)
+                self.cache_stats['hits'] += 1
+                return entry[1]
+            self.cache_stats['misses'] += 1
+
+        with open(path, 'rb') as f:
+            raw = f.read()
+        if SegmentCodec.is_encoded(raw):
+            records = self.codec.decode(raw)
+            records.flags.writeable = False  # 缓存中的数组被多个读者共享
+        else:
+            usable = len(raw) - len(raw) % self.dtype.itemsize
+            records = np.frombuffer(raw[:usable], dtype=self.dtype)  # bytes上的视图，天然只读
+        self._cache_put(path, signature, records)
+        return records
+
+    def _cache_put(self, path, signature, records):
+        with self._cache_lock:
+            self._cache_discard_locked(path)
+            self._cache[path] = (signature, records)
+            self._cache_bytes += records.nbytes
+            while self._cache_bytes > self.cache_max_bytes and len(self._cache) > 1:
+                _, (_, evicted) = self._cache.popitem(last=False)
+                self._cache_bytes -= evicted.nbytes
+                self.cache_stats['evictions'] += 1
+
+    def _cache_discard_locked(self, path):
+        entry = self._cache.pop(path, None)
+        if entry:
+            self._cache_bytes -= entry[1].nbytes
+
+    def _remove_segment(self, path):
+        """删除分段文件并丢弃其缓存"""
+        os.remove(path)
+        with self._cache_lock:
+            self._cache_discard_locked(path)
+
+    def cache_info(self):
+        """分段读缓存统计"""
+        with self._cache_lock:
+            return dict(self.cache_stats, entries=len(self._cache), bytes=self._cache_bytes)
+
+    def last_ts(self, series):
+        """获取序列最后一条记录的时间戳，没有数据时返回None"""
+        if series not in self._last_ts:
+            last = None
+            segments = self.list_segments(series)
+            if segments:
+                records = self._read_segment(segments[-1])
+                if len(records):
+                    last = int(records['ts'][-1])
+            self._last_ts[series] = last
+        return self._last_ts[series]
+
+    def commit(self, series, records):
+        """提交一批记录，只接受比已有数据更新的时间戳，返回实际写入条数
+
+        新记录追加到未写满的末尾分段（见 _append），写满后新建分段；新分段
+        写入临时文件再rename。读者读到追加了一半的记录时会忽略它。
+        """
+        with self._lock:
+            last = self.last_ts(series)
+            if last is not None:
+                records = records[records['ts'] > last]
+            if not len(records):
+                return 0
+
+            os.makedirs(self.series_dir(series), exist_ok=True)
+            starts = self._segment_starts(series)
+
+            written = 0
+            while written < len(records):
+                tail = np.empty(0, dtype=self.dtype)
+                if starts:
+                    tail = self._read_segment(self._segment_path(series, starts[-1]))
+                room = self.segment_max_records - len(tail)
+                if room <= 0:
+                    tail = np.empty(0, dtype=self.dtype)
+                    room = self.segment_max_records
+
+                chunk = records[written:written + room]
+                if len(tail):
+                    self._append(self._segment_path(series, starts[-1]), tail, chunk)
+                else:
+                    start = int(chunk['ts'][0])
+                    self._write_atomic(self._segment_path(series, start), chunk)
+                    starts.append(start)
+                written += len(chunk)
+
+            self._last_ts[series] = int(records['ts'][-1])
+            return written
+
+    def _append(self, path, tail, chunk):
+        """把记录追加到末尾分段，tail 为该分段当前的记录
+
+        先截掉上次写入中断时可能残留的不完整记录，保证追加的记录对齐；
+        只有追加的字节需要写入和fsync。追加后的完整记录直接放入读缓存。
+        """
+        with open(path, 'r+b') as f:
+            f.truncate(len(tail) * self.dtype.itemsize)
+            f.seek(0, os.SEEK_END)
+            f.write(chunk.tobytes())
+            f.flush()
+            os.fsync(f.fileno())
+        merged = np.concatenate((tail, chunk))
+        merged.flags.writeable = False
+        self._cache_put(path, self._file_signature(path), merged)
+
+    def _write_atomic(self, path, records, encode=False):
+        """写临时文件后rename，保证分段文件要么是旧内容要么是新内容
+
+        encode=True 时以压缩格式写入（仅用于已封存的分段）。写入的内容直接
+        放入读缓存，下一次读取（包括下次提交读取末尾分段）不必读盘。
+        """
+        tmp_path = f"{path}.tmp"
+        if encode:
+            data = self.codec.encode(records)
+            cached = np.array(records)
+            cached.flags.writeable = False
+        else:
+            data = records.tobytes()
+            cached = np.frombuffer(data, dtype=self.dtype)
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+        self._cache_put(path, self._file_signature(path), cached)
+
+    def read(self, series):
+        """顺序读取序列的全部记录"""
+        chunks = [self._read_segment(path) for path in self.list_segments(series)]
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def read_range(self, series, start_ts, end_ts):
+        """读取 [start_ts, end_ts] 内的记录
+
+        分段i的记录都早于分段i+1的起点，因此用bisect在分段索引上定位
+        第一个和最后一个相关分段，段内再用二分查找截取，不做全量过滤。
+        """
+        chunks = list(self.iter_range(series, start_ts, end_ts))
+        if not chunks:
+            return np.empty(0, dtype=self.dtype)
+        return np.concatenate(chunks)
+
+    def iter_range(self, series, start_ts, end_ts):
+        """逐个分段产出 [start_ts, end_ts] 内的记录，供流式读取使用"""
+        starts = list(self._segment_starts(series))
+        first = max(bisect.bisect_right(starts, start_ts) - 1, 0)
+        last = bisect.bisect_right(starts, end_ts)
+
+        for i in range(first, last):
+            start = starts[i]
+            # 以快照中下一分段的起点为上界，分段被并发合并时也不会重复产出记录
+            upper = end_ts if i + 1 >= len(starts) else min(end_ts, starts[i + 1] - 1)
+            try:
+                records = self._read_segment(self._segment_path(series, start))
+            except FileNotFoundError:
+                # 分段刚被后台压缩合并进前一段或因过期删除：按最新索引找到包含它的分段
+                records = self._read_containing_segment(series, start)
+            lo = np.searchsorted(records['ts'], max(start_ts, start), side='left')
+            hi = np.searchsorted(records['ts'], upper, side='right')
+            if hi > lo:
+                yield records[lo:hi]
+
+    def _read_containing_segment(self, series, ts):
+        """按最新索引读取包含时间戳ts的分段"""
+        starts = list(self._segment_starts(series))
+        index = bisect.bisect_right(starts, ts) - 1
+        if index < 0:
+            return np.empty(0, dtype=self.dtype)
+        try:
+            return self._read_segment(self._segment_path(series, starts[index]))
+        except FileNotFoundError:
+            return np.empty(0, dtype=self.dtype)
+
+    def _segment_count(self, path):
+        """分段的记录数：压缩分段读文件头，原始分段按文件大小计算，都不需要解码"""
+        with open(path, 'rb') as f:
+            header = f.read(SegmentCodec.HEADER_SIZE)
+        if SegmentCodec.is_encoded(header):
+            return SegmentCodec.record_count(header)
+        return os.path.getsize(path) // self.dtype.itemsize
+
+    def merge_small(self, series, target_records):
+        """把相邻的已封存分段合并为不超过target_records条记录的大分段
+
+        末尾分段正在被写线程追加，不参与合并；合并结果先写临时文件再rename
+        覆盖组内第一个分段，之后才在锁内更新索引并删除其余分段，读者始终能
+        读到完整数据。合并结果以压缩格式写入。返回 (删除的分段数, 释放的字节数)。
+        """
+        starts = list(self._segment_starts(series))[:-1]
+        groups, group, group_records = [], [], 0
+        for start in starts:
+            try:
+                count = self._segment_count(self._segment_path(series, start))
+            except FileNotFoundError:
+                continue  # 分段已被删除
+            if group and group_records + count > target_records:
+                groups.append(group)
+                group, group_records = [], 0
+            group.append(start)
+            group_records += count
+        if group:
+            groups.append(group)
+
+        removed = 0
+        reclaimed = 0
+        for group in groups:
+            if len(group) < 2:
+                continue
+            paths = [self._segment_path(series, start) for start in group]
+            before = sum(os.path.getsize(path) for path in paths)
+            merged = np.concatenate([self._read_segment(path) for path in paths])
+            self._write_atomic(paths[0], merged, encode=True)
+            with self._lock:
+                index = self._segment_starts(series)
+                for start, path in zip(group[1:], paths[1:]):
+                    index.remove(start)
+                    self._remove_segment(path)
+            removed += len(group) - 1
+            reclaimed += before - os.path.getsize(paths[0])
+        return removed, reclaimed
+
+    def compress_sealed(self, series):
+        """把尚未压缩的已封存分段重写为压缩格式，返回 (压缩的分段数, 释放的字节数)"""
+        compressed = 0
+        reclaimed = 0
+        for start in list(self._segment_starts(series))[:-1]:
+            path = self._segment_path(series, start)
+            try:
+                with open(path, 'rb') as f:
+                    if SegmentCodec.is_encoded(f.read(len(SegmentCodec.MAGIC))):
+                        continue
+                before = os.path.getsize(path)
+                self._write_atomic(path, self._read_segment(path), encode=True)
+            except FileNotFoundError:
+                continue  # 分段已被删除
+            compressed += 1
+            reclaimed += before - os.path.getsize(path)
+        return compressed, reclaimed
+
+    def drop_before(self, series, cutoff_ts):
+        """删除所有记录都早于cutoff_ts的分段，返回 (释放的字节数, 删除的分段数)
+
+        分段i的全部记录都早于分段i+1的起点，因此只看文件名即可判断，
+        末尾分段永远保留。
+        """
+        with self._lock:
+            starts = self._segment_starts(series)
+            # 起点 <= cutoff_ts 的最后一个分段之前的分段都可以删除
+            expired = max(bisect.bisect_right(starts, cutoff_ts) - 1, 0)
+            reclaimed = 0
+            for start in starts[:expired]:
+                path = self._segment_path(series, start)
+                reclaimed += os.path.getsize(path)
+                self._remove_segment(path)
+            del starts[:expired]
+            return reclaimed, expired
+
+
+class WriteBehindQueue:
+    """后台写入队列
+
+    请求线程只负责把待写数据放入有界队列，独立的写线程每个刷新周期
+    把期间积累的所有数据合并成一次提交（group commit），磁盘延迟不再
+    影响API响应。队列满时丢弃新数据并计数，绝不阻塞调用方。
+    """
+
+    def __init__(self, commit_fn, max_pending=10000, flush_interval=2.0, name='persistence-writer'):
+        self.commit_fn = commit_fn  # commit_fn(items): 批量提交一组数据
+        self.flush_interval = flush_interval
+        self.name = name
+        self._queue = queue.Queue(maxsize=max_pending)
+        self._thread = None
+        self._thread_lock = threading.Lock()
+        self._running = False
+        self.stats = {'enqueued': 0, 'dropped': 0, 'commits': 0, 'committed_items': 0, 'errors': 0}
+
+    def start(self):
+        """启动写线程（已在运行时直接返回）"""
+        with self._thread_lock:
+            if self._thread and self._thread.is_alive():
+                return
+            self._running = True
+            self._thread = threading.Thread(target=self._worker, name=self.name, daemon=True)
+            self._thread.start()
+
+    def put(self, item):
+        """非阻塞入队，成功返回True"""
+        self.start()
+        try:
+            self._queue.put_nowait(item)
+            self.stats['enqueued'] += 1
+            return True
+        except queue.Full:
+            self.stats['dropped'] += 1
+            print(f"⚠️  写入队列已满，丢弃数据 (累计 {self.stats['dropped']} 条)")
+            return False
+
+    def _worker(self):
+        """写线程：取到第一条数据后等待一个刷新周期，再整批提交"""
+        while self._running or not self._queue.empty():
+            try:
+                first = self._queue.get(timeout=0.5)
+            except queue.Empty:
+                continue
+
+            batch = [first]
+            deadline = time.monotonic() + self.flush_interval
+            while self._running:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(self._queue.get(timeout=remaining))
+                except queue.Empty:
+                    break
+            # 停止时（或周期结束时）把已经排队的数据一并带走
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+
+            self._commit(batch)
+
+    def _commit(self, batch):
+        try:
+            self.commit_fn(batch)
+            self.stats['commits'] += 1
+            self.stats['committed_items'] += len(batch)
+        except Exception as e:
+            self.stats['errors'] += 1
+            print(f"❌ 批量写入失败: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+    def flush(self):
+        """阻塞直到当前排队的数据全部提交"""
+        if self._thread and self._thread.is_alive():
+            self._queue.join()
+
+    def stop(self, timeout=10):
+        """停止写线程，退出前会提交所有剩余数据"""
+        self._running = False
+        if self._thread:
+            self._thread.join(timeout=timeout)
+        if not self._queue.empty():
+            # 写线程没能及时退出时，由调用线程兜底提交
+            batch = []
+            while True:
+                try:
+                    batch.append(self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            if batch:
+                self._commit(batch)
+
+
+class RollupAggregator:
+    """写入时增量维护的降采样层级
+
+    每个 (服务器, 层级) 维护一个尚未结束的时间桶，记录桶内各指标的
+    min/max/sum/last；新数据落到下一个桶时，旧桶结束并作为一行
+    汇总数据输出，由持久化层写入对应层级的存储。
+    """
+
+    def __init__(self, tiers=ROLLUP_TIERS):
+        self.tiers = tiers
+        self._open = {}  # (server_id, 层级名) -> 未结束的桶
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def _to_row(bucket):
+        """把内部桶状态转换为一行ROLLUP_DTYPE记录"""
+        row = np.zeros(1, dtype=ROLLUP_DTYPE)
+        row['ts'] = bucket['ts']
+        row['count'] = bucket['count']
+        for i, field in enumerate(HISTORY_FIELDS):
+            row[f'{field}_min'] = bucket['min'][i]
+            row[f'{field}_max'] = bucket['max'][i]
+            row[f'{field}_avg'] = bucket['sum'][i] / bucket['count']
+            row[f'{field}_last'] = bucket['last'][i]
+        return row
+
+    def ingest(self, server_id, records, since=None):
+        """送入一批按时间递增的原始记录，返回 {层级名: 已结束的汇总行数组}
+
+        since 可按层级指定只聚合时间戳不早于该值的记录（重启后补齐汇总时使用）。
+        """
+        if not len(records):
+            return {}
+        all_values = np.column_stack([records[field] for field in HISTORY_FIELDS])
+        closed = {}
+
+        with self._lock:
+            for name, width, _ in self.tiers:
+                key = (server_id, name)
+                bucket = self._open.get(key)
+                offset = 0
+                if since and name in since:
+                    offset = int(np.searchsorted(records['ts'], since[name]))
+                timestamps = records['ts'][offset:]
+                values = all_values[offset:]
+                if not len(timestamps):
+                    continue
+                starts = timestamps - timestamps % width
+                boundaries = np.flatnonzero(np.diff(starts)) + 1
+                rows = []
+
+                for begin, end in zip(np.concatenate(([0], boundaries)), np.append(boundaries, len(timestamps))):
+                    chunk = values[begin:end]
+                    start = int(starts[begin])
+                    if bucket is not None and bucket['ts'] != start:
+                        rows.append(self._to_row(bucket))
+                        bucket = None
+                    if bucket is None:
+                        bucket = {
+                            'ts': start,
+                            'count': len(chunk),
+                            'min': chunk.min(axis=0),
+                            'max': chunk.max(axis=0),
+                            'sum': chunk.sum(axis=0),
+                            'last': chunk[-1].copy(),
+                        }
+                    else:
+                        bucket['count'] += len(chunk)
+                        bucket['min'] = np.minimum(bucket['min'], chunk.min(axis=0))
+                        bucket['max'] = np.maximum(bucket['max'], chunk.max(axis=0))
+                        bucket['sum'] = bucket['sum'] + chunk.sum(axis=0)
+                        bucket['last'] = chunk[-1].copy()
+
+                self._open[key] = bucket
+                if rows:
+                    closed[name] = np.concatenate(rows)
+        return closed
+
+    def snapshot(self, server_id, tier_name):
+        """获取当前未结束桶的汇总行（查询时补上最新一段），没有时返回None"""
+        with self._lock:
+            bucket = self._open.get((server_id, tier_name))
+            return self._to_row(bucket) if bucket else None
+
+
+class RingBufferFile:
+    """内存映射的定长环形缓冲文件（每个服务器一个，保存最近N小时的热数据）
+
+    文件布局: 64字节文件头（魔数、版本、容量、写游标、记录数）+ 按列存放的
+    int64时间戳列和各指标的float64列。写一个样本只是在映射内存中就地赋值，
+    文件大小与运行时长无关。
+
+    写满后新记录会覆盖最旧的记录，一批跨越环尾的写入期间，读者可能看到
+    顺序错乱或写了一半的记录，因此读取与写入共用一把锁：读者在锁内定位
+    切片并复制出来，锁外只持有副本。
+    """
+
+    MAGIC = b'HRNG'
+    VERSION = 1
+    HEADER = struct.Struct('<4sIQQQ')  # 魔数, 版本, 容量, 写游标, 记录数
+    HEADER_SIZE = 64
+
+    def __init__(self, path, capacity, fields=HISTORY_FIELDS):
+        self.path = path
+        self.capacity = capacity
+        self.fields = fields
+        self._lock = threading.Lock()
+        size = self.HEADER_SIZE + capacity * 8 * (len(fields) + 1)
+
+        fresh = True
+        if os.path.exists(path) and os.path.getsize(path) == size:
+            with open(path, 'rb') as f:
+                magic, version, stored_capacity, _, _ = self.HEADER.unpack(f.read(self.HEADER.size))
+            fresh = not (magic == self.MAGIC and version == self.VERSION and stored_capacity == capacity)
+        if fresh:
+            # 新建或容量变化：重建文件（热数据在分段存储中仍有一份）
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            with open(path, 'wb') as f:
+                f.write(self.HEADER.pack(self.MAGIC, self.VERSION, capacity, 0, 0).ljust(self.HEADER_SIZE, b'\0'))
+                f.truncate(size)
+
+        self._file = open(path, 'r+b')
+        self._map = mmap.mmap(self._file.fileno(), size)
+        offset = self.HEADER_SIZE
+        self.ts = np.ndarray((capacity,), dtype='<i8', buffer=self._map, offset=offset)
+        self.columns = {}
+        for field in fields:
+            offset += capacity * 8
+            self.columns[field] = np.ndarray((capacity,), dtype='<f8', buffer=self._map, offset=offset)
+
+    def _header(self):
+        _, _, _, cursor, count = self.HEADER.unpack_from(self._map, 0)
+        return cursor, count
+
+    def last_ts(self):
+        with self._lock:
+            cursor, count = self._header()
+            return int(self.ts[(cursor - 1) % self.capacity]) if count else None
+
+    def append(self, records):
+        """就地写入一批按时间递增的记录（旧于最后一条的记录被忽略）"""
+        with self._lock:
+            cursor, count = self._header()
+            last = int(self.ts[(cursor - 1) % self.capacity]) if count else None
+            if last is not None:
+                records = records[records['ts'] > last]
+            for record in records[-self.capacity:]:
+                self.ts[cursor] = record['ts']
+                for field in self.fields:
+                    self.columns[field][cursor] = record[field]
+                cursor = (cursor + 1) % self.capacity
+                count = min(count + 1, self.capacity)
+            # 数据写完后再更新文件头，读者不会看到未写完的新记录
+            self.HEADER.pack_into(self._map, 0, self.MAGIC, self.VERSION, self.capacity, cursor, count)
+
+    def _views_locked(self):
+        """按时间顺序返回视图片段列表 [(ts视图, {字段: 视图}), ...]，须在锁内调用且不能带出锁外
+
+        缓冲区写满后分为两段：从游标（最旧记录，下一条要覆盖的位置）到环尾，
+        以及环头到游标之前的新数据，共 capacity 条。写入也持有同一把锁，
+        读者不会看到正在被覆盖的游标处记录，因此不需要跳过它。视图只在锁内
+        使用，对外返回的都是复制出来的数组，不再把映射区的零拷贝视图交给调用方。
+        """
+        cursor, count = self._header()
+        if count < self.capacity:
+            spans = [(0, count)]
+        else:
+            spans = [(cursor, self.capacity), (0, cursor)]
+        return [
+            (self.ts[lo:hi], {field: column[lo:hi] for field, column in self.columns.items()})
+            for lo, hi in spans if hi > lo
+        ]
+
+    def oldest_ts(self):
+        with self._lock:
+            views = self._views_locked()
+            return int(views[0][0][0]) if views else None
+
+    def read_range(self, start_ts, end_ts, fields=None):
+        """读取时间范围内的记录（只复制命中的切片）"""
+        fields = fields or self.fields
+        dtype = [('ts', '<i8')] + [(field, '<f8') for field in fields]
+        chunks = []
+        with self._lock:
+            for ts, columns in self._views_locked():
+                lo = np.searchsorted(ts, start_ts, side='left')
+                hi = np.searchsorted(ts, end_ts, side='right')
+                if hi > lo:
+                    chunk = np.empty(hi - lo, dtype=dtype)
+                    chunk['ts'] = ts[lo:hi]
+                    for field in fields:
+                        chunk[field] = columns[field][lo:hi]
+                    chunks.append(chunk)
+        return np.concatenate(chunks) if chunks else np.empty(0, dtype=dtype)
+
+    def close(self):
+        with self._lock:
+            try:
+                self._map.flush()
+                self._map.close()
+            except BufferError:
+                pass  # self.ts/self.columns 仍引用映射区，映射会在对象释放后回收
+            self._file.close()
+
+
+class HotRingBuffers:
+    """管理每个服务器的热数据环形缓冲文件"""
+
+    def __init__(self, data_dir, hours=6, resolution_seconds=1):
+        self.data_dir = data_dir
+        self.capacity = int(hours * 3600 / resolution_seconds)
+        self._rings = {}
+        self._lock = threading.Lock()
+
+    def get(self, server_id, create=False):
+        ring = self._rings.get(server_id)
+        if ring is None:
+            path = _safe_join(self.data_dir, server_id, 'hot.ring')
+            if not create and not os.path.exists(path):
+                return None
+            with self._lock:
+                ring = self._rings.get(server_id)
+                if ring is None:
+                    ring = RingBufferFile(path, self.capacity)
+                    self._rings[server_id] = ring
+        return ring
+
+    def append(self, server_id, records):
+        self.get(server_id, create=True).append(records)
+
+    def covers(self, server_id, start_ts):
+        """环形缓冲是否包含从start_ts开始的全部数据"""
+        ring = self.get(server_id)
+        oldest = ring.oldest_ts() if ring else None
+        return oldest is not None and oldest <= start_ts
+
+    def close(self):
+        with self._lock:
+            for ring in self._rings.values():
+                ring.close()
+            self._rings.clear()
+
+
+class RetentionPolicy:
+    """数据保留策略：每个层级一个默认保留时长，可按服务器单独覆盖
+
+    服务器配置中的 retention 字段形如 {"raw": "72h", "1m": "30d"}。
+    """
+
+    TIERS = ('raw',) + tuple(name for name, _, _ in ROLLUP_TIERS)
+
+    def __init__(self, defaults=None):
+        self.defaults = {'raw': RAW_RETENTION_SECONDS}
+        self.defaults.update({name: retention for name, _, retention in ROLLUP_TIERS})
+        self.defaults.update(defaults or {})
+        self._overrides = {}  # server_id -> {层级: 秒}
+
+    @staticmethod
+    def parse_duration(value):
+        """把 3600 / '3600s' / '90m' / '48h' / '30d' 转换为秒数"""
+        if isinstance(value, (int, float)):
+            return int(value)
+        match = re.fullmatch(r'\s*(\d+)\s*([smhd]?)\s*', str(value))
+        if not match:
+            raise ValueError(f"无法解析的时长: {value}")
+        units = {'': 1, 's': 1, 'm': 60, 'h': 3600, 'd': 86400}
+        return int(match.group(1)) * units[match.group(2)]
+
+    def set_server_policy(self, server_id, policy):
+        """设置某个服务器的保留期覆盖，未知层级抛出ValueError"""
+        parsed = {}
+        for tier, value in (policy or {}).items():
+            if tier not in self.TIERS:
+                raise ValueError(f"未知的数据层级: {tier}")
+            parsed[tier] = self.parse_duration(value)
+        if parsed:
+            self._overrides[server_id] = parsed
+        else:
+            self._overrides.pop(server_id, None)
+
+    def clear_server_policy(self, server_id):
+        self._overrides.pop(server_id, None)
+
+    def window(self, server_id, tier):
+        """获取某服务器某层级的保留时长（秒）"""
+        return self._overrides.get(server_id, {}).get(tier, self.defaults[tier])
+
+    def cutoff(self, server_id, tier, now):
+        return now - self.window(server_id, tier)
+
+
+class BackgroundCompactor:
+    """后台压缩线程
+
+    定期按保留策略删除过期数据并合并小分段。写线程只追加末尾分段，
+    压缩只处理已封存的分段，读者按分段索引读取，三者互不阻塞。
+    """
+
+    def __init__(self, persistence, interval=300):
+        self.persistence = persistence
+        self.interval = interval
+        self._stop_event = threading.Event()
+        self._thread = None
+        self.stats = {
+            'runs': 0,
+            'bytes_reclaimed': 0,
+            'segments_dropped': 0,
+            'segments_merged': 0,
+            'segments_compressed': 0,
+            'last_run': None,
+            'last_duration': 0.0,
+            'last_result': {},
+        }
+
+    def start(self):
+        if self._thread and self._thread.is_alive():
+            return
+        self._stop_event.clear()
+        self._thread = threading.Thread(target=self._worker, name='history-compactor', daemon=True)
+        self._thread.start()
+
+    def stop(self, timeout=10):
+        self._stop_event.set()
+        if self._thread:
+            self._thread.join(timeout=timeout)
+
+    def _worker(self):
+        while not self._stop_event.wait(self.interval):
+            self.run_once()
+
+    def run_once(self):
+        """执行一轮压缩，返回本轮结果"""
+        started = time.monotonic()
+        try:
+            result = self.persistence.compact()
+        except Exception as e:
+            print(f"❌ 历史数据压缩失败: {e}")
+            return None
+
+        self.stats['runs'] += 1
+        self.stats['bytes_reclaimed'] += result['bytes_reclaimed']
+        self.stats['segments_dropped'] += result['segments_dropped']
+        self.stats['segments_merged'] += result['segments_merged']
+        self.stats['segments_compressed'] += result.get('segments_compressed', 0)
+        self.stats['last_run'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.stats['last_duration'] = round(time.monotonic() - started, 3)
+        self.stats['last_result'] = result
+        if 'rows_deleted' in result:
+            removed = f"删除 {result['rows_deleted']} 行过期数据"
+        else:
+            removed = (f"删除 {result['segments_dropped']} 个过期分段, 合并 {result['segments_merged']} 个小分段, "
+                       f"压缩 {result['segments_compressed']} 个分段")
+        if any(result.values()):
+            print(f"🧹 历史数据压缩完成: {removed}, 释放 {result['bytes_reclaimed'] / 1024:.1f}KB")
+        return result
+
+
 class HistoricalDataPersistence:
     """历史数据持久化管理类"""
 
     def __init__(self, data_dir='historical_data'):
         self.data_dir = data_dir
         self.ensure_data_dir()
+        self.store = SegmentStore(data_dir)
+        self.rollup_store = SegmentStore(data_dir, dtype=ROLLUP_DTYPE)
+        self.device_stores = {kind: SegmentStore(data_dir, dtype=dtype) for kind, dtype in DEVICE_DTYPES.items()}
+        self._init_rollups()
+        self.writer = WriteBehindQueue(self._commit_batch)  # 后台批量写入
+        self.migrate_legacy_files()
+
+    def _init_rollups(self):
+        """初始化热数据环形缓冲、降采样层级与保留期状态"""
+        self.hot = HotRingBuffers(self.data_dir)  # 最近6小时的逐秒热数据
+        self.rollups = RollupAggregator()
+        self.min_tier_points_ratio = 0.5  # 层级至少要能提供 max_points 的一半数据点
+        self.merge_target_records = 8192  # 压缩时把已封存分段合并到的目标大小
+        self.retention = RetentionPolicy()
+        self.compactor = BackgroundCompactor(self)  # 过期清理与分段合并在后台线程进行
+        self.compactor.start()
+        self._seeded_servers = set()
 
     def ensure_data_dir(self):
         """确保数据目录存在"""
@@ -37,206 +1116,658 @@ class HistoricalDataPersistence:
             print(f"📁 创建历史数据目录: {self.data_dir}")
 
     def get_file_path(self, server_id, metric_type):
-        """获取指定服务器和指标类型的文件路径"""
+        """获取旧版JSON文本文件路径（仅用于迁移）"""
         filename = f"{server_id}_{metric_type}.txt"
         return os.path.join(self.data_dir, filename)
 
+    @staticmethod
+    def _series(server_id, tier='raw'):
+        return f"{server_id}/{tier}"
+
+    @staticmethod
+    def _device_series(server_id, kind, device):
+        return f"{server_id}/{kind}/{device}"
+
+    def _build_records(self, timestamps, columns):
+        """把时间戳列表和指标列构建为结构化记录数组"""
+        records = np.zeros(len(timestamps), dtype=RECORD_DTYPE)
+        reference = datetime.now()
+        records['ts'] = [_to_epoch(ts, reference) for ts in timestamps]
+        for field, values in columns.items():
+            if values is not None:
+                records[field] = values
+        # 同一批内保证时间戳递增，重复时间戳只保留第一条
+        records = records[np.argsort(records['ts'], kind='stable')]
+        if len(records):
+            keep = np.concatenate(([True], np.diff(records['ts']) > 0))
+            records = records[keep]
+        return records
+
     def save_historical_data(self, server_id, historical_data):
-        """保存历史数据到文件（追加模式）"""
+        """保存历史数据到文件（追加模式），成功放入写入队列时返回True"""
         try:
-            # 保存CPU数据
-            self._append_metric_data(server_id, 'cpu', historical_data['timestamps'], historical_data['cpu'])
-
-            # 保存内存数据
-            self._append_metric_data(server_id, 'memory', historical_data['timestamps'], historical_data['memory'])
-
-            # 保存磁盘IO数据
-            self._append_disk_io_data(server_id, historical_data['timestamps'],
-                                    historical_data['disk_read'], historical_data['disk_write'])
-
-            # 保存网络数据
-            self._append_network_data(server_id, historical_data['timestamps'],
-                                    historical_data['network_sent'], historical_data['network_recv'])
-
-            print(f"💾 历史数据已追加保存到文件: {server_id}")
+            columns = {field: historical_data.get(field) for field in HISTORY_FIELDS}
+            records = self._build_records(historical_data['timestamps'], columns)
+            return self.writer.put((server_id, records))
 
         except Exception as e:
             print(f"❌ 保存历史数据失败: {e}")
+            return False
 
-    def _append_metric_data(self, server_id, metric_type, timestamps, values):
-        """追加单一指标数据（CPU或内存）"""
-        file_path = self.get_file_path(server_id, metric_type)
-
-        # 加载现有数据
-        existing_data = {'timestamps': [], 'values': []}
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except:
-                pass  # 如果文件损坏，从空数据开始
-
-        # 合并数据（避免重复时间戳）
-        existing_timestamps = set(existing_data.get('timestamps', []))
-        for i, timestamp in enumerate(timestamps):
-            if timestamp not in existing_timestamps:
-                existing_data['timestamps'].append(timestamp)
-                existing_data['values'].append(values[i])
-
-        # 限制数据点数量（保留最新的1000个数据点）
-        max_points = 1000
-        if len(existing_data['timestamps']) > max_points:
-            existing_data['timestamps'] = existing_data['timestamps'][-max_points:]
-            existing_data['values'] = existing_data['values'][-max_points:]
-
-        # 保存更新后的数据
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
-
-    def _append_disk_io_data(self, server_id, timestamps, disk_read, disk_write):
-        """追加磁盘IO数据"""
-        file_path = self.get_file_path(server_id, 'disk_io')
-
-        # 加载现有数据
-        existing_data = {'timestamps': [], 'disk_read': [], 'disk_write': []}
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except:
-                pass
-
-        # 合并数据
-        existing_timestamps = set(existing_data.get('timestamps', []))
-        for i, timestamp in enumerate(timestamps):
-            if timestamp not in existing_timestamps:
-                existing_data['timestamps'].append(timestamp)
-                existing_data['disk_read'].append(disk_read[i])
-                existing_data['disk_write'].append(disk_write[i])
-
-        # 限制数据点数量
-        max_points = 1000
-        if len(existing_data['timestamps']) > max_points:
-            existing_data['timestamps'] = existing_data['timestamps'][-max_points:]
-            existing_data['disk_read'] = existing_data['disk_read'][-max_points:]
-            existing_data['disk_write'] = existing_data['disk_write'][-max_points:]
-
-        # 保存更新后的数据
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
-
-    def _append_network_data(self, server_id, timestamps, network_sent, network_recv):
-        """追加网络数据"""
-        file_path = self.get_file_path(server_id, 'network')
-
-        # 加载现有数据
-        existing_data = {'timestamps': [], 'network_sent': [], 'network_recv': []}
-        if os.path.exists(file_path):
-            try:
-                with open(file_path, 'r', encoding='utf-8') as f:
-                    existing_data = json.load(f)
-            except:
-                pass
-
-        # 合并数据
-        existing_timestamps = set(existing_data.get('timestamps', []))
-        for i, timestamp in enumerate(timestamps):
-            if timestamp not in existing_timestamps:
-                existing_data['timestamps'].append(timestamp)
-                existing_data['network_sent'].append(network_sent[i])
-                existing_data['network_recv'].append(network_recv[i])
-
-        # 限制数据点数量
-        max_points = 1000
-        if len(existing_data['timestamps']) > max_points:
-            existing_data['timestamps'] = existing_data['timestamps'][-max_points:]
-            existing_data['network_sent'] = existing_data['network_sent'][-max_points:]
-            existing_data['network_recv'] = existing_data['network_recv'][-max_points:]
-
-        # 保存更新后的数据
-        with open(file_path, 'w', encoding='utf-8') as f:
-            json.dump(existing_data, f, ensure_ascii=False, indent=2)
-
-    def append_realtime_data(self, server_id, timestamp, cpu, memory, disk_read, disk_write, network_sent, network_recv):
+    def append_realtime_data(self, server_id, timestamp, cpu, memory, disk_read, disk_write, network_sent, network_recv, load_avg=0.0):
         """追加单个实时数据点"""
         try:
-            # 追加CPU数据
-            self._append_metric_data(server_id, 'cpu', [timestamp], [cpu])
+            columns = {
+                'cpu': [cpu], 'memory': [memory],
+                'disk_read': [disk_read], 'disk_write': [disk_write],
+                'network_sent': [network_sent], 'network_recv': [network_recv],
+                'load_avg': [load_avg],
+            }
+            records = self._build_records([timestamp], columns)
+            self.writer.put((server_id, records))
 
-            # 追加内存数据
-            self._append_metric_data(server_id, 'memory', [timestamp], [memory])
+        except Exception as e:
+            print(f"❌ 追加实时数据失败: {e}")
 
-            # 追加磁盘IO数据
-            self._append_disk_io_data(server_id, [timestamp], [disk_read], [disk_write])
+    def append_device_metrics(self, server_id, kind, timestamp, devices):
+        """追加一次分设备采样，devices为 设备名 -> {字段: 值}，每个设备一条序列"""
+        try:
+            epoch = _to_epoch(timestamp)
+            for device, values in devices.items():
+                records = np.zeros(1, dtype=DEVICE_DTYPES[kind])
+                records['ts'] = epoch
+                for field in DEVICE_FIELDS[kind]:
+                    records[field] = values.get(field, 0.0)
+                self.writer.put(((server_id, kind, device), records))
 
-            # 追加网络数据
-            self._append_network_data(server_id, [timestamp], [network_sent], [network_recv])
+        except Exception as e:
+            print(f"❌ 追加分设备数据失败: {e}")
+
+    @staticmethod
+    def _group_batch(items):
+        """把写入队列中的数据按服务器（分设备数据按 (服务器, 类别, 设备)）合并、排序并去重"""
+        grouped = {}
+        for server_id, records in items:
+            grouped.setdefault(server_id, []).append(records)
+
+        for server_id, chunks in grouped.items():
+            records = np.concatenate(chunks)
+            records = records[np.argsort(records['ts'], kind='stable')]
+            grouped[server_id] = records[np.concatenate(([True], np.diff(records['ts']) > 0))]
+        return grouped
+
+    # ---- 存储相关的钩子，SQLite后端覆盖这些方法 ----
+
+    def _commit_records(self, server_id, records):
+        """把一个服务器的原始记录写入存储，返回实际写入的记录"""
+        written = self.store.commit(self._series(server_id), records)
+        return records[len(records) - written:]
+
+    def _commit_rollups(self, server_id, tier_name, rows):
+        """写入某一层级已结束的汇总行"""
+        self.rollup_store.commit(self._series(server_id, tier_name), rows)
+
+    def _read_raw_records(self, server_id, start_ts, end_ts):
+        """读取时间范围内的原始记录（RECORD_DTYPE数组）"""
+        return self.store.read_range(self._series(server_id), start_ts, end_ts)
+
+    def _read_rollups(self, server_id, tier_name, start_ts, end_ts):
+        """读取时间范围内某一层级的汇总行（ROLLUP_DTYPE数组）"""
+        return self.rollup_store.read_range(self._series(server_id, tier_name), start_ts, end_ts)
+
+    def _last_rollup_ts(self, server_id, tier_name):
+        return self.rollup_store.last_ts(self._series(server_id, tier_name))
+
+    def _commit_device_records(self, server_id, kind, device, records):
+        """写入一个设备的分设备记录，返回实际写入条数"""
+        return self.device_stores[kind].commit(self._device_series(server_id, kind, device), records)
+
+    def _read_device_records(self, server_id, kind, device, start_ts, end_ts):
+        return self.device_stores[kind].read_range(self._device_series(server_id, kind, device), start_ts, end_ts)
+
+    def list_devices(self, server_id, kind):
+        """列出服务器在存储中有分设备数据的设备"""
+        directory = self.device_stores[kind].series_dir(f"{server_id}/{kind}")
+        if not os.path.isdir(directory):
+            return []
+        return sorted(name for name in os.listdir(directory) if os.path.isdir(os.path.join(directory, name)))
+
+    def list_servers(self):
+        """列出存储中有数据的服务器"""
+        return sorted(
+            name for name in os.listdir(self.data_dir)
+            if os.path.isdir(os.path.join(self.data_dir, name, 'raw'))
+        )
+
+    def compact_server(self, server_id, now):
+        """按保留策略删除一个服务器的过期分段，合并小分段并压缩已封存分段"""
+        result = {'bytes_reclaimed': 0, 'segments_dropped': 0, 'segments_merged': 0, 'segments_compressed': 0}
+        for tier in RetentionPolicy.TIERS:
+            store = self.store if tier == 'raw' else self.rollup_store
+            series = self._series(server_id, tier)
+            reclaimed, dropped = store.drop_before(series, self.retention.cutoff(server_id, tier, now))
+            merged, merge_reclaimed = store.merge_small(series, self.merge_target_records)
+            compressed, compress_reclaimed = store.compress_sealed(series)
+            result['bytes_reclaimed'] += reclaimed + merge_reclaimed + compress_reclaimed
+            result['segments_dropped'] += dropped
+            result['segments_merged'] += merged
+            result['segments_compressed'] += compressed
+
+        # 分设备序列只有原始分辨率，按raw保留期清理
+        raw_cutoff = self.retention.cutoff(server_id, 'raw', now)
+        for kind, store in self.device_stores.items():
+            for device in self.list_devices(server_id, kind):
+                series = self._device_series(server_id, kind, device)
+                reclaimed, dropped = store.drop_before(series, raw_cutoff)
+                merged, merge_reclaimed = store.merge_small(series, self.merge_target_records)
+                compressed, compress_reclaimed = store.compress_sealed(series)
+                result['bytes_reclaimed'] += reclaimed + merge_reclaimed + compress_reclaimed
+                result['segments_dropped'] += dropped
+                result['segments_merged'] += merged
+                result['segments_compressed'] += compressed
+        return result
 
-            print(f"📊 实时数据已追加: {server_id} @ {timestamp}")
+    def compact(self, now=None):
+        """对所有服务器执行一轮保留期清理和压缩（由BackgroundCompactor调用）"""
+        now = now or int(time.time())
+        total = {'bytes_reclaimed': 0, 'segments_dropped': 0, 'segments_merged': 0}
+        for server_id in self.list_servers():
+            result = self.compact_server(server_id, now)
+            for key, value in result.items():
+                total[key] = total.get(key, 0) + value
+        return total
+
+    # ---- 读缓存 ----
+
+    def read_cache_stats(self):
+        """各存储的读统计：原始数据、降采样层级和各类分设备数据的分段读缓存命中情况"""
+        stores = {'raw': self.store, 'rollup': self.rollup_store, **self.device_stores}
+        return {name: store.cache_info() for name, store in stores.items()}
+
+    # ---- 写入流程 ----
+
+    def _commit_batch(self, items):
+        """写线程回调：按服务器合并一个刷新周期内的所有数据，每个服务器一次提交
+
+        原始数据写入后同步推进各降采样层级，返回写入的原始记录总数。
+        """
+        total = 0
+        for server_id, records in self._group_batch(items).items():
+            if isinstance(server_id, tuple):  # (服务器, 类别, 设备) 的分设备记录
+                self._commit_device_records(*server_id, records)
+                continue
+            written = self._commit_records(server_id, records)
+            if len(written):
+                print(f"💾 历史数据已批量写入: {server_id} (+{len(written)})")
+                self.hot.append(server_id, written)
+                self._update_rollups(server_id, written)
+                total += len(written)
+        return total
+
+    def _update_rollups(self, server_id, written):
+        """把新写入的原始记录送入降采样聚合器，并保存已结束的桶
+
+        进程重启后第一次写入某服务器时，从各层级最后一个桶之后的原始数据
+        重新聚合，补齐停机期间未生成的汇总。
+        """
+        since = None
+        if server_id not in self._seeded_servers:
+            self._seeded_servers.add(server_id)
+            since = {}
+            for name, width, _ in ROLLUP_TIERS:
+                last = self._last_rollup_ts(server_id, name)
+                since[name] = last + width if last is not None else 0
+            written = self._read_raw_records(server_id, min(since.values()), int(written['ts'][-1]))
+
+        for name, rows in self.rollups.ingest(server_id, written, since).items():
+            self._commit_rollups(server_id, name, rows)
+
+    def flush(self):
+        """等待所有排队的数据写入磁盘"""
+        self.writer.flush()
+
+    def close(self):
+        """停止写线程并提交剩余数据（关闭时调用）"""
+        self.compactor.stop()
+        self.writer.stop()
+        self.hot.close()
+
+    # ---- 查询 ----
+
+    def select_tier(self, span_seconds, max_points):
+        """选择仍能提供足够数据点的最粗层级，原始数据更合适时返回None"""
+        if not max_points:
+            return None
+        min_points = max_points * self.min_tier_points_ratio
+        for name, width, _ in reversed(ROLLUP_TIERS):
+            if span_seconds / width >= min_points:
+                return name
+        return None
+
+    @staticmethod
+    def _records_to_result(records, fields):
+        result = {'timestamps': records['ts'].tolist()}
+        for field in fields:
+            result[field] = records[field].tolist()
+        return result
 
-        except Exception as e:
-            print(f"❌ 追加实时数据失败: {e}")
+    def _query_raw(self, server_id, start_ts, end_ts, fields, max_points):
+        records = self._read_raw_records(server_id, start_ts, end_ts)
+        if not len(records):
+            return None
+        records = _downsample_records(records, start_ts, max_points)
+        return self._records_to_result(records, fields)
+
+    def _query_rollup(self, server_id, tier_name, start_ts, end_ts, fields, max_points, agg):
+        rows = self._read_rollups(server_id, tier_name, start_ts, end_ts)
+        open_row = self.rollups.snapshot(server_id, tier_name)
+        if (open_row is not None and start_ts <= open_row['ts'][0] <= end_ts
+                and (not len(rows) or open_row['ts'][0] > rows['ts'][-1])):
+            rows = np.concatenate((rows, open_row))
+        if not len(rows):
+            return None
 
-    def load_historical_data(self, server_id):
-        """从文件加载历史数据"""
-        try:
-            result = {
-                'timestamps': [],
-                'cpu': [],
-                'memory': [],
-                'disk_read': [],
-                'disk_write': [],
-                'network_sent': [],
-                'network_recv': []
-            }
+        records = np.zeros(len(rows), dtype=[('ts', '<i8')] + [(field, '<f8') for field in fields])
+        records['ts'] = rows['ts']
+        for field in fields:
+            records[field] = rows[f'{field}_{agg}']
+        records = _downsample_records(records, start_ts, max_points)
+        return self._records_to_result(records, fields)
+
+    def query_devices(self, server_id, kind, start_ts, end_ts, devices=None, max_points=None):
+        """按时间范围查询分设备序列，返回 设备名 -> {timestamps, 各字段}"""
+        result = {}
+        for device in devices or self.list_devices(server_id, kind):
+            records = self._read_device_records(server_id, kind, device, start_ts, end_ts)
+            if len(records):
+                records = _downsample_records(records, start_ts, max_points)
+                result[device] = self._records_to_result(records, DEVICE_FIELDS[kind])
+        return result
 
-            # 加载CPU数据
-            cpu_file = self.get_file_path(server_id, 'cpu')
-            if os.path.exists(cpu_file):
-                with open(cpu_file, 'r', encoding='utf-8') as f:
-                    cpu_data = json.load(f)
-                    result['timestamps'] = cpu_data.get('timestamps', [])
-                    result['cpu'] = cpu_data.get('values', [])
-
-            # 加载内存数据
-            memory_file = self.get_file_path(server_id, 'memory')
-            if os.path.exists(memory_file):
-                with open(memory_file, 'r', encoding='utf-8') as f:
-                    memory_data = json.load(f)
-                    if not result['timestamps']:  # 如果CPU数据没有时间戳，使用内存数据的
-                        result['timestamps'] = memory_data.get('timestamps', [])
-                    result['memory'] = memory_data.get('values', [])
-
-            # 加载磁盘IO数据
-            disk_file = self.get_file_path(server_id, 'disk_io')
-            if os.path.exists(disk_file):
-                with open(disk_file, 'r', encoding='utf-8') as f:
-                    disk_data = json.load(f)
-                    if not result['timestamps']:
-                        result['timestamps'] = disk_data.get('timestamps', [])
-                    result['disk_read'] = disk_data.get('disk_read', [])
-                    result['disk_write'] = disk_data.get('disk_write', [])
-
-            # 加载网络数据
-            network_file = self.get_file_path(server_id, 'network')
-            if os.path.exists(network_file):
-                with open(network_file, 'r', encoding='utf-8') as f:
-                    network_data = json.load(f)
-                    if not result['timestamps']:
-                        result['timestamps'] = network_data.get('timestamps', [])
-                    result['network_sent'] = network_data.get('network_sent', [])
-                    result['network_recv'] = network_data.get('network_recv', [])
-
-            if result['timestamps']:
-                print(f"📖 从文件加载历史数据: {server_id}, {len(result['timestamps'])}个数据点")
+    def iter_range(self, server_id, start_ts, end_ts, fields=HISTORY_FIELDS):
+        """流式读取原始数据：逐块产出 [(ts, 字段值...), ...]，只读取范围内的分段和请求的字段"""
+        columns = ['ts'] + list(fields)
+        for records in self.store.iter_range(self._series(server_id), start_ts, end_ts):
+            yield records[columns].tolist()
+
+    def query_range(self, server_id, start_ts, end_ts, fields=HISTORY_FIELDS, max_points=None, agg='avg'):
+        """查询 [start_ts, end_ts] 时间范围内的数据
+
+        指定max_points时自动选用能提供足够数据点的最粗降采样层级
+        （agg选择层级中的 min/max/avg/last），仍超出上限的部分再按时间桶降采样。
+        返回 {'timestamps': [epoch秒...], 字段: [...], 'resolution': 层级}，没有数据时返回None。
+        """
+        tier_name = self.select_tier(end_ts - start_ts, max_points)
+        if tier_name:
+            result = self._query_rollup(server_id, tier_name, start_ts, end_ts, fields, max_points, agg)
+            if result:
+                result['resolution'] = tier_name
                 return result
+
+        # 层级中还没有数据（刚开始采集）时退回原始数据，热数据范围内直接读环形缓冲
+        if self.hot.covers(server_id, start_ts):
+            records = self.hot.get(server_id).read_range(start_ts, end_ts, fields)
+            records = _downsample_records(records, start_ts, max_points)
+            result = self._records_to_result(records, fields) if len(records) else None
+        else:
+            result = self._query_raw(server_id, start_ts, end_ts, fields, max_points)
+        if result:
+            result['resolution'] = 'raw'
+        return result
+
+    def migrate_legacy_files(self):
+        """一次性把旧版 {server_id}_{metric}.txt JSON文件迁移到分段存储
+
+        迁移完成的文件重命名为 .txt.migrated，因此重复调用不会重复导入。
+        """
+        suffixes = tuple(f"_{metric}.txt" for metric in LEGACY_METRIC_FILES)
+        server_ids = set()
+        for name in os.listdir(self.data_dir):
+            for suffix in suffixes:
+                if name.endswith(suffix):
+                    server_ids.add(name[:-len(suffix)])
+
+        migrated = 0
+        for server_id in sorted(server_ids):
+            try:
+                migrated += self._migrate_legacy_server(server_id)
+            except Exception as e:
+                print(f"❌ 迁移历史数据失败: {server_id} - {e}")
+        return migrated
+
+    def _migrate_legacy_server(self, server_id):
+        """迁移单个服务器的旧版文件，返回写入的数据点数"""
+        rows = {}  # 时间字符串 -> {字段: 值}
+        order = []
+        paths = []
+        reference = None
+
+        for metric, mapping in LEGACY_METRIC_FILES.items():
+            path = self.get_file_path(server_id, metric)
+            if not os.path.exists(path):
+                continue
+            paths.append(path)
+            mtime = datetime.fromtimestamp(os.path.getmtime(path))
+            reference = max(reference, mtime) if reference else mtime
+            try:
+                with open(path, 'r', encoding='utf-8') as f:
+                    data = json.load(f)
+            except (ValueError, OSError):
+                continue  # 文件损坏，跳过
+
+            for i, timestamp in enumerate(data.get('timestamps', [])):
+                if timestamp not in rows:
+                    rows[timestamp] = {}
+                    order.append(timestamp)
+                for field, key in mapping.items():
+                    values = data.get(key, [])
+                    if i < len(values):
+                        rows[timestamp][field] = values[i]
+
+        # 旧时间戳没有日期：从最后一个点（文件修改日期）倒推，时间回绕则减一天
+        epochs = []
+        current_day = None
+        previous = None
+        for timestamp in reversed(order):
+            if current_day is None:
+                epoch = _to_epoch(timestamp, reference)
+                current_day = datetime.fromtimestamp(epoch).date()
             else:
-                print(f"📖 未找到历史数据文件: {server_id}")
+                clock = datetime.strptime(timestamp, '%H:%M:%S').time()
+                candidate = datetime.combine(current_day, clock)
+                if candidate.timestamp() >= previous:
+                    current_day -= timedelta(days=1)
+                    candidate = datetime.combine(current_day, clock)
+                epoch = int(candidate.timestamp())
+            epochs.append(epoch)
+            previous = epoch
+        epochs.reverse()
+
+        columns = {field: [rows[ts].get(field, 0.0) for ts in order] for field in HISTORY_FIELDS}
+        records = self._build_records(epochs, columns)
+        written = self._commit_batch([(server_id, records)])
+
+        for path in paths:
+            os.replace(path, path + '.migrated')
+        print(f"📦 已迁移旧版历史数据: {server_id}, {written}个数据点")
+        return written
+
+class SQLiteHistoricalPersistence(HistoricalDataPersistence):
+    """基于SQLite（WAL模式）的历史数据持久化
+
+    接口与HistoricalDataPersistence一致。所有指标存在一张以
+    (server_id, ts) 为主键的表里，各降采样层级各占一张表；写线程
+    每批数据一个事务批量插入，时间范围过滤和降采样都在SQL里完成，
+    不再把全部数据点读进Python。
+    """
+
+    def __init__(self, data_dir='historical_data', db_name='metrics.db'):
+        self.data_dir = data_dir
+        self.ensure_data_dir()
+        self.db_path = os.path.join(data_dir, db_name)
+        self._local = threading.local()  # 每个线程一个连接
+        self._last_ts = {}  # 服务器 -> 已写入的最新时间戳
+        # 各类表的读取次数和读出行数（键与分段后端的 read_cache_stats 一致）
+        self._read_stats = {name: {'queries': 0, 'rows': 0} for name in ('raw', 'rollup', *DEVICE_FIELDS)}
+        self._read_stats_lock = threading.Lock()
+        self._init_schema()
+        self._init_rollups()
+        self.writer = WriteBehindQueue(self._commit_batch)
+        self.migrate_legacy_files()
+
+    def _connect(self):
+        """获取当前线程的数据库连接"""
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30)
+            conn.execute('PRAGMA auto_vacuum=INCREMENTAL')  # 只对新建的数据库生效
+            conn.execute('PRAGMA journal_mode=WAL')
+            conn.execute('PRAGMA synchronous=NORMAL')
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _rollup_table(tier_name):
+        return f"metrics_{tier_name}"
+
+    @staticmethod
+    def _device_table(kind):
+        return f"device_{kind}"
+
+    def _init_schema(self):
+        """创建原始指标表和各层级汇总表（主键即 (server_id, ts) 索引）"""
+        raw_columns = ', '.join(f"{field} REAL NOT NULL DEFAULT 0" for field in HISTORY_FIELDS)
+        rollup_columns = ', '.join(f"{name} REAL NOT NULL DEFAULT 0" for name in ROLLUP_DTYPE.names[2:])
+        conn = self._connect()
+        with conn:
+            conn.execute(f"""
+                CREATE TABLE IF NOT EXISTS metrics (
+                    server_id TEXT NOT NULL,
+                    ts INTEGER NOT NULL,
+                    {raw_columns},
+                    PRIMARY KEY (server_id, ts)
+                ) WITHOUT ROWID
+            """)
+            for name, _, _ in ROLLUP_TIERS:
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self._rollup_table(name)} (
+                        server_id TEXT NOT NULL,
+                        ts INTEGER NOT NULL,
+                        count INTEGER NOT NULL,
+                        {rollup_columns},
+                        PRIMARY KEY (server_id, ts)
+                    ) WITHOUT ROWID
+                """)
+            for kind, fields in DEVICE_FIELDS.items():
+                device_columns = ', '.join(f"{field} REAL NOT NULL DEFAULT 0" for field in fields)
+                conn.execute(f"""
+                    CREATE TABLE IF NOT EXISTS {self._device_table(kind)} (
+                        server_id TEXT NOT NULL,
+                        device TEXT NOT NULL,
+                        ts INTEGER NOT NULL,
+                        {device_columns},
+                        PRIMARY KEY (server_id, device, ts)
+                    ) WITHOUT ROWID
+                """)
+
+    def _commit_batch(self, items):
+        """写线程回调：整批数据（含汇总和过期清理）在一个事务中完成"""
+        conn = self._connect()
+        with conn:
+            return super()._commit_batch(items)
+
+    def _commit_records(self, server_id, records):
+        conn = self._connect()
+        if server_id not in self._last_ts:
+            self._last_ts[server_id] = conn.execute(
+                "SELECT MAX(ts) FROM metrics WHERE server_id = ?", (server_id,)
+            ).fetchone()[0]
+        last = self._last_ts[server_id]
+        if last is not None:
+            records = records[records['ts'] > last]
+        if not len(records):
+            return records
+
+        placeholders = ', '.join('?' * (len(HISTORY_FIELDS) + 2))
+        conn.executemany(
+            f"INSERT OR IGNORE INTO metrics (server_id, ts, {', '.join(HISTORY_FIELDS)}) VALUES ({placeholders})",
+            [(server_id,) + tuple(row) for row in records.tolist()]
+        )
+        self._last_ts[server_id] = int(records['ts'][-1])
+        return records
+
+    def _commit_rollups(self, server_id, tier_name, rows):
+        placeholders = ', '.join('?' * (len(ROLLUP_DTYPE.names) + 1))
+        self._connect().executemany(
+            f"INSERT OR REPLACE INTO {self._rollup_table(tier_name)} "
+            f"(server_id, {', '.join(ROLLUP_DTYPE.names)}) VALUES ({placeholders})",
+            [(server_id,) + tuple(row) for row in rows.tolist()]
+        )
+
+    def _read_raw_records(self, server_id, start_ts, end_ts):
+        rows = self._connect().execute(
+            f"SELECT ts, {', '.join(HISTORY_FIELDS)} FROM metrics "
+            f"WHERE server_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (server_id, int(start_ts), int(end_ts))
+        ).fetchall()
+        self._count_read('raw', len(rows))
+        return np.array(rows, dtype=RECORD_DTYPE) if rows else np.empty(0, dtype=RECORD_DTYPE)
+
+    def _read_rollups(self, server_id, tier_name, start_ts, end_ts):
+        rows = self._connect().execute(
+            f"SELECT {', '.join(ROLLUP_DTYPE.names)} FROM {self._rollup_table(tier_name)} "
+            f"WHERE server_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (server_id, int(start_ts), int(end_ts))
+        ).fetchall()
+        self._count_read('rollup', len(rows))
+        return np.array(rows, dtype=ROLLUP_DTYPE) if rows else np.empty(0, dtype=ROLLUP_DTYPE)
+
+    def _last_rollup_ts(self, server_id, tier_name):
+        return self._connect().execute(
+            f"SELECT MAX(ts) FROM {self._rollup_table(tier_name)} WHERE server_id = ?", (server_id,)
+        ).fetchone()[0]
+
+    def _commit_device_records(self, server_id, kind, device, records):
+        fields = DEVICE_FIELDS[kind]
+        placeholders = ', '.join('?' * (len(fields) + 3))
+        return self._connect().executemany(
+            f"INSERT OR IGNORE INTO {self._device_table(kind)} (server_id, device, ts, {', '.join(fields)}) "
+            f"VALUES ({placeholders})",
+            [(server_id, device) + tuple(row) for row in records.tolist()]
+        ).rowcount
+
+    def _read_device_records(self, server_id, kind, device, start_ts, end_ts):
+        dtype = DEVICE_DTYPES[kind]
+        rows = self._connect().execute(
+            f"SELECT ts, {', '.join(DEVICE_FIELDS[kind])} FROM {self._device_table(kind)} "
+            f"WHERE server_id = ? AND device = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (server_id, device, int(start_ts), int(end_ts))
+        ).fetchall()
+        self._count_read(kind, len(rows))
+        return np.array(rows, dtype=dtype) if rows else np.empty(0, dtype=dtype)
+
+    def list_devices(self, server_id, kind):
+        return [row[0] for row in self._connect().execute(
+            f"SELECT DISTINCT device FROM {self._device_table(kind)} WHERE server_id = ? ORDER BY device", (server_id,)
+        )]
+
+    def list_servers(self):
+        return [row[0] for row in self._connect().execute("SELECT DISTINCT server_id FROM metrics")]
+
+    def compact_server(self, server_id, now):
+        """删除过期行；SQLite中没有分段，释放的空间在compact()中统一回收"""
+        conn = self._connect()
+        deleted = 0
+        with conn:
+            for tier in RetentionPolicy.TIERS:
+                table = 'metrics' if tier == 'raw' else self._rollup_table(tier)
+                deleted += conn.execute(
+                    f"DELETE FROM {table} WHERE server_id = ? AND ts < ?",
+                    (server_id, self.retention.cutoff(server_id, tier, now))
+                ).rowcount
+            for kind in DEVICE_FIELDS:
+                deleted += conn.execute(
+                    f"DELETE FROM {self._device_table(kind)} WHERE server_id = ? AND ts < ?",
+                    (server_id, self.retention.cutoff(server_id, 'raw', now))
+                ).rowcount
+        return {'bytes_reclaimed': 0, 'segments_dropped': 0, 'segments_merged': 0, 'rows_deleted': deleted}
+
+    def _count_read(self, name, rows, queries=1):
+        with self._read_stats_lock:
+            self._read_stats[name]['queries'] += queries
+            self._read_stats[name]['rows'] += rows
+
+    def read_cache_stats(self):
+        """各类表的读取统计
+
+        Python的sqlite3模块取不到SQLite页缓存的命中计数，这里返回与分段后端
+        相同键下的查询次数和读出行数，另附页缓存配置和数据库页数。
+        """
+        conn = self._connect()
+        with self._read_stats_lock:
+            stats = {name: dict(counts) for name, counts in self._read_stats.items()}
+        stats['page_cache'] = {
+            'page_size': conn.execute('PRAGMA page_size').fetchone()[0],
+            'cache_size': conn.execute('PRAGMA cache_size').fetchone()[0],  # 负数表示KiB
+            'database_pages': conn.execute('PRAGMA page_count').fetchone()[0],
+        }
+        return stats
+
+    def _database_bytes(self):
+        return sum(os.path.getsize(path) for path in (self.db_path, self.db_path + '-wal') if os.path.exists(path))
+
+    def compact(self, now=None):
+        """删除过期行后做增量VACUUM并截断WAL，按文件大小变化统计释放的字节数"""
+        before = self._database_bytes()
+        total = super().compact(now)
+        conn = self._connect()
+        # incremental_vacuum每执行一步只释放一页，而它没有结果列，execute()只执行
+        # 第一步、fetchall()也无法继续；executescript会把语句执行到底
+        conn.executescript('PRAGMA incremental_vacuum;')
+        conn.execute('PRAGMA wal_checkpoint(TRUNCATE)').fetchall()
+        total['bytes_reclaimed'] = max(before - self._database_bytes(), 0)
+        return total
+
+    def iter_range(self, server_id, start_ts, end_ts, fields=HISTORY_FIELDS, chunk_size=1000):
+        cursor = self._connect().execute(
+            f"SELECT ts, {', '.join(fields)} FROM metrics "
+            f"WHERE server_id = ? AND ts BETWEEN ? AND ? ORDER BY ts",
+            (server_id, int(start_ts), int(end_ts))
+        )
+        self._count_read('raw', 0)
+        while True:
+            rows = cursor.fetchmany(chunk_size)
+            if not rows:
+                break
+            self._count_read('raw', len(rows), queries=0)
+            yield rows
+
+    def _query_raw(self, server_id, start_ts, end_ts, fields, max_points):
+        """原始数据查询：时间过滤和按时间桶平均降采样都交给SQL"""
+        conn = self._connect()
+        where = "FROM metrics WHERE server_id = ? AND ts BETWEEN ? AND ?"
+        params = (server_id, int(start_ts), int(end_ts))
+
+        bucket_seconds = 1
+        if max_points:
+            count, last_ts = conn.execute(f"SELECT COUNT(*), MAX(ts) {where}", params).fetchone()
+            if not count:
                 return None
+            if count > max_points:
+                span = last_ts - int(start_ts) + 1
+                bucket_seconds = max(1, -(-span // max_points))
+
+        if bucket_seconds > 1:
+            selects = ', '.join(f"AVG({field})" for field in fields)
+            sql = (f"SELECT MAX(ts), {selects} {where} "
+                   f"GROUP BY (ts - ?) / ? ORDER BY 1")
+            params = params + (int(start_ts), bucket_seconds)
+        else:
+            selects = ', '.join(fields)
+            sql = f"SELECT ts, {selects} {where} ORDER BY ts"
 
-        except Exception as e:
-            print(f"❌ 加载历史数据失败: {e}")
+        rows = conn.execute(sql, params).fetchall()
+        self._count_read('raw', len(rows))
+        if not rows:
             return None
+        columns = list(zip(*rows))
+        result = {'timestamps': list(columns[0])}
+        for i, field in enumerate(fields):
+            result[field] = list(columns[i + 1])
+        return result
+
+
+def create_persistence(backend=None, data_dir='historical_data'):
+    """按配置创建历史数据持久化后端
+
+    backend 为 'segment'（默认，二进制分段文件）或 'sqlite'，
+    未指定时读取环境变量 HISTORY_BACKEND。
+    """
+    backend = (backend or os.environ.get('HISTORY_BACKEND', 'segment')).lower()
+    if backend == 'sqlite':
+        print("🗄️  历史数据后端: SQLite")
+        return SQLiteHistoricalPersistence(data_dir)
+    return HistoricalDataPersistence(data_dir)
 
 app = Flask(__name__, static_folder='dist/static', template_folder='dist')
 CORS(app)
@@ -511,25 +2042,1546 @@ class PerformanceAnalyzer:
 # 创建性能分析器实例
 analyzer = PerformanceAnalyzer()
 
+class HostProbe:
+    """SSH之前的TCP可达性预检与DNS解析缓存
+
+    解析结果按TTL缓存（解析失败也缓存一小段时间，避免错误主机名反复
+    阻塞在getaddrinfo上），随后用很短的超时直接连接SSH端口。端口不通的
+    主机在几秒内就被判定为不可达，不再占用采集线程等待30秒的SSH超时；
+    连接成功的socket直接交给paramiko使用，不重复握手。
+    """
+
+    def __init__(self, timeout=2, dns_ttl=300, negative_ttl=30, max_workers=64):
+        self.timeout = timeout
+        self.dns_ttl = dns_ttl
+        self.negative_ttl = negative_ttl
+        self.max_workers = max_workers
+        self._dns = {}  # (host, port) -> (过期时间, 地址列表或解析异常)
+        self._lock = threading.Lock()
+        self.hosts = {}  # 'host:port' -> 最近一次预检结果
+        self.stats_counters = {
+            'probes': 0,
+            'failures': 0,
+            'dns_hits': 0,
+            'dns_misses': 0,
+        }
+
+    def resolve(self, host, port):
+        """解析主机地址，返回 [(family, sockaddr), ...]，解析失败抛出 socket.gaierror"""
+        key = (host, int(port))
+        now = time.monotonic()
+        with self._lock:
+            cached = self._dns.get(key)
+        if cached and cached[0] > now:
+            self.stats_counters['dns_hits'] += 1
+            if isinstance(cached[1], Exception):
+                raise cached[1]
+            return cached[1]
+
+        self.stats_counters['dns_misses'] += 1
+        try:
+            infos = socket.getaddrinfo(host, int(port), type=socket.SOCK_STREAM)
+        except socket.gaierror as e:
+            with self._lock:
+                self._dns[key] = (now + self.negative_ttl, e)
+            raise
+        addresses = [(family, sockaddr) for family, _, _, _, sockaddr in infos]
+        with self._lock:
+            self._dns[key] = (now + self.dns_ttl, addresses)
+        return addresses
+
+    def connect(self, host, port, timeout=None):
+        """解析并建立TCP连接，返回已连接的socket
+
+        依次尝试解析出的每个地址；全部失败时记录为不可达并抛出最后一个
+        异常（socket.timeout / ConnectionRefusedError / socket.gaierror 等）。
+        """
+        timeout = timeout or self.timeout
+        started = time.monotonic()
+        self.stats_counters['probes'] += 1
+        try:
+            last_error = None
+            for family, sockaddr in self.resolve(host, port):
+                sock = socket.socket(family, socket.SOCK_STREAM)
+                sock.settimeout(timeout)
+                try:
+                    sock.connect(sockaddr)
+                except OSError as e:
+                    sock.close()
+                    last_error = e
+                    continue
+                self._record(host, port, started, address=sockaddr[0])
+                return sock
+            raise last_error or OSError(f"没有可用的地址: {host}")
+        except OSError as e:
+            self.stats_counters['failures'] += 1
+            if not isinstance(e, socket.gaierror):
+                with self._lock:
+                    self._dns.pop((host, int(port)), None)  # 地址可能已变化，下次重新解析
+            self._record(host, port, started, error=e)
+            raise
+
+    def _record(self, host, port, started, address=None, error=None):
+        key = f"{host}:{port}"
+        previous = self.hosts.get(key)
+        self.hosts[key] = {
+            'reachable': error is None,
+            'address': address,
+            'latency_ms': round((time.monotonic() - started) * 1000, 1),
+            'error': f"{type(error).__name__}: {error}" if error else None,
+            'checked_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+        }
+        if error is not None and (previous is None or previous['reachable']):
+            print(f"🚫 主机不可达: {key} - {self.hosts[key]['error']}")
+
+    def is_reachable(self, host, port):
+        """最近一次预检的结果，从未预检过时返回None"""
+        result = self.hosts.get(f"{host}:{port}")
+        return result['reachable'] if result else None
+
+    def probe(self, host, port, timeout=None):
+        """只检查TCP端口是否可达，返回预检结果"""
+        try:
+            self.connect(host, port, timeout).close()
+        except OSError:
+            pass
+        return {'host': host, 'port': int(port), **self.hosts[f"{host}:{port}"]}
+
+    def probe_many(self, targets, timeout=None):
+        """并发预检 [(host, port), ...]，按输入顺序返回结果"""
+        if not targets:
+            return []
+        workers = min(len(targets), self.max_workers)
+        with concurrent.futures.ThreadPoolExecutor(max_workers=workers, thread_name_prefix='probe') as pool:
+            return list(pool.map(lambda target: self.probe(target[0], target[1], timeout), targets))
+
+    def snapshot(self):
+        with self._lock:
+            dns_entries = len(self._dns)
+        return {**self.stats_counters, 'dns_entries': dns_entries, 'hosts': dict(self.hosts)}
+
+
+class PooledSSHConnection:
+    """连接池中单个服务器的SSH连接状态"""
+
+    def __init__(self, key, max_channels):
+        self.key = key
+        self.client = None
+        self.fingerprint = None  # 建立连接时使用的配置，配置变化后需要重连
+        self.channels = threading.BoundedSemaphore(max_channels)  # 并发通道上限
+        self.lock = threading.Lock()  # 串行化连接/重连
+        self.in_use = 0
+        self.connected_at = None
+        self.last_used = time.monotonic()
+        self.last_check = 0.0
+        self.connect_count = 0
+        self.streams = 0  # 占用本连接的长期流式通道数
+
+
+class SSHConnectionPool:
+    """按服务器复用的SSH连接池
+
+    每个服务器保持一个长连接（transport），命令通过新开的channel执行，
+    不再为每次采集重复TCP握手和SSH认证。传输层开启keepalive，长时间
+    未检查的连接在使用前发送一个ignore包做健康检查；执行中连接断开时
+    自动重连并重试一次；空闲超时的连接由后台线程定期回收。
+    """
+
+    def __init__(self, connect_timeout=30, keepalive_interval=30, health_check_interval=60,
+                 idle_timeout=300, max_channels=4, channel_wait_timeout=30, probe=None):
+        self.connect_timeout = connect_timeout
+        self.probe = probe or HostProbe()  # 新建连接前先做TCP预检
+        self.keepalive_interval = keepalive_interval
+        self.health_check_interval = health_check_interval
+        self.idle_timeout = idle_timeout
+        self.max_channels = max_channels
+        self.channel_wait_timeout = channel_wait_timeout
+        self._entries = {}  # 服务器标识 -> PooledSSHConnection
+        self._lock = threading.Lock()
+        self.stats_counters = {
+            'requests': 0,
+            'reuses': 0,
+            'connects': 0,
+            'reconnects': 0,
+            'connect_failures': 0,
+            'health_check_failures': 0,
+            'evictions': 0,
+            'channel_wait_timeouts': 0,
+            'streams_opened': 0,
+            'connect_time_total': 0.0,
+            'last_connect_time': 0.0,
+        }
+
+    @staticmethod
+    def pool_key(server_config):
+        return server_config.get('id') or f"{server_config.get('username')}@{server_config['host']}:{server_config.get('port', 22)}"
+
+    @staticmethod
+    def _fingerprint(server_config):
+        return tuple(server_config.get(name) for name in
+                     ('host', 'port', 'username', 'auth_type', 'password', 'private_key_path', 'key_password'))
+
+    def _open_client(self, server_config, timeout=None):
+        """建立新的SSH连接（密码或密钥认证），TCP连接由预检阶段建立
+
+        传入sock时paramiko忽略timeout参数，因此banner、认证和开通道的
+        超时都要单独设置，整个建连过程不超过 timeout（默认 connect_timeout）。
+        """
+        timeout = min(timeout, self.connect_timeout) if timeout else self.connect_timeout
+        ssh = paramiko.SSHClient()
+        ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
+        connect_args = {
+            'hostname': server_config['host'],
+            'port': server_config['port'],
+            'username': server_config['username'],
+            'timeout': timeout,
+            'banner_timeout': timeout,
+            'auth_timeout': timeout,
+            'channel_timeout': timeout,
+        }
+
+        if server_config.get('auth_type', 'password') == 'password':
+            connect_args['password'] = server_config.get('password')
+        else:  # key认证
+            private_key_path = server_config.get('private_key_path')
+            key_password = server_config.get('key_password')
+            try:
+                connect_args['pkey'] = paramiko.RSAKey.from_private_key_file(private_key_path, password=key_password)
+            except paramiko.SSHException:
+                connect_args['pkey'] = paramiko.Ed25519Key.from_private_key_file(private_key_path, password=key_password)
+
+        sock = self.probe.connect(server_config['host'], server_config['port'],
+                                  timeout=min(self.probe.timeout, timeout))
+        try:
+            ssh.connect(sock=sock, **connect_args)
+        except Exception:
+            ssh.close()
+            sock.close()
+            raise
+        ssh.get_transport().set_keepalive(self.keepalive_interval)
+        return ssh
+
+    def _healthy(self, entry):
+        transport = entry.client.get_transport()
+        if transport is None or not transport.is_active():
+            return False
+        now = time.monotonic()
+        if now - entry.last_check >= self.health_check_interval:
+            try:
+                transport.send_ignore()
+            except Exception:
+                return False
+            entry.last_check = now
+        return True
+
+    @staticmethod
+    def _close_client(entry):
+        if entry.client is not None:
+            try:
+                entry.client.close()
+            except Exception:
+                pass
+        entry.client = None
+        entry.connected_at = None
+
+    def _entry(self, server_config):
+        key = self.pool_key(server_config)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                entry = self._entries[key] = PooledSSHConnection(key, self.max_channels)
+            return entry
+
+    def _ensure_connected(self, entry, server_config, timeout=None):
+        """确保连接可用：配置变化或健康检查失败时重连，新建连接不超过timeout秒"""
+        with entry.lock:
+            fingerprint = self._fingerprint(server_config)
+            if entry.client is not None and entry.fingerprint != fingerprint:
+                self._close_client(entry)
+            if entry.client is not None and not self._healthy(entry):
+                self.stats_counters['health_check_failures'] += 1
+                self._close_client(entry)
+
+            if entry.client is not None:
+                self.stats_counters['reuses'] += 1
+                return entry.client
+
+            started = time.monotonic()
+            try:
+                entry.client = self._open_client(server_config, timeout)
+            except Exception:
+                self.stats_counters['connect_failures'] += 1
+                raise
+            elapsed = time.monotonic() - started
+            self.stats_counters['connects'] += 1
+            if entry.connect_count:
+                self.stats_counters['reconnects'] += 1
+            self.stats_counters['connect_time_total'] += elapsed
+            self.stats_counters['last_connect_time'] = elapsed
+            entry.connect_count += 1
+            entry.fingerprint = fingerprint
+            entry.connected_at = time.monotonic()
+            entry.last_check = entry.connected_at
+            print(f"🔌 SSH连接已建立: {entry.key} ({elapsed * 1000:.0f}ms)")
+            return entry.client
+
+    @staticmethod
+    def _remaining(deadline, what):
+        remaining = deadline - time.monotonic()
+        if remaining <= 0:
+            raise socket.timeout(f"{what}超过时限")
+        return remaining
+
+    def _exec(self, client, command, deadline):
+        """执行命令并读完输出，整个过程不超过deadline（monotonic时间）
+
+        exec_command的timeout只是单次读取的超时，持续缓慢输出的命令永远不会
+        超时，因此这里自己循环读取并检查总时限，超时后关闭通道。
+        """
+        channel = client.get_transport().open_session(timeout=self._remaining(deadline, '打开SSH通道'))
+        stdout, stderr = [], []
+        try:
+            channel.exec_command(command)
+            while True:
+                channel.settimeout(min(self._remaining(deadline, '执行远程命令'), 1.0))
+                while channel.recv_stderr_ready():
+                    stderr.append(channel.recv_stderr(65536))
+                try:
+                    data = channel.recv(65536)
+                except socket.timeout:
+                    continue
+                if not data:
+                    break  # stdout已结束
+                stdout.append(data)
+            while not channel.exit_status_ready():
+                self._remaining(deadline, '等待远程命令退出')
+                time.sleep(0.01)
+            while channel.recv_stderr_ready():
+                stderr.append(channel.recv_stderr(65536))
+        finally:
+            channel.close()
+        return b''.join(stdout).decode(), b''.join(stderr).decode()
+
+    def run(self, server_config, command, timeout=30):
+        """在服务器上执行命令，返回 (stdout, stderr)
+
+        timeout是整次调用的时限：等待通道名额、建立连接、执行命令和读取
+        输出（包括断线重连后的重试）全部计算在内，超时抛出socket.timeout
+        或TimeoutError。同一服务器同时最多打开 max_channels 个通道，超出
+        时等待；执行时连接已断开则重连后重试一次。
+        """
+        deadline = time.monotonic() + timeout
+        self.stats_counters['requests'] += 1
+        entry = self._entry(server_config)
+        if not entry.channels.acquire(timeout=min(self.channel_wait_timeout, timeout)):
+            self.stats_counters['channel_wait_timeouts'] += 1
+            raise TimeoutError(f"等待SSH通道超时: {entry.key}")
+
+        entry.in_use += 1
+        try:
+            client = self._ensure_connected(entry, server_config, self._remaining(deadline, '建立SSH连接'))
+            try:
+                return self._exec(client, command, deadline)
+            except socket.timeout:
+                raise  # 命令本身超时，连接未必有问题
+            except (paramiko.SSHException, EOFError, OSError) as e:
+                print(f"⚠️  SSH连接已断开，重新连接: {entry.key} - {e}")
+                with entry.lock:
+                    if entry.client is client:
+                        self._close_client(entry)
+                client = self._ensure_connected(entry, server_config, self._remaining(deadline, '重新建立SSH连接'))
+                return self._exec(client, command, deadline)
+        finally:
+            entry.in_use -= 1
+            entry.last_used = time.monotonic()
+            entry.channels.release()
+
+    def connection_id(self, server_config):
+        """服务器当前连接的序号，每次（重新）建立连接后加一；用于判断两次采集之间是否发生过重连"""
+        with self._lock:
+            entry = self._entries.get(self.pool_key(server_config))
+        return entry.connect_count if entry else 0
+
+    def open_stream(self, server_config, command):
+        """在长连接上启动一个长期运行的命令，返回 (channel, stdout文件对象)
+
+        流式通道在关闭前一直占用该服务器的一个通道名额，且占用期间连接
+        不会被当作空闲回收。用完必须调用 close_stream。
+        """
+        self.stats_counters['requests'] += 1
+        entry = self._entry(server_config)
+        if not entry.channels.acquire(timeout=min(self.channel_wait_timeout, self.connect_timeout)):
+            self.stats_counters['channel_wait_timeouts'] += 1
+            raise TimeoutError(f"等待SSH通道超时: {entry.key}")
+
+        try:
+            client = self._ensure_connected(entry, server_config)
+            channel = client.get_transport().open_session(timeout=self.connect_timeout)
+            channel.exec_command(command)
+        except Exception:
+            entry.channels.release()
+            raise
+        entry.in_use += 1
+        entry.streams += 1
+        self.stats_counters['streams_opened'] += 1
+        return channel, channel.makefile('rb')
+
+    def close_stream(self, server_config, channel):
+        """关闭流式通道并归还通道名额"""
+        try:
+            channel.close()
+        except Exception:
+            pass
+        with self._lock:
+            entry = self._entries.get(self.pool_key(server_config))
+        if entry is None:
+            return  # 连接已被整体关闭
+        entry.in_use -= 1
+        entry.streams -= 1
+        entry.last_used = time.monotonic()
+        entry.channels.release()
+
+    def close(self, server_id):
+        """关闭并移除某个服务器的连接（服务器被删除或配置更新时调用）"""
+        with self._lock:
+            entry = self._entries.pop(server_id, None)
+        if entry:
+            with entry.lock:
+                self._close_client(entry)
+
+    def close_all(self):
+        with self._lock:
+            entries = list(self._entries.values())
+            self._entries.clear()
+        for entry in entries:
+            with entry.lock:
+                self._close_client(entry)
+
+    def evict_idle(self):
+        """关闭空闲超过 idle_timeout 的连接，返回回收的连接数"""
+        now = time.monotonic()
+        evicted = 0
+        with self._lock:
+            entries = list(self._entries.values())
+        for entry in entries:
+            if entry.client is None or entry.in_use or now - entry.last_used < self.idle_timeout:
+                continue
+            with entry.lock:
+                if entry.client is not None and not entry.in_use:
+                    self._close_client(entry)
+                    evicted += 1
+        if evicted:
+            self.stats_counters['evictions'] += evicted
+            print(f"🧹 回收了 {evicted} 个空闲SSH连接")
+        return evicted
+
+    def stats(self):
+        """连接池统计：复用率、连接耗时以及每个连接的状态"""
+        counters = dict(self.stats_counters)
+        checkouts = counters['reuses'] + counters['connects']
+        now = time.monotonic()
+        with self._lock:
+            entries = list(self._entries.values())
+        return {
+            'requests': counters['requests'],
+            'reuses': counters['reuses'],
+            'connects': counters['connects'],
+            'reconnects': counters['reconnects'],
+            'connect_failures': counters['connect_failures'],
+            'health_check_failures': counters['health_check_failures'],
+            'evictions': counters['evictions'],
+            'channel_wait_timeouts': counters['channel_wait_timeouts'],
+            'streams_opened': counters['streams_opened'],
+            'reuse_rate': round(counters['reuses'] / checkouts, 4) if checkouts else 0.0,
+            'avg_connect_ms': round(counters['connect_time_total'] / counters['connects'] * 1000, 1) if counters['connects'] else 0.0,
+            'last_connect_ms': round(counters['last_connect_time'] * 1000, 1),
+            'connections': {
+                entry.key: {
+                    'connected': entry.client is not None,
+                    'age_seconds': round(now - entry.connected_at, 1) if entry.connected_at else None,
+                    'idle_seconds': round(now - entry.last_used, 1),
+                    'channels_in_use': entry.in_use,
+                    'streams': entry.streams,
+                    'connect_count': entry.connect_count,
+                }
+                for entry in entries
+            },
+        }
+
+
+class RemoteMetricsScript:
+    """单次往返的远程指标采集脚本及其严格解析器
+
+    所有指标由一条命令采集，输出为逐行 key=value，首行是带版本号的
+    头部，末行是结束标记。解析器只接受已知版本、已知字段和完整输出，
+    结构不符时抛出ValueError，而不是悄悄返回0。
+    """
+
+    VERSION = 1
+    HEADER = '@@monitor-metrics'
+    FOOTER = '@@end'
+
+    SCRIPT = '\n'.join([
+        f'echo "{HEADER} v{VERSION}"',
+        '''echo "cpu=$(top -bn1 | grep 'Cpu(s)' | awk '{print $2}' | cut -d'%' -f1)"''',
+        '''echo "load_avg=$(uptime | awk -F'load average:' '{print $2}' | awk '{print $1}' | tr -d ',')"''',
+        '''echo "memory=$(free | grep Mem | awk '{printf "%.1f %.1f", $3/$2*100, $2/1024/1024}')"''',
+        '''echo "disk_percent=$(df -h / | tail -1 | awk '{print $5}' | tr -d '%')"''',
+        '''echo "disk_free=$(df -BG / | tail -1 | awk '{print $4}' | tr -d 'G')"''',
+        '''echo "disk_io=$(iostat -d 1 2 2>/dev/null | tail -n +4 | grep -E '(vda|sda|nvme)' | tail -1 | awk '{print $3, $4}')"''',
+        '''echo "network=$(cat /proc/net/dev | grep -E '(eth0|ens|enp)' | head -1 | awk '{print $2, $10}')"''',
+        f'echo "{FOOTER}"',
+    ])
+
+    # 字段 -> (值的个数, 是否必需)；可选字段在远端缺少工具（如iostat）时允许为空
+    FIELDS = {
+        'cpu': (1, True),
+        'load_avg': (1, True),
+        'memory': (2, True),
+        'disk_percent': (1, True),
+        'disk_free': (1, True),
+        'disk_io': (2, False),
+        'network': (2, False),
+    }
+
+    @classmethod
+    def parse_lines(cls, output):
+        """校验头尾和行格式，返回 {字段: 原始字符串}"""
+        lines = [line.strip() for line in output.strip().splitlines() if line.strip()]
+        if not lines or lines[0] != f"{cls.HEADER} v{cls.VERSION}":
+            header = lines[0] if lines else ''
+            raise ValueError(f"远程采集脚本版本不匹配: {header!r}")
+        if lines[-1] != cls.FOOTER:
+            raise ValueError("远程采集输出不完整（缺少结束标记）")
+
+        values = {}
+        for line in lines[1:-1]:
+            key, sep, value = line.partition('=')
+            if not sep or key not in cls.FIELDS:
+                raise ValueError(f"无法识别的输出行: {line!r}")
+            if key in values:
+                raise ValueError(f"重复的字段: {key}")
+            values[key] = value.strip()
+
+        missing = [key for key in cls.FIELDS if key not in values]
+        if missing:
+            raise ValueError(f"缺少字段: {', '.join(missing)}")
+        return values
+
+    @classmethod
+    def parse_numbers(cls, values):
+        """把每个字段解析为数字列表，可选字段为空时返回None"""
+        numbers = {}
+        for key, (count, required) in cls.FIELDS.items():
+            parts = values[key].split()
+            if not parts and not required:
+                numbers[key] = None
+                continue
+            if len(parts) != count:
+                raise ValueError(f"字段 {key} 应有 {count} 个值: {values[key]!r}")
+            try:
+                numbers[key] = [float(part) for part in parts]
+            except ValueError:
+                raise ValueError(f"字段 {key} 不是数字: {values[key]!r}")
+        return numbers
+
+    @classmethod
+    def parse(cls, output):
+        """解析脚本输出，返回与 get_real_server_metrics 相同结构的指标字典"""
+        numbers = cls.parse_numbers(cls.parse_lines(output))
+        memory_percent, memory_total = numbers['memory']
+        # iostat输出的是kB/s，转换为字节/s
+        disk_read, disk_write = [value * 1024 for value in numbers['disk_io']] if numbers['disk_io'] else (0.0, 0.0)
+        network_recv, network_sent = [int(value) for value in numbers['network']] if numbers['network'] else (0, 0)
+        return {
+            'cpu': numbers['cpu'][0],
+            'load_avg': numbers['load_avg'][0],
+            'memory_percent': memory_percent,
+            'memory_total': memory_total,
+            'memory_used': memory_total * memory_percent / 100,
+            'disk_percent': numbers['disk_percent'][0],
+            'disk_free': numbers['disk_free'][0],
+            'disk_read': disk_read,
+            'disk_write': disk_write,
+            'network_recv': network_recv,
+            'network_sent': network_sent,
+        }
+
+
+def disk_device_rates(previous, current, elapsed):
+    """由两次分设备磁盘计数计算每个设备的速率、平均等待时间和利用率
+
+    计数格式: 设备名 -> (读完成次数, 写完成次数, 读字节, 写字节, 读耗时ms, 写耗时ms, 忙碌ms)。
+    await 为这段时间内完成的每个I/O平均耗时（含排队），util 为设备忙碌时间占比。
+    上次没有该设备（新设备）或计数回退（设备重置）时以0为起点。
+    """
+    devices = {}
+    if elapsed <= 0:
+        return devices
+    for name, counters in current.items():
+        before = (previous or {}).get(name)
+        if before is None or any(now < then for now, then in zip(counters, before)):
+            before = (0,) * len(counters)
+        reads, writes, read_bytes, write_bytes, read_ms, write_ms, busy_ms = (
+            now - then for now, then in zip(counters, before))
+        ios = reads + writes
+        devices[name] = {
+            'reads': round(reads / elapsed, 2),
+            'writes': round(writes / elapsed, 2),
+            'read_bytes': read_bytes / elapsed,  # bytes/s
+            'write_bytes': write_bytes / elapsed,  # bytes/s
+            'await': round((read_ms + write_ms) / ios, 2) if ios else 0.0,  # ms
+            'util': round(min(100.0, busy_ms / (elapsed * 1000) * 100), 1),  # %
+        }
+    return devices
+
+
+def interface_rates(previous, current, elapsed):
+    """由两次分接口网络计数计算每个接口的每秒速率
+
+    计数格式: 接口名 -> (收字节, 发字节, 收包, 发包, 收错误, 发错误, 收丢包, 发丢包)。
+    没有上一次计数（首次采样、重连后）时不输出；新出现的接口和发生计数器
+    重置的接口本次跳过，下一次采样再以新值为基准。
+    """
+    rates = {}
+    if not previous or elapsed <= 0:
+        return rates
+    for name, counters in current.items():
+        before = previous.get(name)
+        if before is None:
+            continue
+        deltas = [counter_delta(then, now) for then, now in zip(before, counters)]
+        if None in deltas:
+            print(f"⚠️  网络接口计数器已重置，跳过本次采样: {name}")
+            continue
+        rates[name] = {field: round(delta / elapsed, 2) for field, delta in zip(DEVICE_FIELDS['net'], deltas)}
+    return rates
+
+
+class ProcMetricsScript:
+    """无代理的 /proc 采集模式
+
+    一次往返读取 /proc/stat、/proc/meminfo、/proc/diskstats、/proc/loadavg、
+    /proc/net/dev 等原始计数器，远端不做任何sleep；CPU%、IOPS、字节/秒
+    等速率在本地由前后两次快照的差值计算。时间基准使用远端 /proc/uptime，
+    不受网络延迟抖动影响。
+    """
+
+    VERSION = 1
+    HEADER = '@@monitor-proc'
+    FOOTER = '@@end'
+    SECTIONS = ('uptime', 'stat', 'meminfo', 'loadavg', 'diskstats', 'net_dev', 'df')
+
+    SCRIPT = '\n'.join([
+        f'echo "{HEADER} v{VERSION}"',
+        'echo "@@uptime"; cat /proc/uptime',
+        "echo \"@@stat\"; grep '^cpu' /proc/stat",
+        'echo "@@meminfo"; cat /proc/meminfo',
+        'echo "@@loadavg"; cat /proc/loadavg',
+        'echo "@@diskstats"; cat /proc/diskstats',
+        'echo "@@net_dev"; tail -n +3 /proc/net/dev',
+        'echo "@@df"; df -Pk / | tail -1',
+        f'echo "{FOOTER}"',
+    ])
+
+    # 整盘设备（不含分区、loop、ram等虚拟设备）
+    WHOLE_DISK_PATTERN = re.compile(r'^(sd[a-z]+|vd[a-z]+|xvd[a-z]+|hd[a-z]+|nvme\d+n\d+|mmcblk\d+)$')
+    SECTOR_BYTES = 512
+
+    @classmethod
+    def split_sections(cls, output):
+        """校验头尾，按 @@段名 切分输出"""
+        lines = output.strip().splitlines()
+        if not lines or lines[0].strip() != f"{cls.HEADER} v{cls.VERSION}":
+            header = lines[0].strip() if lines else ''
+            raise ValueError(f"/proc采集脚本版本不匹配: {header!r}")
+        if lines[-1].strip() != cls.FOOTER:
+            raise ValueError("/proc采集输出不完整（缺少结束标记）")
+
+        sections = {}
+        current = None
+        for line in lines[1:-1]:
+            if line.startswith('@@'):
+                current = line[2:].strip()
+                if current not in cls.SECTIONS or current in sections:
+                    raise ValueError(f"无法识别的段: {line!r}")
+                sections[current] = []
+            elif current is None:
+                raise ValueError(f"段外的输出行: {line!r}")
+            elif line.strip():
+                sections[current].append(line)
+
+        missing = [name for name in cls.SECTIONS if not sections.get(name)]
+        if missing:
+            raise ValueError(f"缺少段: {', '.join(missing)}")
+        return sections
+
+    @classmethod
+    def parse(cls, output):
+        """把脚本输出解析为原始计数器快照"""
+        sections = cls.split_sections(output)
+        try:
+            cpus = {}
+            for line in sections['stat']:
+                name, *values = line.split()
+                cpus[name] = [int(value) for value in values]
+
+            meminfo = {}
+            for line in sections['meminfo']:
+                key, _, value = line.partition(':')
+                meminfo[key.strip()] = int(value.split()[0])
+
+            disks = {}
+            for line in sections['diskstats']:
+                parts = line.split()
+                if cls.WHOLE_DISK_PATTERN.match(parts[2]):
+                    disks[parts[2]] = [int(value) for value in parts[3:]]
+
+            interfaces = {}
+            for line in sections['net_dev']:
+                name, _, values = line.partition(':')
+                name = name.strip()
+                if name != 'lo':
+                    interfaces[name] = [int(value) for value in values.split()]
+
+            df = sections['df'][-1].split()
+            return {
+                'uptime': float(sections['uptime'][0].split()[0]),
+                'cpus': cpus,
+                'meminfo': meminfo,
+                'load_avg': float(sections['loadavg'][0].split()[0]),
+                'disks': disks,
+                'interfaces': interfaces,
+                'disk_used_kb': int(df[2]),
+                'disk_available_kb': int(df[3]),
+            }
+        except (ValueError, IndexError) as e:
+            raise ValueError(f"/proc数据格式错误: {e}")
+
+    @classmethod
+    def disk_counters(cls, disks):
+        """diskstats: [0]读完成 [2]读扇区 [3]读耗时ms [4]写完成 [6]写扇区 [7]写耗时ms [9]I/O忙碌ms"""
+        return {
+            name: (values[0], values[4], values[2] * cls.SECTOR_BYTES, values[6] * cls.SECTOR_BYTES,
+                   values[3], values[7], values[9])
+            for name, values in disks.items() if len(values) >= 10
+        }
+
+    @staticmethod
+    def interface_counters(interfaces):
+        """net/dev: 收[0]字节 [1]包 [2]错误 [3]丢包，发[8]字节 [9]包 [10]错误 [11]丢包"""
+        return {
+            name: (values[0], values[8], values[1], values[9], values[2], values[10], values[3], values[11])
+            for name, values in interfaces.items() if len(values) >= 12
+        }
+
+    @staticmethod
+    def _cpu_percent(previous, current):
+        """由两次 /proc/stat 计数求CPU使用率；idle包含iowait"""
+        total = sum(current) - sum(previous)
+        idle = (current[3] + current[4]) - (previous[3] + previous[4])
+        if total <= 0:
+            return 0.0
+        return round(max(0.0, min(100.0, 100.0 * (total - idle) / total)), 1)
+
+    @classmethod
+    def derive(cls, previous, current):
+        """由前后两次快照计算指标
+
+        previous 为None（首次采集、重连后或远端重启）时以开机为起点，得到的是
+        开机以来的平均值，结果标记 warmup=True，只用于展示不写入历史；
+        网络速率在这种情况下不输出。
+        """
+        warmup = previous is None or current['uptime'] <= previous['uptime']
+        if warmup:
+            previous = {'uptime': 0.0, 'cpus': {}, 'disks': {}, 'interfaces': {}}
+        elapsed = current['uptime'] - previous['uptime']
+
+        cpus = current['cpus']
+        cpu = cls._cpu_percent(previous['cpus'].get('cpu', [0] * len(cpus['cpu'])), cpus['cpu'])
+        per_core = [
+            cls._cpu_percent(previous['cpus'].get(name, [0] * len(values)), values)
+            for name, values in sorted(((n, v) for n, v in cpus.items() if n != 'cpu'),
+                                       key=lambda item: int(item[0][3:]))
+        ]
+
+        # diskstats: [0]读完成次数 [2]读扇区数 [4]写完成次数 [6]写扇区数
+        def disk_delta(index):
+            return sum(values[index] - previous['disks'].get(name, [0] * len(values))[index]
+                       for name, values in current['disks'].items())
+
+        meminfo = current['meminfo']
+        memory_total_kb = meminfo.get('MemTotal', 0)
+        memory_available_kb = meminfo.get('MemAvailable', meminfo.get('MemFree', 0))
+        memory_percent = (memory_total_kb - memory_available_kb) / memory_total_kb * 100 if memory_total_kb else 0.0
+
+        disk_total_kb = current['disk_used_kb'] + current['disk_available_kb']
+        interfaces = interface_rates(cls.interface_counters(previous['interfaces']),
+                                     cls.interface_counters(current['interfaces']), elapsed)
+
+        return {
+            'cpu': cpu,
+            'cpu_per_core': per_core,
+            'load_avg': current['load_avg'],
+            'memory_percent': round(memory_percent, 1),
+            'memory_total': memory_total_kb / 1024 / 1024,  # GB
+            'memory_used': (memory_total_kb - memory_available_kb) / 1024 / 1024,  # GB
+            'disk_percent': round(current['disk_used_kb'] / disk_total_kb * 100, 1) if disk_total_kb else 0.0,
+            'disk_free': current['disk_available_kb'] / 1024 / 1024,  # GB
+            'disk_read': max(disk_delta(2), 0) * cls.SECTOR_BYTES / elapsed,  # bytes/s
+            'disk_write': max(disk_delta(6), 0) * cls.SECTOR_BYTES / elapsed,  # bytes/s
+            'disk_read_iops': max(disk_delta(0), 0) / elapsed,
+            'disk_write_iops': max(disk_delta(4), 0) / elapsed,
+            'network_recv': sum(rates['rx_bytes'] for rates in interfaces.values()),  # bytes/s
+            'network_sent': sum(rates['tx_bytes'] for rates in interfaces.values()),  # bytes/s
+            'network_recv_total': sum(values[0] for values in current['interfaces'].values()),  # 累计字节数
+            'network_sent_total': sum(values[8] for values in current['interfaces'].values()),
+            'network_interfaces': interfaces,
+            'disk_devices': disk_device_rates(cls.disk_counters(previous['disks']), cls.disk_counters(current['disks']), elapsed),
+            'warmup': warmup,
+        }
+
+
+class StreamingSampler:
+    """单个服务器的流式采集会话
+
+    在连接池的长连接上启动一个常驻的远程循环，每隔 interval 秒输出一份
+    /proc 快照（格式与 ProcMetricsScript 相同），读取线程逐行解析，每读到
+    一个完整快照就回调 on_sample(server_id, snapshot, 会话序号)。每个会话只在远端
+    启动一次进程，得到秒级分辨率；通道断开或长时间没有输出时按指数退避
+    重新建立会话。
+    """
+
+    MIN_INTERVAL = 0.5
+    MAX_INTERVAL = 300
+
+    def __init__(self, server_id, server_config, connections, on_sample, interval=1,
+                 stall_timeout=15, max_backoff=60):
+        self.server_id = server_id
+        self.server_config = server_config
+        self.connections = connections
+        self.on_sample = on_sample
+        self.interval = interval = self.clamp_interval(interval)
+        self.stall_timeout = max(stall_timeout, interval * 3)  # 超过此时间没有输出视为会话卡死
+        self.max_backoff = max_backoff
+        self.command = f"while :; do\n{ProcMetricsScript.SCRIPT}\nsleep {interval:g}\ndone"
+        self._stop = threading.Event()
+        self._channel = None
+        self.thread = None
+        self.stats = {
+            'connected': False,
+            'sessions': 0,
+            'samples': 0,
+            'parse_errors': 0,
+            'last_sample': None,
+            'last_error': None,
+        }
+
+    @classmethod
+    def clamp_interval(cls, interval):
+        """把配置中的采样间隔转换为数字并限制在合理范围内
+
+        间隔会直接拼进远程shell命令，不是有限数字的值（如 "1; rm -rf /"）抛出ValueError。
+        """
+        interval = float(interval)
+        if not math.isfinite(interval):
+            raise ValueError(f"非法的stream_interval: {interval!r}")
+        return min(max(interval, cls.MIN_INTERVAL), cls.MAX_INTERVAL)
+
+    def start(self):
+        self.thread = threading.Thread(target=self._run, name=f'stream-{self.server_id}', daemon=True)
+        self.thread.start()
+
+    def stop(self, timeout=2):
+        self._stop.set()
+        channel = self._channel
+        if channel is not None:
+            try:
+                channel.close()  # 让阻塞中的readline立即返回
+            except Exception:
+                pass
+        if self.thread and self.thread is not threading.current_thread():
+            self.thread.join(timeout=timeout)
+
+    def _run(self):
+        backoff = 1
+        while not self._stop.is_set():
+            try:
+                if self._session():
+                    backoff = 1  # 本次会话收到过数据，重连时不退避
+            except Exception as e:
+                self.stats['last_error'] = str(e)
+                if not self._stop.is_set():
+                    print(f"⚠️  流式采集会话中断: {self.server_id} - {e}")
+            if self._stop.wait(backoff):
+                break
+            backoff = min(backoff * 2, self.max_backoff)
+
+    def _session(self):
+        """运行一次会话直到通道关闭，返回是否收到过完整快照"""
+        channel, stream = self.connections.open_stream(self.server_config, self.command)
+        self._channel = channel
+        self.stats['sessions'] += 1
+        self.stats['connected'] = True
+        received = False
+        try:
+            channel.settimeout(self.stall_timeout)
+            block = None
+            for raw in iter(stream.readline, b''):
+                if self._stop.is_set():
+                    break
+                line = raw.decode(errors='replace').rstrip('\n')
+                if line.startswith(ProcMetricsScript.HEADER):
+                    block = [line]  # 新快照开始，丢弃之前不完整的内容
+                elif block is not None:
+                    block.append(line)
+                    if line.strip() == ProcMetricsScript.FOOTER:
+                        self._emit('\n'.join(block))
+                        block = None
+                        received = True
+            if not self._stop.is_set():
+                self.stats['last_error'] = '远程采集进程已退出'
+        finally:
+            self._channel = None
+            self.stats['connected'] = False
+            self.connections.close_stream(self.server_config, channel)
+        return received
+
+    def _emit(self, output):
+        try:
+            snapshot = ProcMetricsScript.parse(output)
+        except ValueError as e:
+            self.stats['parse_errors'] += 1
+            self.stats['last_error'] = str(e)
+            return
+        self.stats['samples'] += 1
+        self.stats['last_sample'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.on_sample(self.server_id, snapshot, self.stats['sessions'])
+
+
+class PollScheduler:
+    """按服务器独立计时的轮询调度器
+
+    用最小堆保存每台服务器的下次到期时间（time.monotonic）。每次采集完成后
+    才计算下一次到期时间，因此同一服务器不会同时有两个采集任务：
+    - 抖动：间隔乘以 1±jitter 的随机系数，首次采集在一个间隔内随机错开，
+      避免所有服务器同时发起SSH连接
+    - 退避：连续失败时间隔按2的幂增长，最长 max_backoff 秒
+    - 自适应：CPU变化超过 change_threshold 个百分点时按一半间隔加密采样
+    - 超时检测：采集耗时超过自身间隔，或完成时已错过下一个时间槽，记为overrun，
+      下次到期时间跳到下一个尚未到来的对齐时间槽
+    """
+
+    def __init__(self, default_interval=10, min_interval=2, max_backoff=300, jitter=0.1, change_threshold=10.0):
+        self.default_interval = default_interval
+        self.min_interval = min_interval
+        self.max_backoff = max_backoff
+        self.jitter = jitter
+        self.change_threshold = change_threshold
+        self._heap = []  # (到期时间, 序号, server_id)
+        self._entries = {}  # server_id -> 调度状态
+        self._counter = 0
+        self._lock = threading.Lock()
+        self._wakeup = threading.Event()
+
+    def _push_locked(self, server_id, due):
+        self._counter += 1
+        self._entries[server_id]['due'] = due
+        heapq.heappush(self._heap, (due, self._counter, server_id))
+
+    def _jittered(self, interval):
+        return interval * random.uniform(1 - self.jitter, 1 + self.jitter)
+
+    def add(self, server_id, interval=None):
+        """添加或重置一台服务器的调度，首次采集在一个间隔内随机错开"""
+        interval = max(float(interval or self.default_interval), self.min_interval)
+        with self._lock:
+            self._entries[server_id] = {
+                'interval': interval,
+                'current_interval': interval,
+                'failures': 0,
+                'fast': False,
+                'running': False,
+                'overruns': 0,
+                'last_value': None,
+                'due': None,
+            }
+            self._push_locked(server_id, time.monotonic() + random.uniform(0, min(interval, self.default_interval)))
+        self._wakeup.set()
+
+    def remove(self, server_id):
+        """移除服务器；堆中残留的旧条目在弹出时被忽略"""
+        with self._lock:
+            self._entries.pop(server_id, None)
+
+    def pop_due(self, now=None):
+        """取出所有已到期的服务器，并标记为运行中"""
+        now = now if now is not None else time.monotonic()
+        due = []
+        with self._lock:
+            while self._heap and self._heap[0][0] <= now:
+                due_time, _, server_id = heapq.heappop(self._heap)
+                entry = self._entries.get(server_id)
+                # 已删除或已被重新调度的条目直接丢弃
+                if entry is None or entry['due'] != due_time or entry['running']:
+                    continue
+                entry['running'] = True
+                due.append((server_id, due_time))
+        return due
+
+    def seconds_until_next(self, now=None):
+        now = now if now is not None else time.monotonic()
+        with self._lock:
+            if not self._heap:
+                return None
+            return max(self._heap[0][0] - now, 0.0)
+
+    def wake(self):
+        self._wakeup.set()
+
+    def wait(self, timeout):
+        """等待到下一次到期或有新服务器加入"""
+        self._wakeup.wait(timeout)
+        self._wakeup.clear()
+
+    def complete(self, server_id, due_time, success, duration, value=None):
+        """一次采集完成：计算下次到期时间，返回是否发生overrun"""
+        now = time.monotonic()
+        with self._lock:
+            entry = self._entries.get(server_id)
+            if entry is None:
+                return False
+            entry['running'] = False
+
+            if success:
+                entry['failures'] = 0
+                previous = entry['last_value']
+                entry['fast'] = (value is not None and previous is not None
+                                 and abs(value - previous) >= self.change_threshold)
+                if value is not None:
+                    entry['last_value'] = value
+                interval = entry['interval'] / 2 if entry['fast'] else entry['interval']
+                interval = max(interval, self.min_interval)
+            else:
+                entry['failures'] += 1
+                entry['fast'] = False
+                interval = min(entry['interval'] * 2 ** entry['failures'], self.max_backoff)
+            entry['current_interval'] = interval
+
+            next_due = due_time + self._jittered(interval)
+            overrun = duration > interval or next_due <= now
+            if overrun:
+                # 跳过已经错过的时间槽，对齐到本服务器下一个尚未到来的槽：
+                # 慢主机按自己的间隔节奏继续采集，而不是被更频繁地重试
+                entry['overruns'] += 1
+                next_due = due_time + interval * (math.floor((now - due_time) / interval) + 1)
+            self._push_locked(server_id, next_due)
+        self._wakeup.set()
+        return overrun
+
+    def snapshot(self):
+        """每台服务器的调度状态"""
+        now = time.monotonic()
+        with self._lock:
+            return {
+                server_id: {
+                    'interval': entry['interval'],
+                    'current_interval': round(entry['current_interval'], 2),
+                    'failures': entry['failures'],
+                    'fast': entry['fast'],
+                    'running': entry['running'],
+                    'overruns': entry['overruns'],
+                    'next_due_in': round(entry['due'] - now, 2) if entry['due'] is not None else None,
+                }
+                for server_id, entry in self._entries.items()
+            }
+
+
 # 服务器监控系统
+class LocalSampler:
+    """本机指标的常驻采样线程
+
+    后台线程每 interval 秒读取一次psutil计数器，用两次读取之间的
+    time.monotonic() 间隔计算CPU%、磁盘和网络速率，结果整体构建成一个新
+    字典后替换 latest 引用。读取方直接拿 latest，不加锁也不会阻塞（替换
+    引用是原子的，已发布的字典不再修改），因此请求线程里读取本机指标是
+    瞬时的，不再等待 cpu_percent(interval=1)。
+    """
+
+    def __init__(self, interval=1.0):
+        self.interval = interval
+        self.latest = None  # 最近一次发布的指标快照（只读）
+        self.samples = 0
+        self._previous = None  # (monotonic时间, cpu_times, disk_io, net_io, 分设备磁盘计数, 分接口网络计数)
+        self._stop = threading.Event()
+        self._start_lock = threading.Lock()
+        self.thread = None
+
+    def start(self):
+        """启动采样线程并立即发布第一份快照（psutil不可用时抛出ImportError）"""
+        if self.thread and self.thread.is_alive():
+            return
+        with self._start_lock:
+            if self.thread and self.thread.is_alive():
+                return
+            self._stop.clear()
+            self._sample()  # 以开机为起点的第一份快照，保证启动后立即可读
+            self.thread = threading.Thread(target=self._run, name='local-sampler', daemon=True)
+            self.thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self.thread:
+            self.thread.join(timeout=self.interval + 1)
+
+    def _run(self):
+        next_tick = time.monotonic() + self.interval
+        while not self._stop.wait(max(next_tick - time.monotonic(), 0)):
+            try:
+                self._sample()
+            except Exception as e:
+                print(f"❌ 本地采样失败: {e}")
+            next_tick += self.interval
+            if next_tick < time.monotonic():  # 落后超过一个周期时不补采
+                next_tick = time.monotonic() + self.interval
+
+    @staticmethod
+    def _cpu_busy_total(times):
+        """Linux上guest时间已计入user/nice，需从总数中扣除；idle包含iowait"""
+        total = sum(times) - getattr(times, 'guest', 0) - getattr(times, 'guest_nice', 0)
+        return total - times.idle - getattr(times, 'iowait', 0), total
+
+    @classmethod
+    def _cpu_percent(cls, previous, current):
+        busy, total = cls._cpu_busy_total(current)
+        if previous is not None:
+            previous_busy, previous_total = cls._cpu_busy_total(previous)
+            busy -= previous_busy
+            total -= previous_total
+        if total <= 0:
+            return 0.0
+        return round(max(0.0, min(100.0, 100.0 * busy / total)), 1)
+
+    def _sample(self):
+        import psutil
+
+        now = time.monotonic()
+        cpu_times = psutil.cpu_times(percpu=True)
+        disk_io = psutil.disk_io_counters()
+        per_disk = {
+            name: (io.read_count, io.write_count, io.read_bytes, io.write_bytes,
+                   io.read_time, io.write_time, getattr(io, 'busy_time', 0))
+            for name, io in (psutil.disk_io_counters(perdisk=True) or {}).items()
+            if ProcMetricsScript.WHOLE_DISK_PATTERN.match(name)
+        }
+        net_io = psutil.net_io_counters()
+        per_nic = {
+            name: (io.bytes_recv, io.bytes_sent, io.packets_recv, io.packets_sent,
+                   io.errin, io.errout, io.dropin, io.dropout)
+            for name, io in (psutil.net_io_counters(pernic=True) or {}).items()
+            if name != 'lo'
+        }
+        memory = psutil.virtual_memory()
+        disk = psutil.disk_usage('/')
+
+        previous = self._previous
+        elapsed = now - previous[0] if previous else 0.0
+
+        def rate(current, attr, prev):
+            if not elapsed or current is None or prev is None:
+                return 0.0
+            return max(getattr(current, attr) - getattr(prev, attr), 0) / elapsed
+
+        interfaces = interface_rates(previous[5] if previous else None, per_nic, elapsed)
+        per_core = [
+            self._cpu_percent(previous[1][i] if previous and i < len(previous[1]) else None, core)
+            for i, core in enumerate(cpu_times)
+        ]
+        metrics = {
+            'cpu': round(sum(per_core) / len(per_core), 1) if per_core else 0.0,
+            'cpu_per_core': per_core,
+            'load_avg': psutil.getloadavg()[0] if hasattr(psutil, 'getloadavg') else 0.0,
+            'memory_percent': memory.percent,
+            'memory_total': memory.total / (1024**3),  # GB
+            'memory_used': memory.used / (1024**3),    # GB
+            'disk_percent': disk.percent,
+            'disk_free': disk.free / (1024**3),  # GB
+            'disk_read': rate(disk_io, 'read_bytes', previous and previous[2]),  # bytes/s
+            'disk_write': rate(disk_io, 'write_bytes', previous and previous[2]),  # bytes/s
+            'disk_read_iops': rate(disk_io, 'read_count', previous and previous[2]),
+            'disk_write_iops': rate(disk_io, 'write_count', previous and previous[2]),
+            'network_recv_total': net_io.bytes_recv,  # 累计字节数
+            'network_sent_total': net_io.bytes_sent,
+            'network_interfaces': interfaces,
+            'network_recv': sum(rates['rx_bytes'] for rates in interfaces.values()),  # bytes/s
+            'network_sent': sum(rates['tx_bytes'] for rates in interfaces.values()),  # bytes/s
+            'disk_devices': disk_device_rates(previous[4], per_disk, elapsed) if previous else {},
+            'sample_interval': round(elapsed, 3),
+            'warmup': previous is None,
+        }
+        self._previous = (now, cpu_times, disk_io, net_io, per_disk, per_nic)
+        self.samples += 1
+        self.latest = metrics  # 原子替换引用，读取方无需加锁
+
+
+def _approx_size(value, depth=0):
+    """估算缓存值占用的字节数（递归累加容器及其元素的getsizeof）"""
+    size = sys.getsizeof(value)
+    if depth >= 6:
+        return size
+    if isinstance(value, dict):
+        return size + sum(_approx_size(k, depth + 1) + _approx_size(v, depth + 1) for k, v in value.items())
+    if isinstance(value, (list, tuple)):
+        return size + sum(_approx_size(item, depth + 1) for item in value)
+    return size
+
+
+class TTLCache:
+    """线程安全、有界的TTL + LRU缓存
+
+    键按哈希分到若干分片，每个分片一把锁和一个OrderedDict，后台线程写入
+    与请求线程读取只在同一分片上竞争。每个条目有自己的TTL，过期条目在
+    读取时视为未命中并删除；条目数或估算字节数超过上限时，按分片淘汰
+    最久未使用的条目（近似全局LRU）。
+
+    stale_grace > 0 时，过期条目在宽限期内继续保留：get 仍视为未命中，
+    get_stale 则返回旧值并标记为stale，供 stale-while-revalidate 使用。
+
+    同时提供dict风格的接口（cache[key] = value、get、in、pop、keys、items），
+    可以直接替换原来的普通dict。
+
+    条目为 [值, 过期时间, 估算字节数, 写入时间, 命中次数]；每个分片另按秒
+    记录命中/未命中，用于计算最近1/5/15分钟的滑动窗口命中率。
+    """
+
+    # 滑动窗口: 名称 -> 秒数
+    WINDOWS = (('1m', 60), ('5m', 300), ('15m', 900))
+
+    def __init__(self, default_ttl=30, max_entries=1024, max_bytes=64 * 1024 * 1024, stripes=8, stale_grace=0):
+        self.default_ttl = default_ttl
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.stale_grace = stale_grace
+        window_seconds = max(seconds for _, seconds in self.WINDOWS)
+        self._stripes = [
+            {'lock': threading.Lock(), 'entries': OrderedDict(), 'bytes': 0,
+             'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'sets': 0,
+             'window': deque(maxlen=window_seconds)}  # [秒, 命中, 过期命中, 未命中]
+            for _ in range(stripes)
+        ]
+        # 上限平均分到各分片，每个分片至少能放一个条目
+        self._stripe_max_entries = max(1, max_entries // stripes)
+        self._stripe_max_bytes = max(1, max_bytes // stripes)
+
+    def _stripe(self, key):
+        return self._stripes[hash(key) % len(self._stripes)]
+
+    @staticmethod
+    def _count(stripe, name):
+        """在分片锁内累加一次查找结果（总计数和当前秒的窗口桶）"""
+        stripe[name] += 1
+        second = int(time.monotonic())
+        window = stripe['window']
+        if not window or window[-1][0] != second:
+            window.append([second, 0, 0, 0])
+        window[-1][('hits', 'stale_hits', 'misses').index(name) + 1] += 1
+
+    @staticmethod
+    def _drop(stripe, key):
+        """在分片锁内删除条目并扣减字节数"""
+        entry = stripe['entries'].pop(key)
+        stripe['bytes'] -= entry[2]
+        return entry
+
+    def set(self, key, value, ttl=None):
+        """写入条目，ttl为None时使用默认TTL；超过单个分片字节上限的值不缓存"""
+        ttl = self.default_ttl if ttl is None else ttl
+        size = _approx_size(value)
+        stripe = self._stripe(key)
+        with stripe['lock']:
+            if key in stripe['entries']:
+                self._drop(stripe, key)
+            stripe['sets'] += 1
+            if size > self._stripe_max_bytes:
+                stripe['evictions'] += 1
+                return False
+            now = time.monotonic()
+            stripe['entries'][key] = [value, now + ttl, size, now, 0]
+            stripe['bytes'] += size
+            while (len(stripe['entries']) > self._stripe_max_entries
+                   or stripe['bytes'] > self._stripe_max_bytes):
+                self._drop(stripe, next(iter(stripe['entries'])))
+                stripe['evictions'] += 1
+        return True
+
+    def _lookup(self, stripe, key, allow_stale):
+        """在分片锁内查找条目，返回 (值, 是否过期) 或None；超过宽限期的条目被删除"""
+        entry = stripe['entries'].get(key)
+        if entry is None:
+            self._count(stripe, 'misses')
+            return None
+        now = time.monotonic()
+        if entry[1] <= now:
+            if entry[1] + self.stale_grace <= now:
+                self._drop(stripe, key)
+                stripe['expirations'] += 1
+                self._count(stripe, 'misses')
+                return None
+            if not allow_stale:
+                self._count(stripe, 'misses')
+                return None
+            stripe['entries'].move_to_end(key)
+            entry[4] += 1
+            self._count(stripe, 'stale_hits')
+            return entry[0], True
+        stripe['entries'].move_to_end(key)
+        entry[4] += 1
+        self._count(stripe, 'hits')
+        return entry[0], False
+
+    def get(self, key, default=None):
+        """读取未过期的条目并标记为最近使用，未命中或已过期时返回default"""
+        stripe = self._stripe(key)
+        with stripe['lock']:
+            found = self._lookup(stripe, key, allow_stale=False)
+        return found[0] if found else default
+
+    def get_stale(self, key):
+        """读取条目，过期但仍在宽限期内的也返回；返回 (值, 是否过期)，没有可用条目时返回None"""
+        stripe = self._stripe(key)
+        with stripe['lock']:
+            return self._lookup(stripe, key, allow_stale=True)
+
+    def pop(self, key, default=None):
+        stripe = self._stripe(key)
+        with stripe['lock']:
+            if key not in stripe['entries']:
+                return default
+            return self._drop(stripe, key)[0]
+
+    def purge_expired(self):
+        """删除所有已过期且超过宽限期的条目，返回删除数量"""
+        now = time.monotonic() - self.stale_grace
+        purged = 0
+        for stripe in self._stripes:
+            with stripe['lock']:
+                expired = [key for key, entry in stripe['entries'].items() if entry[1] <= now]
+                for key in expired:
+                    self._drop(stripe, key)
+                stripe['expirations'] += len(expired)
+                purged += len(expired)
+        return purged
+
+    def clear(self):
+        for stripe in self._stripes:
+            with stripe['lock']:
+                stripe['entries'].clear()
+                stripe['bytes'] = 0
+
+    # ---- dict风格接口 ----
+
+    def __setitem__(self, key, value):
+        self.set(key, value)
+
+    def __getitem__(self, key):
+        value = self.get(key, self)
+        if value is self:
+            raise KeyError(key)
+        return value
+
+    def __contains__(self, key):
+        """只判断是否存在未过期的条目，不计入命中统计也不改变LRU顺序"""
+        stripe = self._stripe(key)
+        with stripe['lock']:
+            entry = stripe['entries'].get(key)
+            return entry is not None and entry[1] > time.monotonic()
+
+    def __len__(self):
+        return sum(len(stripe['entries']) for stripe in self._stripes)
+
+    def keys(self):
+        """所有键的快照（可能包含宽限期内或尚未清理的过期条目）"""
+        result = []
+        for stripe in self._stripes:
+            with stripe['lock']:
+                result.extend(stripe['entries'].keys())
+        return result
+
+    def items(self):
+        """所有未过期条目的 (键, 值) 快照"""
+        now = time.monotonic()
+        result = []
+        for stripe in self._stripes:
+            with stripe['lock']:
+                result.extend((key, entry[0]) for key, entry in stripe['entries'].items() if entry[1] > now)
+        return result
+
+    def stats(self):
+        """命中/过期命中/未命中/淘汰/过期计数以及当前条目数和估算字节数"""
+        totals = {'hits': 0, 'stale_hits': 0, 'misses': 0, 'evictions': 0, 'expirations': 0, 'sets': 0,
+                  'entries': 0, 'bytes': 0}
+        for stripe in self._stripes:
+            with stripe['lock']:
+                for name in ('hits', 'stale_hits', 'misses', 'evictions', 'expirations', 'sets', 'bytes'):
+                    totals[name] += stripe[name]
+                totals['entries'] += len(stripe['entries'])
+        lookups = totals['hits'] + totals['stale_hits'] + totals['misses']
+        totals['hit_rate'] = round((totals['hits'] + totals['stale_hits']) / lookups, 4) if lookups else 0.0
+        totals['stale_grace'] = self.stale_grace
+        totals['max_entries'] = self.max_entries
+        totals['max_bytes'] = self.max_bytes
+        totals['windows'] = self.window_stats()
+        return totals
+
+    def window_stats(self):
+        """最近1/5/15分钟内的命中/过期命中/未命中次数和命中率"""
+        now = int(time.monotonic())
+        buckets = []
+        for stripe in self._stripes:
+            with stripe['lock']:
+                buckets.extend(list(bucket) for bucket in stripe['window'])
+
+        result = {}
+        for name, seconds in self.WINDOWS:
+            hits = stale_hits = misses = 0
+            for second, bucket_hits, bucket_stale, bucket_misses in buckets:
+                if now - second < seconds:
+                    hits += bucket_hits
+                    stale_hits += bucket_stale
+                    misses += bucket_misses
+            lookups = hits + stale_hits + misses
+            result[name] = {
+                'hits': hits, 'stale_hits': stale_hits, 'misses': misses,
+                'hit_rate': round((hits + stale_hits) / lookups, 4) if lookups else 0.0,
+            }
+        return result
+
+    def entries_info(self):
+        """每个条目的年龄、剩余TTL、估算字节数、命中次数和是否过期，按年龄从新到旧排列"""
+        now = time.monotonic()
+        result = []
+        for stripe in self._stripes:
+            with stripe['lock']:
+                for key, (_, expires, size, stored_at, hits) in stripe['entries'].items():
+                    result.append({
+                        'key': key,
+                        'age': round(now - stored_at, 3),
+                        'ttl_remaining': round(expires - now, 3),
+                        'size': size,
+                        'hits': hits,
+                        'stale': expires <= now,
+                    })
+        result.sort(key=lambda info: info['age'])
+        return result
+
+
+class SingleFlight:
+    """按键合并并发的相同计算（single-flight）
+
+    同一个键同时只有一个调用者（leader）真正执行计算，其余并发调用者
+    等待它的结果并共享；等待超过 wait_timeout 时抛出 TimeoutError，
+    leader的异常会同样抛给所有等待者。
+    """
+
+    def __init__(self, wait_timeout=30):
+        self.wait_timeout = wait_timeout
+        self._lock = threading.Lock()
+        self._calls = {}  # 键 -> 正在进行的计算
+        self.stats = {'executions': 0, 'coalesced': 0, 'wait_timeouts': 0}
+
+    def do(self, key, fn):
+        """执行或等待键对应的计算，返回 (结果, 是否为共享的结果)"""
+        with self._lock:
+            call = self._calls.get(key)
+            leader = call is None
+            if leader:
+                call = self._calls[key] = {'done': threading.Event(), 'result': None, 'error': None}
+                self.stats['executions'] += 1
+            else:
+                self.stats['coalesced'] += 1
+
+        if leader:
+            try:
+                call['result'] = fn()
+            except Exception as e:
+                call['error'] = e
+                raise
+            finally:
+                with self._lock:
+                    self._calls.pop(key, None)
+                call['done'].set()
+            return call['result'], False
+
+        if not call['done'].wait(self.wait_timeout):
+            with self._lock:
+                self.stats['wait_timeouts'] += 1
+            raise TimeoutError(f"等待进行中的请求超时: {key}")
+        if call['error'] is not None:
+            raise call['error']
+        return call['result'], True
+
+    def in_flight(self):
+        with self._lock:
+            return len(self._calls)
+
+
 class ServerMonitor:
     def __init__(self):
         self.servers = {}  # 存储服务器配置
-        self.connections = {}  # SSH连接池
+        self.host_deadline = 8  # 单台服务器一次采集（连接+执行）的时限，秒
+        self.probe = HostProbe(timeout=2)  # SSH之前的TCP预检（2秒内端口不通即判定不可达）与DNS缓存
+        self.connections = SSHConnectionPool(connect_timeout=self.host_deadline, probe=self.probe)  # SSH连接池：每个服务器复用一个长连接
+        self.default_collector = 'proc'  # 远程采集方式: proc(读取/proc计数器) / script(top、iostat等命令)
+        self.proc_snapshots = {}  # 服务器 -> (上一次/proc快照, 由它计算出的指标, 连接序号)
+        self.script_counters = {}  # 服务器 -> (monotonic时间, 上一次网络累计字节数, 连接序号)，命令脚本方式使用
+        self.min_proc_interval = 1.0  # 两次快照间隔小于1秒时复用上次结果，避免速率抖动
+        self._proc_lock = threading.Lock()
+        self.stream_interval = 1  # 流式采集（collector=stream）的采样间隔，秒
+        self.local_sampler = LocalSampler(interval=1.0)  # 本机指标常驻采样，首次读取本机指标时启动
+        self.streams = {}  # server_id -> StreamingSampler
         self.monitoring_threads = {}  # 监控线程
         self.metrics_data = {}  # 监控数据存储
         self.historical_cache = {}  # 历史数据缓存
         self.last_update_time = {}  # 上次更新时间
-        self.persistence = HistoricalDataPersistence()  # 历史数据持久化
+        self.persistence = create_persistence()  # 历史数据持久化（HISTORY_BACKEND=segment/sqlite）
 
         # 🚀 新增：性能优化缓存
-        self.performance_cache = {}  # API响应缓存
         self.cache_ttl = 30  # 缓存30秒
+        self.stale_grace = int(os.environ.get('CACHE_STALE_GRACE', 300))  # 过期后仍可返回旧数据的宽限期（秒）
+        # API响应缓存：线程安全，按条目TTL过期，条目数/字节数超限时LRU淘汰
+        self.performance_cache = TTLCache(default_ttl=self.cache_ttl, max_entries=1024, max_bytes=64 * 1024 * 1024,
+                                          stale_grace=self.stale_grace)
+        # 缓存未命中时，同一 (server_id, time_range) 的并发请求只采集一次、共享结果
+        self.metrics_flight = SingleFlight(wait_timeout=self.host_deadline * 3)
+        self._refreshing = set()  # 正在后台刷新的 (server_id, time_range)
+        self._refresh_lock = threading.Lock()
         self.max_data_points = 200  # 最多返回200个数据点
         self.background_update_interval = 10  # 后台更新间隔10秒
         self.background_thread = None  # 后台更新线程
         self.is_running = False  # 后台线程运行状态
 
+        # 并发采集：有界线程池，单台服务器的失败或超时不影响其他服务器
+        self.collector_workers = 8
+        self.collector_pool = None
+        # 每台服务器独立的采集间隔（服务器配置 interval，默认10秒），带抖动、退避和自适应加密
+        self.scheduler = PollScheduler(default_interval=self.background_update_interval)
+        self.collection_status = {}  # server_id -> 最近一次采集的结果
+        self.collector_stats = {
+            'collections': 0,
+            'overruns': 0,  # 采集耗时超过自身间隔或错过下一个时间槽的次数
+            'host_timeouts': 0,
+            'host_failures': 0,
+        }
+        # 机群负载按时间窗口（每 background_update_interval 秒一个）统计，
+        # 用于判断全部服务器的采集能否在线程池容量内按时完成
+        self.fleet_windows = deque(maxlen=360)  # 最近已结束的窗口
+        self._window = None  # 当前窗口的累计值
+        self._window_lock = threading.Lock()
+
+        # 推送模式：agent主动上报的批次状态（server_id -> 序号与计数）
+        self.ingest_state = {}
+        self._ingest_lock = threading.Lock()
+
         self.init_storage()
         self.start_background_update()  # 启动后台更新
 
@@ -545,6 +3597,8 @@ class ServerMonitor:
             return
 
         self.is_running = True
+        self.collector_pool = concurrent.futures.ThreadPoolExecutor(
+            max_workers=self.collector_workers, thread_name_prefix='collector')
         self.background_thread = threading.Thread(target=self._background_update_worker, daemon=True)
         self.background_thread.start()
         print("🔄 后台数据更新线程已启动")
@@ -552,122 +3606,262 @@ class ServerMonitor:
     def stop_background_update(self):
         """停止后台数据更新线程"""
         self.is_running = False
+        self.scheduler.wake()
         if self.background_thread:
             self.background_thread.join(timeout=5)
+        if self.collector_pool:
+            self.collector_pool.shutdown(wait=False, cancel_futures=True)
+        for server_id in list(self.streams):
+            self._stop_stream(server_id)
+        self.local_sampler.stop()
+        self.connections.close_all()
+        # 把写入队列里尚未落盘的历史数据提交完
+        self.persistence.close()
         print("🛑 后台数据更新线程已停止")
 
     def _background_update_worker(self):
         """后台数据更新工作线程"""
         import time
 
+        last_housekeeping = time.monotonic()
         while self.is_running:
             try:
-                current_time = datetime.now()
-
-                # 为每个服务器更新缓存数据
-                for server_id in list(self.servers.keys()):
-                    try:
-                        self._update_server_cache(server_id, current_time)
-                    except Exception as e:
-                        print(f"❌ 更新服务器 {server_id} 缓存失败: {e}")
-
-                # 清理过期缓存
-                self._cleanup_expired_cache(current_time)
-
-                # 等待下次更新
-                time.sleep(self.background_update_interval)
+                # 把已到期的服务器提交到线程池采集
+                self._dispatch_due()
+
+                # 清理过期缓存，回收空闲的SSH连接
+                now = time.monotonic()
+                if now - last_housekeeping >= self.background_update_interval:
+                    self._cleanup_expired_cache(datetime.now())
+                    self.connections.evict_idle()
+                    last_housekeeping = now
+
+                # 睡到下一台服务器到期（或有服务器加入/采集完成）
+                timeout = self.background_update_interval - (now - last_housekeeping)
+                next_due = self.scheduler.seconds_until_next(now)
+                if next_due is not None:
+                    timeout = min(timeout, next_due)
+                self.scheduler.wait(max(timeout, 0.05))
 
             except Exception as e:
                 print(f"❌ 后台更新线程错误: {e}")
                 time.sleep(5)
 
+    def _dispatch_due(self):
+        """取出所有到期的服务器并提交到线程池"""
+        for server_id, due_time in self.scheduler.pop_due():
+            self.collector_pool.submit(self._collect_server, server_id, due_time)
+
+    def _record_window(self, server_id, finished, duration, lag, overrun):
+        """把一次采集计入它完成时所在的时间窗口，进入新窗口时结束上一个窗口
+
+        每个窗口记录完成的采集次数、涉及的服务器数、采集线程的忙碌时间
+        （利用率 = 忙碌秒数 / (线程数 × 窗口秒数)）、最大调度延迟和overrun次数。
+        利用率接近1或延迟持续增长说明机群已超出线程池在该间隔内的处理能力。
+        """
+        length = self.background_update_interval
+        index = int(finished // length)
+        with self._window_lock:
+            window = self._window
+            if window is None or index > window['index']:
+                if window is not None:
+                    self.fleet_windows.append(self._close_window(window))
+                window = self._window = {
+                    'index': index, 'collections': 0, 'servers': set(),
+                    'busy': 0.0, 'max_lag': 0.0, 'overruns': 0,
+                }
+            window['collections'] += 1
+            window['servers'].add(server_id)
+            window['busy'] += duration
+            window['max_lag'] = max(window['max_lag'], lag)
+            window['overruns'] += int(overrun)
+
+    def _close_window(self, window):
+        length = self.background_update_interval
+        return {
+            'started': datetime.fromtimestamp(
+                time.time() - time.monotonic() + window['index'] * length).strftime('%Y-%m-%d %H:%M:%S'),
+            'collections': window['collections'],
+            'servers': len(window['servers']),
+            'utilization': round(window['busy'] / (self.collector_workers * length), 3),
+            'max_lag': round(window['max_lag'], 3),
+            'overruns': window['overruns'],
+        }
+
+    def _collect_server(self, server_id, due_time):
+        """线程池任务：采集单个服务器、记录结果并安排下一次采集，异常不会传播到其他服务器"""
+        started = time.monotonic()
+        current_time = datetime.now()
+        error = None
+        metrics = None
+        try:
+            metrics = self._update_server_cache(server_id, current_time)
+        except Exception as e:
+            error = str(e)
+            print(f"❌ 更新服务器 {server_id} 缓存失败: {e}")
+        duration = time.monotonic() - started
+        success = bool(metrics)
+
+        status = self.collection_status.setdefault(server_id, {
+            'last_success': None, 'last_error': None, 'consecutive_failures': 0,
+        })
+        status['last_duration'] = round(duration, 3)
+        status['last_attempt'] = current_time.strftime('%Y-%m-%d %H:%M:%S')
+        status['schedule_lag'] = round(started - due_time, 3)  # 到期后等待线程池的时间
+        if success:
+            status['last_success'] = status['last_attempt']
+            status['consecutive_failures'] = 0
+        else:
+            status['last_error'] = error or '未获取到监控数据'
+            status['consecutive_failures'] += 1
+            self.collector_stats['host_failures'] += 1
+        if duration > self.host_deadline:
+            self.collector_stats['host_timeouts'] += 1
+        server_config = self.servers.get(server_id)
+        if server_config:
+            status['reachable'] = self.probe.is_reachable(server_config.get('host'), server_config.get('port'))
+
+        self.collector_stats['collections'] += 1
+        overrun = self.scheduler.complete(server_id, due_time, success, duration, metrics.get('cpu') if success else None)
+        if overrun:
+            self.collector_stats['overruns'] += 1
+            print(f"⚠️  服务器 {server_id} 采集超出时间槽 (耗时 {duration:.1f}s, 延迟 {status['schedule_lag']:.1f}s)")
+        self._record_window(server_id, time.monotonic(), duration, max(started - due_time, 0.0), overrun)
+        return success
+
+    def fleet_fit(self):
+        """按时间窗口汇总的机群负载：线程利用率和调度延迟的p50/p95，以及最近60个窗口"""
+        windows = list(self.fleet_windows)
+        utilization = sorted(window['utilization'] for window in windows)
+        lags = sorted(window['max_lag'] for window in windows)
+
+        def percentile(values, q):
+            return values[min(int(len(values) * q), len(values) - 1)] if values else 0.0
+
+        return {
+            'window': self.background_update_interval,
+            'windows': len(windows),
+            'p50_utilization': percentile(utilization, 0.5),
+            'p95_utilization': percentile(utilization, 0.95),
+            'p95_max_lag': percentile(lags, 0.95),
+            # 95%的窗口里线程池未饱和，且到期的采集最多等待不到一个窗口才开始
+            'fits': percentile(utilization, 0.95) < 1 and percentile(lags, 0.95) < self.background_update_interval,
+            'recent': windows[-60:],
+        }
+
+    def collector_summary(self):
+        """采集统计：按时间窗口的机群负载、每台服务器的调度状态和最近一次采集情况"""
+        return {
+            **self.collector_stats,
+            'interval': self.background_update_interval,
+            'workers': self.collector_workers,
+            'host_deadline': self.host_deadline,
+            'fleet_fit': self.fleet_fit(),
+            'servers': {server_id: dict(status) for server_id, status in self.collection_status.items()},
+            'schedule': self.scheduler.snapshot(),
+            'streams': {server_id: dict(sampler.stats) for server_id, sampler in list(self.streams.items())},
+            'probe': self.probe.snapshot(),
+        }
+
+    def cache_summary(self):
+        """缓存统计：响应缓存的总计数、滑动窗口命中率和每个键的状态，以及合并/后台刷新和历史读缓存"""
+        with self._refresh_lock:
+            refreshing = len(self._refreshing)
+        return {
+            **self.performance_cache.stats(),
+            'ttl': self.cache_ttl,
+            'keys': self.performance_cache.entries_info(),
+            'single_flight': dict(self.metrics_flight.stats, in_flight=self.metrics_flight.in_flight()),
+            'refreshing': refreshing,
+            'historical': self.persistence.read_cache_stats(),
+        }
+
     def _update_server_cache(self, server_id, current_time):
-        """更新单个服务器的缓存数据"""
+        """更新单个服务器的缓存数据，返回采集到的实时指标（失败时返回None）"""
         if server_id not in self.servers:
-            return
+            return None
 
         server_config = self.servers[server_id]
+        # 实时指标和进程列表共用一个截止时间，一台服务器最多占用采集线程 host_deadline 秒
+        deadline = time.monotonic() + self.host_deadline
 
         # 获取实时监控数据
-        real_metrics = self.get_real_server_metrics(server_config)
+        real_metrics = self.get_real_server_metrics(server_config, timeout=self.host_deadline)
         if not real_metrics:
-            return
+            return None
+
+        self._record_metrics(server_id, current_time, real_metrics)
+
+        # 进程列表过期时用剩余时间顺带刷新，时间已用完则留到下一次采集；请求路径只读缓存
+        processes_key = f"{server_id}_processes"
+        remaining = deadline - time.monotonic()
+        if processes_key not in self.performance_cache and remaining > 0:
+            self.performance_cache.set(processes_key, self._get_real_processes(server_config, timeout=remaining),
+                                       ttl=self.cache_ttl)
+        return real_metrics
+
+    def _record_metrics(self, server_id, current_time, real_metrics):
+        """持久化一次采样，并刷新实时数据和到期的历史数据缓存
+
+        首次采样或重连后的第一个样本（warmup）没有可靠的差值基准，只用于
+        实时展示，不写入历史。
+        """
+        if not real_metrics.get('warmup'):
+            # 记录本次采样，持久化层在写入时同步推进各降采样层级；网络序列为每秒字节数
+            self.persistence.append_realtime_data(
+                server_id, current_time,
+                real_metrics.get('cpu', 0), real_metrics.get('memory_percent', 0),
+                real_metrics.get('disk_read', 0), real_metrics.get('disk_write', 0),
+                real_metrics.get('network_sent', 0), real_metrics.get('network_recv', 0),
+                real_metrics.get('load_avg', 0)
+            )
+            if real_metrics.get('disk_devices'):
+                self.persistence.append_device_metrics(server_id, 'disk', current_time, real_metrics['disk_devices'])
+            if real_metrics.get('network_interfaces'):
+                self.persistence.append_device_metrics(server_id, 'net', current_time, real_metrics['network_interfaces'])
 
         # 更新缓存中的实时数据
         cache_key = f"{server_id}_realtime"
-        self.performance_cache[cache_key] = {
+        self.performance_cache.set(cache_key, {
             'data': real_metrics,
             'timestamp': current_time,
-            'ttl': self.cache_ttl
-        }
+        }, ttl=self.cache_ttl)
 
         # 更新历史数据缓存
         for time_range in ['1h', '6h', '24h']:
             cache_key = f"{server_id}_metrics_{time_range}"
 
-            # 检查是否需要更新
-            if (cache_key not in self.performance_cache or
-                (current_time - self.performance_cache[cache_key]['timestamp']).total_seconds() > self.cache_ttl):
+            # 检查是否需要更新：条目TTL即cache_ttl，不存在未过期条目就重建。
+            # 用 in 判断，不计入命中统计，/api/cache/stats 只反映请求路径的查找
+            if cache_key not in self.performance_cache:
 
                 # 生成历史数据
                 historical_data = self._get_cached_historical_data(server_id, time_range, real_metrics)
 
-                self.performance_cache[cache_key] = {
+                self.performance_cache.set(cache_key, {
                     'data': historical_data,
                     'timestamp': current_time,
-                    'ttl': self.cache_ttl
-                }
+                }, ttl=self.cache_ttl)
 
                 print(f"🔄 已更新缓存: {cache_key}")
 
     def _cleanup_expired_cache(self, current_time):
         """清理过期的缓存数据"""
-        expired_keys = []
-
-        for cache_key, cache_data in self.performance_cache.items():
-            if (current_time - cache_data['timestamp']).total_seconds() > cache_data['ttl']:
-                expired_keys.append(cache_key)
-
-        for key in expired_keys:
-            del self.performance_cache[key]
-
-        if expired_keys:
-            print(f"🧹 清理了 {len(expired_keys)} 个过期缓存")
+        purged = self.performance_cache.purge_expired()
+        if purged:
+            print(f"🧹 清理了 {purged} 个过期缓存")
 
     def _get_cached_historical_data(self, server_id, time_range, current_metrics):
         """获取缓存的历史数据（限制数据点数量）"""
-        # 优先从文件加载历史数据
-        historical_data = self.persistence.load_historical_data(server_id)
+        # 优先从持久化存储按时间范围查询，超过上限的部分在存储层降采样
+        end_ts = int(time.time())
+        start_ts = end_ts - TIME_RANGE_SECONDS.get(time_range, 3600)
+        historical_data = self.persistence.query_range(server_id, start_ts, end_ts, max_points=self.max_data_points)
 
         if historical_data and historical_data.get('timestamps'):
-            # 限制数据点数量
-            timestamps = historical_data['timestamps']
-            if len(timestamps) > self.max_data_points:
-                # 均匀采样，保留最重要的数据点
-                step = len(timestamps) // self.max_data_points
-                indices = list(range(0, len(timestamps), step))
-                if len(indices) > self.max_data_points:
-                    indices = indices[:self.max_data_points]
-
-                # 确保包含最新的数据点
-                if indices[-1] != len(timestamps) - 1:
-                    indices[-1] = len(timestamps) - 1
-
-                # 重新构建数据
-                sampled_data = {
-                    'timestamps': [timestamps[i] for i in indices],
-                    'cpu_data': [historical_data.get('cpu_data', [])[i] if i < len(historical_data.get('cpu_data', [])) else 0 for i in indices],
-                    'memory_data': [historical_data.get('memory_data', [])[i] if i < len(historical_data.get('memory_data', [])) else 0 for i in indices],
-                    'disk_read_data': [historical_data.get('disk_read_data', [])[i] if i < len(historical_data.get('disk_read_data', [])) else 0 for i in indices],
-                    'disk_write_data': [historical_data.get('disk_write_data', [])[i] if i < len(historical_data.get('disk_write_data', [])) else 0 for i in indices],
-                    'network_sent': [historical_data.get('network_sent', [])[i] if i < len(historical_data.get('network_sent', [])) else 0 for i in indices],
-                    'network_recv': [historical_data.get('network_recv', [])[i] if i < len(historical_data.get('network_recv', [])) else 0 for i in indices]
-                }
-
-                print(f"📊 数据采样: {len(timestamps)} -> {len(sampled_data['timestamps'])} 个数据点")
-                return sampled_data
-            else:
-                return historical_data
+            historical_data.pop('load_avg', None)
+            print(f"📊 历史数据查询: {server_id} {time_range} -> {len(historical_data['timestamps'])} 个数据点")
+            return historical_data
         else:
             # 如果没有历史数据，生成新的（但限制数量）
             return self._generate_historical_data(time_range, current_metrics, limit_points=True)
@@ -676,24 +3870,100 @@ class ServerMonitor:
         """添加服务器配置"""
         server_id = server_config.get('id') or f"server_{len(self.servers) + 1}"
         server_config['id'] = server_id
+        self._validate_config(server_config)
+        # 可选的保留期覆盖，如 {"raw": "72h", "1h": "730d"}
+        self.persistence.retention.set_server_policy(server_id, server_config.get('retention'))
         self.servers[server_id] = server_config
+        self._schedule_server(server_id, server_config)
         return server_id
 
+    @staticmethod
+    def _validate_config(server_config):
+        """在保存配置前规范化会被拼进远程命令的字段，非法值抛出ValueError"""
+        if server_config.get('stream_interval') is not None:
+            server_config['stream_interval'] = StreamingSampler.clamp_interval(server_config['stream_interval'])
+
+    def _schedule_server(self, server_id, server_config):
+        """推送模式（collector=agent）的服务器由agent上报，流式模式（collector=stream）
+        由常驻SSH会话持续输出，二者都不参与轮询；本地服务器不支持流式，仍按轮询采集"""
+        self._stop_stream(server_id)
+        collector = server_config.get('collector')
+        is_local = server_config.get('host') in ['localhost', '127.0.0.1'] or server_config.get('auth_type') == 'local'
+        if collector == 'agent':
+            self.scheduler.remove(server_id)
+        elif collector == 'stream' and PARAMIKO_AVAILABLE and not is_local:
+            self.scheduler.remove(server_id)
+            sampler = StreamingSampler(server_id, server_config, self.connections, self._on_stream_sample,
+                                       interval=server_config.get('stream_interval', self.stream_interval),
+                                       stall_timeout=self.host_deadline * 2)
+            self.streams[server_id] = sampler
+            sampler.start()
+            print(f"📡 已启动流式采集: {server_id}")
+        else:
+            self.scheduler.add(server_id, server_config.get('interval'))
+
+    def _stop_stream(self, server_id):
+        sampler = self.streams.pop(server_id, None)
+        if sampler:
+            sampler.stop()
+
+    def _on_stream_sample(self, server_id, snapshot, session):
+        """流式会话每读到一个完整快照调用一次（在该服务器的读取线程中）
+
+        每个新会话的第一个快照只作为基准（warmup），不与上一个会话的快照求差。
+        """
+        with self._proc_lock:
+            previous = self.proc_snapshots.get(server_id)
+            if previous and previous[2] != session:
+                previous = None
+            metrics = ProcMetricsScript.derive(previous[0] if previous else None, snapshot)
+            self.proc_snapshots[server_id] = (snapshot, metrics, session)
+
+        current_time = datetime.now()
+        try:
+            self._record_metrics(server_id, current_time, metrics)
+        except Exception as e:
+            print(f"❌ 记录流式采样失败: {server_id} - {e}")
+            return
+        status = self.collection_status.setdefault(server_id, {
+            'last_success': None, 'last_error': None, 'consecutive_failures': 0,
+        })
+        status['last_attempt'] = status['last_success'] = current_time.strftime('%Y-%m-%d %H:%M:%S')
+        status['consecutive_failures'] = 0
+
+        # 进程列表不在流式快照中，按缓存TTL单独刷新
+        if f"{server_id}_processes" not in self.performance_cache:
+            self._refresh_processes_async(server_id)
+
     def update_server(self, server_id, server_config):
         """更新服务器配置"""
         if server_id in self.servers:
             server_config['id'] = server_id
+            self._validate_config(server_config)
+            self.persistence.retention.set_server_policy(server_id, server_config.get('retention'))
             self.servers[server_id] = server_config
+            self._stop_stream(server_id)  # 先结束流式会话再关闭它所用的连接
+            self.connections.close(server_id)  # 连接参数可能已变化
+            self.proc_snapshots.pop(server_id, None)
+            self.script_counters.pop(server_id, None)
+            self._schedule_server(server_id, server_config)
             return True
         return False
 
     def delete_server(self, server_id):
         """删除服务器"""
         if server_id in self.servers:
-            # 停止监控
-            self.stop_monitoring(server_id)
-            # 删除配置
+            # 删除配置并停止调度，后台线程不会再采集该服务器
             del self.servers[server_id]
+            self.scheduler.remove(server_id)
+            self.persistence.retention.clear_server_policy(server_id)
+            self._stop_stream(server_id)  # 先结束流式会话再关闭它所用的连接
+            self.connections.close(server_id)
+            self.proc_snapshots.pop(server_id, None)
+            self.script_counters.pop(server_id, None)
+            self.collection_status.pop(server_id, None)
+            with self._ingest_lock:
+                self.ingest_state.pop(server_id, None)
             # 清理数据
             if server_id in self.metrics_data:
                 del self.metrics_data[server_id]
@@ -722,6 +3992,10 @@ class ServerMonitor:
 
             print(f"📡 正在连接到 {host}:{port}...")
 
+            # TCP预检：端口不通或主机名无法解析时几秒内返回，不等待SSH超时
+            sock = self.probe.connect(host, port)
+            print(f"📶 TCP端口可达 ({self.probe.hosts[f'{host}:{port}']['latency_ms']}ms)")
+
             # 创建SSH客户端
             ssh = paramiko.SSHClient()
             ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
@@ -730,6 +4004,7 @@ class ServerMonitor:
             if auth_type == 'password':
                 password = server_config.get('password')
                 if not password:
+                    sock.close()
                     return False, "密码认证需要提供密码"
 
                 print(f"🔐 使用密码认证连接...")
@@ -738,6 +4013,7 @@ class ServerMonitor:
                     port=port,
                     username=username,
                     password=password,
+                    sock=sock,
                     timeout=30,  # 增加到30秒
                     allow_agent=False,  # 禁用SSH代理
                     look_for_keys=False  # 禁用自动查找密钥
@@ -747,6 +4023,7 @@ class ServerMonitor:
                 key_password = server_config.get('key_password')
 
                 if not private_key_path:
+                    sock.close()
                     return False, "密钥认证需要提供私钥文件路径"
 
                 print(f"🔑 使用密钥认证连接: {private_key_path}")
@@ -763,6 +4040,7 @@ class ServerMonitor:
                         private_key = paramiko.Ed25519Key.from_private_key_file(private_key_path, password=key_password)
                     except Exception as key_error:
                         print(f"❌ 密钥加载失败: {key_error}")
+                        sock.close()
                         return False, f"无法加载私钥文件: {private_key_path} - {str(key_error)}"
 
                 ssh.connect(
@@ -770,11 +4048,13 @@ class ServerMonitor:
                     port=port,
                     username=username,
                     pkey=private_key,
+                    sock=sock,
                     timeout=30,  # 增加到30秒
                     allow_agent=False,
                     look_for_keys=False
                 )
             else:
+                sock.close()
                 return False, f"不支持的认证方式: {auth_type}"
 
             print(f"✅ SSH连接建立成功")
@@ -826,183 +4106,154 @@ class ServerMonitor:
             print(f"❌ 未知错误: {e}")
             return False, f"连接失败: {str(e)}"
 
-    def get_real_server_metrics(self, server_config):
-        """获取真实服务器监控数据"""
+    def get_real_server_metrics(self, server_config, timeout=None):
+        """获取真实服务器监控数据，远程采集最多用时 timeout 秒（默认 host_deadline）"""
+        if server_config.get('collector') == 'agent':
+            # 推送模式的主机不开放SSH，只使用agent最近一次推送的样本
+            with self._ingest_lock:
+                state = self.ingest_state.get(server_config.get('id'))
+                return dict(state['latest']) if state and state.get('latest') else None
+
+        if server_config.get('id') in self.streams:
+            # 流式采集的服务器使用常驻会话最近一次的快照，不再另开一次性采集
+            with self._proc_lock:
+                latest = self.proc_snapshots.get(server_config['id'])
+            return dict(latest[1]) if latest else None
+
         if not PARAMIKO_AVAILABLE:
             return None
 
         try:
             host = server_config['host']
-            port = server_config['port']
-            username = server_config['username']
             auth_type = server_config.get('auth_type', 'password')
 
             # 本地服务器使用psutil
             if host in ['localhost', '127.0.0.1'] or auth_type == 'local':
                 return self._get_local_metrics()
 
-            # 远程服务器使用SSH
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            # 连接服务器
-            if auth_type == 'password':
-                ssh.connect(
-                    hostname=host,
-                    port=port,
-                    username=username,
-                    password=server_config.get('password'),
-                    timeout=30  # 增加到30秒
-                )
-            else:  # key认证
-                private_key_path = server_config.get('private_key_path')
-                key_password = server_config.get('key_password')
-
-                try:
-                    private_key = paramiko.RSAKey.from_private_key_file(private_key_path, password=key_password)
-                except:
-                    private_key = paramiko.Ed25519Key.from_private_key_file(private_key_path, password=key_password)
-
-                ssh.connect(
-                    hostname=host,
-                    port=port,
-                    username=username,
-                    pkey=private_key,
-                    timeout=30  # 增加到30秒
-                )
-
-            # 获取系统信息
-            metrics = {}
-
-            # CPU信息
-            stdin, stdout, stderr = ssh.exec_command("top -bn1 | grep 'Cpu(s)' | awk '{print $2}' | cut -d'%' -f1")
-            cpu_usage = stdout.read().decode().strip()
-            try:
-                metrics['cpu'] = float(cpu_usage)
-            except:
-                metrics['cpu'] = 0.0
-
-            # 负载平均值
-            stdin, stdout, stderr = ssh.exec_command("uptime | awk -F'load average:' '{print $2}' | awk '{print $1}' | tr -d ','")
-            load_avg = stdout.read().decode().strip()
-            try:
-                metrics['load_avg'] = float(load_avg)
-            except:
-                metrics['load_avg'] = 0.0
-
-            # 内存信息
-            stdin, stdout, stderr = ssh.exec_command("free | grep Mem | awk '{printf \"%.1f %.1f\", $3/$2*100, $2/1024/1024}'")
-            memory_info = stdout.read().decode().strip().split()
-            try:
-                metrics['memory_percent'] = float(memory_info[0])
-                metrics['memory_total'] = float(memory_info[1])
-                metrics['memory_used'] = metrics['memory_total'] * metrics['memory_percent'] / 100
-            except:
-                metrics['memory_percent'] = 0.0
-                metrics['memory_total'] = 0.0
-                metrics['memory_used'] = 0.0
-
-            # 磁盘信息
-            stdin, stdout, stderr = ssh.exec_command("df -h / | tail -1 | awk '{print $5}' | tr -d '%'")
-            disk_usage = stdout.read().decode().strip()
+            # 远程服务器：在连接池的长连接上一次往返执行采集脚本
+            collector = server_config.get('collector', self.default_collector)
+            script = ProcMetricsScript if collector == 'proc' else RemoteMetricsScript
+            output, error_output = self.connections.run(server_config, script.SCRIPT, timeout=timeout or self.host_deadline)
             try:
-                metrics['disk_percent'] = float(disk_usage)
-            except:
-                metrics['disk_percent'] = 0.0
-
-            stdin, stdout, stderr = ssh.exec_command("df -BG / | tail -1 | awk '{print $4}' | tr -d 'G'")
-            disk_free = stdout.read().decode().strip()
-            try:
-                metrics['disk_free'] = float(disk_free)
-            except:
-                metrics['disk_free'] = 0.0
-
-            # 磁盘IO信息 - 使用iostat获取读写速度
-            stdin, stdout, stderr = ssh.exec_command("iostat -d 1 2 | tail -n +4 | grep -E '(vda|sda|nvme)' | tail -1 | awk '{print $3, $4}'")
-            disk_io_info = stdout.read().decode().strip().split()
-            try:
-                if len(disk_io_info) >= 2:
-                    # iostat输出的是kB/s，转换为字节/s
-                    metrics['disk_read'] = float(disk_io_info[0]) * 1024  # kB/s -> B/s
-                    metrics['disk_write'] = float(disk_io_info[1]) * 1024  # kB/s -> B/s
+                key = SSHConnectionPool.pool_key(server_config)
+                connection_id = self.connections.connection_id(server_config)
+                if collector == 'proc':
+                    metrics = self._derive_proc_metrics(key, ProcMetricsScript.parse(output), connection_id)
                 else:
-                    metrics['disk_read'] = 0.0
-                    metrics['disk_write'] = 0.0
-            except:
-                metrics['disk_read'] = 0.0
-                metrics['disk_write'] = 0.0
-
-            # 网络信息（简化版）
-            stdin, stdout, stderr = ssh.exec_command("cat /proc/net/dev | grep -E '(eth0|ens|enp)' | head -1 | awk '{print $2, $10}'")
-            network_info = stdout.read().decode().strip().split()
-            try:
-                metrics['network_recv'] = int(network_info[0]) if len(network_info) > 0 else 0
-                metrics['network_sent'] = int(network_info[1]) if len(network_info) > 1 else 0
-            except:
-                metrics['network_recv'] = 0
-                metrics['network_sent'] = 0
+                    metrics = self._derive_script_network(key, RemoteMetricsScript.parse(output), connection_id)
+            except ValueError as e:
+                print(f"❌ 解析远程监控数据失败: {host} - {e}")
+                if error_output.strip():
+                    print(f"⚠️ 远程采集错误输出: {error_output.strip()}")
+                return None
 
-            ssh.close()
             return metrics
 
         except Exception as e:
             print(f"获取服务器监控数据失败: {e}")
             return None
 
-    def _get_local_metrics(self):
-        """获取本地服务器监控数据"""
-        try:
-            import psutil
-
-            metrics = {}
-
-            # CPU信息
-            metrics['cpu'] = psutil.cpu_percent(interval=1)
-            metrics['load_avg'] = psutil.getloadavg()[0] if hasattr(psutil, 'getloadavg') else 0.0
-
-            # 内存信息
-            memory = psutil.virtual_memory()
-            metrics['memory_percent'] = memory.percent
-            metrics['memory_total'] = memory.total / (1024**3)  # GB
-            metrics['memory_used'] = memory.used / (1024**3)    # GB
-
-            # 磁盘信息
-            disk = psutil.disk_usage('/')
-            metrics['disk_percent'] = disk.percent
-            metrics['disk_free'] = disk.free / (1024**3)  # GB
-
-            # 磁盘IO信息
-            disk_io = psutil.disk_io_counters()
-            if disk_io:
-                # 获取当前时间戳，计算IO速率
-                current_time = time.time()
-                if hasattr(self, '_last_disk_io') and hasattr(self, '_last_disk_time'):
-                    time_diff = current_time - self._last_disk_time
-                    if time_diff > 0:
-                        read_diff = disk_io.read_bytes - self._last_disk_io.read_bytes
-                        write_diff = disk_io.write_bytes - self._last_disk_io.write_bytes
-                        metrics['disk_read'] = read_diff / time_diff  # bytes/s
-                        metrics['disk_write'] = write_diff / time_diff  # bytes/s
-                    else:
-                        metrics['disk_read'] = 0.0
-                        metrics['disk_write'] = 0.0
-                else:
-                    metrics['disk_read'] = 0.0
-                    metrics['disk_write'] = 0.0
+    def ingest_batch(self, header, samples):
+        """写入agent推送的一批样本
+
+        每个agent（agent_id）的样本序号单调递增，序号不大于已确认序号的样本
+        是重传，直接跳过，因此agent重发整批是安全的。agent_id变化（agent
+        状态被清空后重新开始计数）时重置已确认序号。
+        """
+        server_id = header['server_id']
+        with self._ingest_lock:
+            state = self.ingest_state.get(server_id)
+            if state is None or state['agent_id'] != header['agent_id']:
+                state = self.ingest_state[server_id] = {
+                    'agent_id': header['agent_id'], 'last_seq': 0, 'batches': 0,
+                    'samples': 0, 'duplicates': 0, 'gaps': 0, 'last_batch': None,
+                }
 
-                # 保存当前值用于下次计算
-                self._last_disk_io = disk_io
-                self._last_disk_time = current_time
-            else:
-                metrics['disk_read'] = 0.0
-                metrics['disk_write'] = 0.0
+            fresh = [sample for sample in samples if sample['seq'] > state['last_seq']]
+            fresh.sort(key=lambda sample: sample['seq'])
+            duplicates = len(samples) - len(fresh)
+            if fresh:
+                if fresh[0]['seq'] > state['last_seq'] + 1 and state['last_seq']:
+                    state['gaps'] += 1  # agent的本地缓存曾被截断
+                historical_data = {'timestamps': [sample['ts'] for sample in fresh]}
+                for field in HISTORY_FIELDS:
+                    historical_data[field] = [sample.get(field, 0.0) for sample in fresh]
+                if not self.persistence.save_historical_data(server_id, historical_data):
+                    raise RuntimeError('写入队列已满，请稍后重试')
+                state['last_seq'] = fresh[-1]['seq']
+
+            state['batches'] += 1
+            state['samples'] += len(fresh)
+            state['duplicates'] += duplicates
+            state['last_batch'] = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            acked_seq = state['last_seq']
+
+        if fresh:
+            # 最新样本作为实时数据，与SSH采集写入同一个缓存键；
+            # 同时保存在ingest_state中，缓存过期后 get_real_server_metrics 仍可使用
+            latest = fresh[-1]
+            current = {
+                'cpu': latest.get('cpu', 0.0),
+                'memory_percent': latest.get('memory', 0.0),
+                'disk_read': latest.get('disk_read', 0.0),
+                'disk_write': latest.get('disk_write', 0.0),
+                'network_sent': latest.get('network_sent', 0),
+                'network_recv': latest.get('network_recv', 0),
+                'load_avg': latest.get('load_avg', 0.0),
+            }
+            with self._ingest_lock:
+                state['latest'] = current
+            self.performance_cache.set(f"{server_id}_realtime", {
+                'data': current,
+                'timestamp': datetime.now(),
+            }, ttl=self.cache_ttl)
+        return {'accepted': len(fresh), 'duplicates': duplicates, 'acked_seq': acked_seq}
+
+    def _derive_proc_metrics(self, key, snapshot, connection_id):
+        """用该服务器上一次的/proc快照计算速率类指标，并保存本次快照
+
+        connection_id 与上一次快照不同（中间发生过重连）时不使用上一次快照，
+        本次作为新的基准（warmup）。
+        """
+        with self._proc_lock:
+            previous = self.proc_snapshots.get(key)
+            if previous and previous[2] != connection_id:
+                previous = None
+            if previous:
+                elapsed = snapshot['uptime'] - previous[0]['uptime']
+                if 0 <= elapsed < self.min_proc_interval:
+                    return previous[1]
+            metrics = ProcMetricsScript.derive(previous[0] if previous else None, snapshot)
+            self.proc_snapshots[key] = (snapshot, metrics, connection_id)
+            return metrics
 
-            # 网络信息
-            network = psutil.net_io_counters()
-            metrics['network_recv'] = network.bytes_recv
-            metrics['network_sent'] = network.bytes_sent
+    def _derive_script_network(self, key, metrics, connection_id):
+        """命令脚本方式只返回单个接口的累计字节数，按两次采集的间隔换算为每秒速率"""
+        now = time.monotonic()
+        counters = (metrics['network_recv'], metrics['network_sent'])
+        with self._proc_lock:
+            previous = self.script_counters.get(key)
+            self.script_counters[key] = (now, counters, connection_id)
+
+        deltas = None
+        if previous and previous[2] == connection_id and now > previous[0]:
+            deltas = [counter_delta(then, value) for then, value in zip(previous[1], counters)]
+        metrics['network_recv_total'], metrics['network_sent_total'] = counters
+        metrics['warmup'] = not deltas or None in deltas
+        if metrics['warmup']:
+            metrics['network_recv'] = metrics['network_sent'] = 0.0
+        else:
+            elapsed = now - previous[0]
+            metrics['network_recv'] = round(deltas[0] / elapsed, 2)
+            metrics['network_sent'] = round(deltas[1] / elapsed, 2)
+        return metrics
 
-            return metrics
+    def _get_local_metrics(self):
+        """获取本地服务器监控数据（读取本机采样线程的最新快照，不阻塞）"""
+        try:
+            self.local_sampler.start()
+            return dict(self.local_sampler.latest)
 
         except ImportError:
             print("psutil库未安装，无法获取本地监控数据")
@@ -1022,52 +4273,134 @@ class ServerMonitor:
         print(f"🔍 查找缓存: {cache_key}")
         print(f"📦 当前缓存键: {list(self.performance_cache.keys())}")
 
-        # 🔥 优先从缓存获取数据
-        if cache_key in self.performance_cache:
-            cache_data = self.performance_cache[cache_key]
+        # 🔥 优先从缓存获取数据（只读取一次，条目可能在两次访问之间过期）
+        # stale-while-revalidate：过期但仍在宽限期内的数据立即返回，同时在后台刷新
+        cached = self.performance_cache.get_stale(cache_key)
+        if cached is not None:
+            cache_data, stale = cached
             cache_age = (current_time - cache_data['timestamp']).total_seconds()
+            print(f"⚡ 从缓存获取数据: {server_id} ({cache_age:.1f}s前{', 已过期，后台刷新' if stale else ''})")
+
+            # 实时数据和进程列表同样只读缓存：缺失时返回空数据并标记为stale，
+            # 由后台刷新补齐，命中缓存的请求从不同步等待SSH采集
+            realtime_cache = self.performance_cache.get_stale(f"{server_id}_realtime")
+            if realtime_cache is not None:
+                current_metrics = realtime_cache[0]['data']
+                stale = stale or realtime_cache[1]
+            else:
+                current_metrics = {}
+                stale = True
 
-            if cache_age < self.cache_ttl:
-                print(f"⚡ 从缓存获取数据: {server_id} ({cache_age:.1f}s前)")
+            processes_cache = self.performance_cache.get_stale(f"{server_id}_processes")
+            if processes_cache is not None:
+                processes = processes_cache[0]
+                stale = stale or processes_cache[1]
+            else:
+                processes = []
+                stale = True
 
-                # 获取实时数据
-                realtime_cache_key = f"{server_id}_realtime"
-                current_metrics = None
-                if realtime_cache_key in self.performance_cache:
-                    current_metrics = self.performance_cache[realtime_cache_key]['data']
+            if stale:
+                self._refresh_async(server_id, time_range)
 
-                if not current_metrics:
-                    # 如果缓存中没有实时数据，快速获取
-                    server_config = self.servers[server_id]
-                    current_metrics = self.get_real_server_metrics(server_config)
+            return {
+                'current': current_metrics,
+                'historical': self._format_historical(cache_data['data']),
+                'processes': processes,
+                'cache_info': {
+                    'cache_hit': True,
+                    'cache_age': f"{cache_age:.1f}s",
+                    'stale': stale,
+                    'last_update': current_time.strftime('%Y-%m-%d %H:%M:%S')
+                }
+            }
 
-                if not current_metrics:
-                    return {
-                        'error': '无法连接到服务器或获取监控数据',
-                        'suggestion': '请检查服务器连接状态和配置'
-                    }
+        # 🐌 缓存未命中，获取新数据（这种情况应该很少发生，因为后台线程在更新）
+        # 同一服务器和时间范围的并发未命中只建立一次SSH采集，其余请求等待并共享结果
+        try:
+            result, coalesced = self.metrics_flight.do(
+                (server_id, time_range), lambda: self._load_server_metrics(server_id, time_range, current_time))
+        except TimeoutError:
+            return {
+                'error': '获取监控数据超时',
+                'suggestion': '同一服务器的数据正在采集中，请稍后重试'
+            }
+        if coalesced and 'cache_info' in result:
+            result = dict(result, cache_info=dict(result['cache_info'], coalesced=True))
+        return result
 
-                # 获取进程数据（也可以缓存）
-                processes = self._get_real_processes(self.servers[server_id])
+    def _refresh_async(self, server_id, time_range):
+        """在采集线程池中刷新过期的缓存；同一个键同时只提交一次刷新"""
+        key = (server_id, time_range)
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
 
-                return {
-                    'current': current_metrics,
-                    'historical': cache_data['data'],
-                    'processes': processes,
-                    'cache_info': {
-                        'cache_hit': True,
-                        'cache_age': f"{cache_age:.1f}s",
-                        'last_update': current_time.strftime('%Y-%m-%d %H:%M:%S')
-                    }
-                }
+        def refresh():
+            try:
+                self.metrics_flight.do(key, lambda: self._load_server_metrics(server_id, time_range, datetime.now()))
+            except Exception as e:
+                print(f"❌ 后台刷新缓存失败: {server_id} {time_range} - {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
 
-        # 🐌 缓存未命中，获取新数据（这种情况应该很少发生，因为后台线程在更新）
+        try:
+            self.collector_pool.submit(refresh)
+        except RuntimeError:  # 线程池已关闭
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+    def _refresh_processes_async(self, server_id):
+        """流式采集的服务器不经过轮询，进程列表过期后在采集线程池中单独刷新；
+        同一服务器同时只提交一次"""
+        key = (server_id, 'processes')
+        with self._refresh_lock:
+            if key in self._refreshing:
+                return
+            self._refreshing.add(key)
+
+        def refresh():
+            try:
+                server_config = self.servers.get(server_id)
+                if server_config:
+                    self.performance_cache.set(f"{server_id}_processes",
+                                               self._get_real_processes(server_config), ttl=self.cache_ttl)
+            except Exception as e:
+                print(f"❌ 刷新进程列表失败: {server_id} - {e}")
+            finally:
+                with self._refresh_lock:
+                    self._refreshing.discard(key)
+
+        try:
+            self.collector_pool.submit(refresh)
+        except RuntimeError:  # 线程池已关闭
+            with self._refresh_lock:
+                self._refreshing.discard(key)
+
+    def _load_server_metrics(self, server_id, time_range, current_time):
+        """缓存未命中时采集实时数据、查询历史数据和进程列表，并写入缓存"""
+        cache_key = f"{server_id}_metrics_{time_range}"
         print(f"🔄 缓存未命中，获取新数据: {server_id}")
 
         server_config = self.servers[server_id]
-        real_metrics = self.get_real_server_metrics(server_config)
+        deadline = time.monotonic() + self.host_deadline  # 实时指标和进程列表共用的截止时间
+        real_metrics = self.get_real_server_metrics(server_config, timeout=self.host_deadline)
+
+        pushed = server_config.get('collector') == 'agent'
+        streamed = server_id in self.streams
 
         if not real_metrics:
+            if pushed:
+                return {
+                    'error': '尚未收到agent推送的监控数据',
+                    'suggestion': '请检查agent是否在运行以及INGEST_TOKEN配置'
+                }
+            if streamed:
+                return {
+                    'error': '流式采集尚未产生数据',
+                    'suggestion': '流式会话正在建立，请稍后重试'
+                }
             return {
                 'error': '无法连接到服务器或获取监控数据',
                 'suggestion': '请检查服务器连接状态和配置'
@@ -1076,28 +4409,57 @@ class ServerMonitor:
         # 获取历史数据（限制数据点）
         historical_data = self._get_cached_historical_data(server_id, time_range, real_metrics)
 
-        # 更新缓存
-        self.performance_cache[cache_key] = {
+        # 获取进程数据；流式采集的进程列表由采样回调按自己的节奏刷新，这里只读缓存
+        if streamed:
+            processes = self.performance_cache.get(f"{server_id}_processes")
+            if processes is None:
+                self._refresh_processes_async(server_id)
+                processes = []
+        else:
+            remaining = deadline - time.monotonic()
+            # 时间已用完时本次不返回进程列表，也不缓存空列表
+            processes = self._get_real_processes(server_config, timeout=remaining) if remaining > 0 else None
+
+        # 更新缓存（实时数据和进程列表也一并刷新，供stale-while-revalidate使用）；
+        # 推送和流式模式的实时数据只由ingest/采样回调写入，这里不延长旧样本的有效期
+        self.performance_cache.set(cache_key, {
             'data': historical_data,
             'timestamp': current_time,
-            'ttl': self.cache_ttl
-        }
-
-        # 获取进程数据
-        processes = self._get_real_processes(server_config)
+        }, ttl=self.cache_ttl)
+        if not (pushed or streamed):
+            self.performance_cache.set(f"{server_id}_realtime", {
+                'data': real_metrics,
+                'timestamp': current_time,
+            }, ttl=self.cache_ttl)
+        if processes is None:
+            processes = []
+        elif not streamed:
+            self.performance_cache.set(f"{server_id}_processes", processes, ttl=self.cache_ttl)
 
         return {
             'current': real_metrics,
-            'historical': historical_data,
+            'historical': self._format_historical(historical_data),
             'processes': processes,
             'cache_info': {
                 'cache_hit': False,
+                'stale': False,
                 'last_update': current_time.strftime('%Y-%m-%d %H:%M:%S')
             }
         }
 
 
 
+    @staticmethod
+    def _format_historical(historical_data):
+        """API出口：把内部的epoch秒时间戳转换为前端使用的'%H:%M:%S'格式"""
+        if not historical_data or not historical_data.get('timestamps'):
+            return historical_data
+        formatted = dict(historical_data)
+        formatted['timestamps'] = [
+            datetime.fromtimestamp(ts).strftime('%H:%M:%S') for ts in historical_data['timestamps']
+        ]
+        return formatted
+
     def _generate_historical_data(self, time_range, current_metrics, limit_points=False):
         """生成历史数据（带缓存机制和数据点限制）"""
         current_time = datetime.now()
@@ -1149,7 +4511,7 @@ class ServerMonitor:
 
             # 添加新的数据点（当前实时数据）
             new_data_point = {
-                'timestamp': current_time,
+                'timestamp': int(current_time.timestamp()),
                 'cpu': current_metrics.get('cpu', 0),
                 'memory': current_metrics.get('memory_percent', 0),
                 'disk_read': current_metrics.get('disk_read', 0),
@@ -1181,7 +4543,7 @@ class ServerMonitor:
         network_recv_data = []
 
         for point in cache['data_points'][-points:]:  # 取最新的points个数据点
-            timestamps.append(point['timestamp'].strftime('%H:%M:%S'))
+            timestamps.append(point['timestamp'])
             cpu_data.append(round(point['cpu'], 1))
             memory_data.append(round(point['memory'], 1))
             disk_read_data.append(int(point['disk_read']))
@@ -1208,57 +4570,28 @@ class ServerMonitor:
 
 
 
-    def _get_real_processes(self, server_config):
-        """获取真实进程数据"""
+    def _get_real_processes(self, server_config, timeout=None):
+        """获取真实进程数据，远程查询最多用时 timeout 秒（默认 host_deadline）"""
+        if server_config.get('collector') == 'agent':
+            return []  # agent不上报进程列表，也不为此打开SSH
+
         if not PARAMIKO_AVAILABLE:
             return []
 
         try:
             host = server_config['host']
-            port = server_config['port']
-            username = server_config['username']
-            auth_type = server_config.get('auth_type', 'password')
 
             # 本地服务器使用psutil
             if host in ['localhost', '127.0.0.1']:
                 return self._get_local_processes()
 
-            # 远程服务器使用SSH
-            ssh = paramiko.SSHClient()
-            ssh.set_missing_host_key_policy(paramiko.AutoAddPolicy())
-
-            # 连接服务器
-            if auth_type == 'password':
-                ssh.connect(
-                    hostname=host,
-                    port=port,
-                    username=username,
-                    password=server_config.get('password'),
-                    timeout=30  # 增加到30秒
-                )
-            else:  # key认证
-                private_key_path = server_config.get('private_key_path')
-                key_password = server_config.get('key_password')
-
-                try:
-                    private_key = paramiko.RSAKey.from_private_key_file(private_key_path, password=key_password)
-                except:
-                    private_key = paramiko.Ed25519Key.from_private_key_file(private_key_path, password=key_password)
-
-                ssh.connect(
-                    hostname=host,
-                    port=port,
-                    username=username,
-                    pkey=private_key,
-                    timeout=30  # 增加到30秒
-                )
-
+            # 远程服务器使用连接池中的SSH长连接
             # 获取进程信息 - 按CPU使用率排序的前10个进程
             cmd = "ps aux --sort=-%cpu | head -11 | tail -10 | awk '{print $2,$11,$3,$4,$8}'"
             print(f"🔍 执行进程查询命令: {cmd}")
-            stdin, stdout, stderr = ssh.exec_command(cmd)
-            process_lines = stdout.read().decode().strip().split('\n')
-            error_output = stderr.read().decode().strip()
+            output, error_output = self.connections.run(server_config, cmd, timeout=timeout or self.host_deadline)
+            process_lines = output.strip().split('\n')
+            error_output = error_output.strip()
 
             print(f"📊 进程命令输出行数: {len(process_lines)}")
             print(f"📊 进程原始输出: {process_lines}")
@@ -1287,7 +4620,6 @@ class ServerMonitor:
                             print(f"❌ 解析进程失败: {e}, 行内容: '{line}'")
                             continue
 
-            ssh.close()
             return processes[:10]  # 返回前10个进程
 
         except Exception as e:
@@ -1342,6 +4674,7 @@ class ServerMonitor:
 
 # 创建服务器监控实例
 server_monitor = ServerMonitor()
+atexit.register(server_monitor.stop_background_update)  # 退出时刷新未写入的历史数据
 
 # 不添加任何默认服务器配置，只使用用户真实添加的服务器
 
@@ -1504,6 +4837,46 @@ def test_server_connection(server_id=None):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/servers/probe', methods=['POST'])
+def probe_servers():
+    """批量TCP预检：并发检查大量主机的SSH端口是否可达（上架整机柜时使用）
+
+    请求体可选: {"hosts": ["10.0.0.1", "10.0.0.2:2222", {"host": "...", "port": 22}], "timeout": 2}
+    不提供hosts时检查所有已配置的远程服务器。
+    """
+    try:
+        body = request.get_json(silent=True) or {}
+        targets = []
+        for item in body.get('hosts') or []:
+            if isinstance(item, dict):
+                targets.append((item['host'], int(item.get('port', 22))))
+            else:
+                host, sep, port = str(item).rpartition(':')
+                targets.append((host, int(port)) if sep else (str(item), 22))
+        if not body.get('hosts'):
+            targets = [(config['host'], int(config.get('port', 22)))
+                       for config in server_monitor.servers.values()
+                       if config.get('host') not in ['localhost', '127.0.0.1'] and config.get('auth_type') != 'local']
+
+        timeout = min(float(body.get('timeout', server_monitor.probe.timeout)), 10)
+        started = time.monotonic()
+        results = server_monitor.probe.probe_many(targets, timeout)
+        reachable = sum(1 for result in results if result['reachable'])
+        return jsonify({
+            'success': True,
+            'data': {
+                'total': len(results),
+                'reachable': reachable,
+                'unreachable': len(results) - reachable,
+                'duration_ms': round((time.monotonic() - started) * 1000, 1),
+                'results': results,
+            }
+        })
+    except (KeyError, TypeError, ValueError) as e:
+        return jsonify({'success': False, 'error': f'请求格式错误: {e}'}), 400
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/servers/<server_id>/metrics', methods=['GET'])
 def get_server_metrics_api(server_id):
     """获取服务器监控数据API"""
@@ -1554,6 +4927,196 @@ def get_server_realtime_metrics(server_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+# agent推送批次的限制
+INGEST_MAX_BYTES = 16 * 1024 * 1024  # 解压后的最大字节数，防止压缩炸弹
+INGEST_TOKEN = os.environ.get('INGEST_TOKEN')  # agent需携带 Authorization: Bearer <token>，未设置时拒绝推送
+if not INGEST_TOKEN:
+    print("⚠️  未设置环境变量 INGEST_TOKEN，/api/ingest 已禁用，agent推送的数据将被拒绝")
+
+
+def parse_ingest_batch(body, gzipped):
+    """解析agent推送的批次：gzip压缩的NDJSON，首行为批次头，其余每行一个样本
+
+    批次头: {"server_id": ..., "agent_id": ..., "batch_seq": ..., "count": N}
+    样本:   {"seq": 1, "ts": 1700000000, "cpu": ..., "memory": ..., ...}
+    格式不符时抛出ValueError。
+    """
+    if gzipped:
+        decompressor = zlib.decompressobj(16 + zlib.MAX_WBITS)
+        body = decompressor.decompress(body, INGEST_MAX_BYTES)
+        if decompressor.unconsumed_tail:
+            raise ValueError('批次解压后超过大小限制')
+    lines = [line for line in body.decode('utf-8').splitlines() if line.strip()]
+    if not lines:
+        raise ValueError('空批次')
+
+    header = json.loads(lines[0])
+    for key in ('server_id', 'agent_id', 'batch_seq', 'count'):
+        if key not in header:
+            raise ValueError(f"批次头缺少字段: {key}")
+    if not re.fullmatch(r'[\w.-]{1,128}', str(header['server_id'])) or header['server_id'] in ('.', '..'):
+        raise ValueError(f"非法的server_id: {header['server_id']!r}")
+    if header['count'] != len(lines) - 1:
+        raise ValueError(f"样本数不符: 声明 {header['count']}, 实际 {len(lines) - 1}")
+
+    samples = []
+    for line in lines[1:]:
+        sample = json.loads(line)
+        if not isinstance(sample.get('seq'), int) or not isinstance(sample.get('ts'), (int, float)):
+            raise ValueError(f"样本缺少seq或ts: {line[:100]}")
+        for field in HISTORY_FIELDS:
+            value = sample.get(field, 0.0)
+            if not isinstance(value, (int, float)):
+                raise ValueError(f"样本字段 {field} 不是数字: {line[:100]}")
+        samples.append(sample)
+    return header, samples
+
+
+@app.route('/api/ingest', methods=['POST'])
+def ingest_metrics():
+    """接收agent推送的监控数据批次（gzip压缩的NDJSON）"""
+    try:
+        if not INGEST_TOKEN:
+            return jsonify({'success': False, 'error': '服务端未设置INGEST_TOKEN，agent推送已禁用'}), 403
+        if not hmac.compare_digest(request.headers.get('Authorization', ''), f"Bearer {INGEST_TOKEN}"):
+            return jsonify({'success': False, 'error': '未授权'}), 401
+
+        gzipped = request.headers.get('Content-Encoding', '').lower() == 'gzip'
+        try:
+            header, samples = parse_ingest_batch(request.get_data(), gzipped)
+        except (ValueError, OSError, zlib.error) as e:
+            return jsonify({'success': False, 'error': f"批次格式错误: {e}"}), 400
+
+        # 只接受已登记为agent采集的服务器，防止任意创建新的序列文件
+        server_config = server_monitor.servers.get(header['server_id'])
+        if not server_config or server_config.get('collector') != 'agent':
+            return jsonify({'success': False, 'error': f"服务器 {header['server_id']} 未配置为agent采集"}), 404
+
+        result = server_monitor.ingest_batch(header, samples)
+        return jsonify({
+            'success': True,
+            'data': dict(result, batch_seq=header['batch_seq'])
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)}), 503
+
+# 前端metrics参数与存储字段的对应关系
+HISTORICAL_METRIC_FIELDS = {
+    'cpu': ('cpu',),
+    'memory': ('memory',),
+    'disk': ('disk_read', 'disk_write'),
+    'network': ('network_sent', 'network_recv'),
+    'load': ('load_avg',),
+}
+
+
+def _parse_time_param(value, default):
+    """解析时间参数：支持epoch秒/毫秒和 '%Y-%m-%d %H:%M:%S' / ISO 格式"""
+    if value in (None, ''):
+        return default
+    try:
+        number = float(value)
+        return int(number / 1000) if number > 1e11 else int(number)
+    except ValueError:
+        pass
+    try:
+        return _to_epoch(value)
+    except ValueError:
+        return int(datetime.fromisoformat(value.replace('Z', '+00:00')).timestamp())
+
+
+@app.route('/api/servers/<server_id>/historical', methods=['GET'])
+def get_server_historical_data(server_id):
+    """按时间范围查询历史数据（流式返回）
+
+    参数: startTime / endTime（默认最近1小时）、metrics（逗号分隔，默认全部）、
+    maxPoints（可选，指定后使用降采样层级）。数据按行返回:
+    {"fields": ["timestamp", ...], "points": [[epoch秒, 值...], ...]}
+    """
+    try:
+        if server_id not in server_monitor.servers:
+            return jsonify({'success': False, 'error': '服务器不存在'})
+
+        end_ts = _parse_time_param(request.args.get('endTime'), int(time.time()))
+        start_ts = _parse_time_param(request.args.get('startTime'), end_ts - 3600)
+        if start_ts > end_ts:
+            return jsonify({'success': False, 'error': '开始时间不能晚于结束时间'})
+
+        metrics = [m.strip() for m in request.args.get('metrics', ','.join(HISTORICAL_METRIC_FIELDS)).split(',') if m.strip()]
+        unknown = [m for m in metrics if m not in HISTORICAL_METRIC_FIELDS]
+        if unknown or not metrics:
+            return jsonify({'success': False, 'error': f"不支持的指标: {', '.join(unknown) or '(空)'}"})
+        fields = [field for m in metrics for field in HISTORICAL_METRIC_FIELDS[m]]
+        max_points = request.args.get('maxPoints', type=int)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'时间参数格式错误: {e}'})
+
+    persistence = server_monitor.persistence
+    if max_points:
+        result = persistence.query_range(server_id, start_ts, end_ts, fields=fields, max_points=max_points)
+        resolution = result.get('resolution', 'raw') if result else 'raw'
+        chunks = [list(zip(result['timestamps'], *(result[field] for field in fields)))] if result else []
+    else:
+        resolution = 'raw'
+        chunks = persistence.iter_range(server_id, start_ts, end_ts, fields=fields)
+
+    def generate():
+        header = {
+            'server_id': server_id,
+            'start_time': start_ts,
+            'end_time': end_ts,
+            'resolution': resolution,
+            'fields': ['timestamp'] + fields,
+        }
+        yield '{"success": true, "data": ' + json.dumps(header)[:-1] + ', "points": ['
+        first = True
+        for rows in chunks:
+            if not rows:
+                continue
+            body = json.dumps(rows)[1:-1]
+            yield body if first else ',' + body
+            first = False
+        yield ']}}'
+
+    return Response(stream_with_context(generate()), mimetype='application/json')
+
+@app.route('/api/servers/<server_id>/devices/<kind>', methods=['GET'])
+def get_server_device_data(server_id, kind):
+    """按时间范围查询分设备序列（kind=disk: 每块磁盘的IOPS、字节/秒、await、%util）
+
+    参数: startTime / endTime（默认最近1小时）、devices（逗号分隔，默认全部）、maxPoints（可选）
+    """
+    try:
+        if server_id not in server_monitor.servers:
+            return jsonify({'success': False, 'error': '服务器不存在'})
+        if kind not in DEVICE_FIELDS:
+            return jsonify({'success': False, 'error': f'不支持的设备类别: {kind}'})
+
+        end_ts = _parse_time_param(request.args.get('endTime'), int(time.time()))
+        start_ts = _parse_time_param(request.args.get('startTime'), end_ts - 3600)
+        if start_ts > end_ts:
+            return jsonify({'success': False, 'error': '开始时间不能晚于结束时间'})
+        devices = [d.strip() for d in request.args.get('devices', '').split(',') if d.strip()] or None
+        max_points = request.args.get('maxPoints', type=int)
+    except ValueError as e:
+        return jsonify({'success': False, 'error': f'时间参数格式错误: {e}'})
+
+    try:
+        series = server_monitor.persistence.query_devices(server_id, kind, start_ts, end_ts, devices, max_points)
+        return jsonify({
+            'success': True,
+            'data': {
+                'server_id': server_id,
+                'kind': kind,
+                'start_time': start_ts,
+                'end_time': end_ts,
+                'fields': list(DEVICE_FIELDS[kind]),
+                'devices': series,
+            }
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/api/servers/<server_id>/processes', methods=['GET'])
 def get_server_processes(server_id):
     """获取服务器进程列表"""
@@ -1575,6 +5138,39 @@ def get_server_processes(server_id):
     except Exception as e:
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/connections/stats', methods=['GET'])
+def get_connection_stats():
+    """获取SSH连接池统计（复用率、连接耗时、各连接状态）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': server_monitor.connections.stats()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/cache/stats', methods=['GET'])
+def get_cache_stats():
+    """获取响应缓存统计（命中率滑动窗口、每个键的年龄/大小、请求合并与后台刷新）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': server_monitor.cache_summary()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
+@app.route('/api/collector/stats', methods=['GET'])
+def get_collector_stats():
+    """获取后台采集统计（每批耗时、每台服务器最近一次成功时间和调度状态）"""
+    try:
+        return jsonify({
+            'success': True,
+            'data': server_monitor.collector_summary()
+        })
+    except Exception as e:
+        return jsonify({'success': False, 'error': str(e)})
+
 @app.route('/performance-monitor')
 def performance_monitor():
     """性能监控页面"""
@@ -80,15 +80,24 @@ class OptimizedServerManager:
                         response_time = (time.time() - start_time) * 1000
                         
                         if metrics_response.status_code == 200:
-                            data = metrics_response.json()
-                            cache_info = data.get('data', {}).get('cache_info', {})
-                            cache_hit = cache_info.get('cache_hit', False)
-                            cache_age = cache_info.get('cache_age', 'N/A')
+                            cache_stats = requests.get('http://localhost:5000/api/cache/stats', timeout=5).json().get('data', {})
+                            collector_stats = requests.get('http://localhost:5000/api/collector/stats', timeout=5).json().get('data', {})
                             
-                            status = "🔥 缓存命中" if cache_hit else "🐌 缓存未命中"
+                            window = cache_stats.get('windows', {}).get('1m', {})
+                            metrics_key = f"{server_id}_metrics_1h"
+                            entry = next((info for info in cache_stats.get('keys', []) if info['key'] == metrics_key), None)
+                            cache_age = f"{entry['age']:.1f}s" if entry else 'N/A'
+                            last_success = collector_stats.get('servers', {}).get(server_id, {}).get('last_success') or 'N/A'
                             
                             print(f"📊 [{datetime.now().strftime('%H:%M:%S')}] "
-                                  f"响应时间: {response_time:.1f}ms | {status} | 缓存年龄: {cache_age}")
+                                  f"响应时间: {response_time:.1f}ms | "
+                                  f"1分钟命中率: {window.get('hit_rate', 0)*100:.1f}% "
+                                  f"(命中 {window.get('hits', 0) + window.get('stale_hits', 0)}, 未命中 {window.get('misses', 0)}) | "
+                                  f"缓存年龄: {cache_age}")
+                            fleet_fit = collector_stats.get('fleet_fit', {})
+                            print(f"   🔄 采集线程利用率p95: {fleet_fit.get('p95_utilization', 0)*100:.0f}% | "
+                                  f"最近成功采集: {last_success} | "
+                                  f"缓存条目: {cache_stats.get('entries', 0)} ({cache_stats.get('bytes', 0)/1024:.1f}KB)")
                         else:
                             print(f"❌ [{datetime.now().strftime('%H:%M:%S')}] "
                                   f"API错误: {metrics_response.status_code}")
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+"""
+响应缓存测试
+验证TTLCache的LRU淘汰、过期与stale宽限期，以及SingleFlight合并并发调用
+
+运行: python -m pytest -q test_cache.py
+"""
+
+import threading
+import time
+
+import pytest
+
+
+def test_lru_eviction(server):
+    cache = server.TTLCache(default_ttl=60, max_entries=2, stripes=1)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1  # a 变为最近使用
+    cache.set('c', 3)
+
+    assert 'b' not in cache
+    assert cache.get('a') == 1 and cache.get('c') == 3
+    assert cache.stats()['evictions'] == 1
+
+
+def test_expiry_without_grace(server):
+    cache = server.TTLCache(default_ttl=0.05, stripes=1)
+    cache.set('a', 1)
+    time.sleep(0.1)
+    assert cache.get('a') is None
+    assert cache.get_stale('a') is None
+    assert len(cache) == 0
+
+
+def test_stale_grace(server):
+    cache = server.TTLCache(default_ttl=0.05, stripes=1, stale_grace=0.3)
+    cache.set('a', 1)
+    assert cache.get_stale('a') == (1, False)
+
+    time.sleep(0.1)
+    assert 'a' not in cache
+    assert cache.get('a') is None  # get 不返回过期条目
+    assert cache.get_stale('a') == (1, True)
+
+    time.sleep(0.3)
+    assert cache.get_stale('a') is None  # 超过宽限期后删除
+    stats = cache.stats()
+    assert stats['stale_hits'] == 1 and stats['expirations'] == 1
+
+
+def test_single_flight_coalesces_callers(server):
+    flight = server.SingleFlight(wait_timeout=5)
+    release = threading.Event()
+    calls = []
+
+    def load():
+        calls.append(1)
+        release.wait(5)
+        return 'value'
+
+    results = []
+    threads = [threading.Thread(target=lambda: results.append(flight.do('key', load))) for _ in range(5)]
+    for thread in threads:
+        thread.start()
+    deadline = time.monotonic() + 5
+    while flight.stats['coalesced'] < 4 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    for thread in threads:
+        thread.join()
+
+    assert len(calls) == 1
+    assert sorted(results) == [('value', False)] + [('value', True)] * 4
+    assert flight.stats['executions'] == 1 and flight.stats['coalesced'] == 4
+    assert flight.in_flight() == 0
+
+
+def test_single_flight_shares_errors(server):
+    flight = server.SingleFlight(wait_timeout=5)
+    started = threading.Event()
+    release = threading.Event()
+
+    def fail():
+        started.set()
+        release.wait(5)
+        raise RuntimeError('采集失败')
+
+    errors = []
+
+    def call():
+        try:
+            flight.do('key', fail)
+        except RuntimeError as e:
+            errors.append(str(e))
+
+    leader = threading.Thread(target=call)
+    leader.start()
+    started.wait(5)
+    follower = threading.Thread(target=call)
+    follower.start()
+    deadline = time.monotonic() + 5
+    while flight.stats['coalesced'] < 1 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    release.set()
+    leader.join()
+    follower.join()
+
+    assert errors == ['采集失败', '采集失败']
+    with pytest.raises(ValueError):
+        flight.do('other', lambda: int('x'))
@@ -0,0 +1,124 @@
+#!/usr/bin/env python3
+"""
+采集调度与解析测试
+验证PollScheduler的失败退避和overrun对齐，以及ProcMetricsScript对/proc输出的解析和速率计算
+
+运行: python -m pytest -q test_collectors.py
+"""
+
+import time
+
+import pytest
+
+
+def proc_output(uptime, cpu, sda, eth0):
+    """构造一份 /proc 采集脚本输出；cpu为(user, system, idle, iowait)，sda为(读完成, 读扇区, 写完成, 写扇区)，eth0为(收字节, 发字节)"""
+    user, system, idle, iowait = cpu
+    reads, read_sectors, writes, write_sectors = sda
+    rx, tx = eth0
+    return '\n'.join([
+        '@@monitor-proc v1',
+        '@@uptime', f'{uptime:.2f} 1000.00',
+        '@@stat',
+        f'cpu  {user} 0 {system} {idle} {iowait} 0 0 0 0 0',
+        f'cpu0 {user} 0 {system} {idle} {iowait} 0 0 0 0 0',
+        '@@meminfo', 'MemTotal:        8000000 kB', 'MemFree:         1000000 kB', 'MemAvailable:    4000000 kB',
+        '@@loadavg', '0.50 0.40 0.30 1/100 1234',
+        '@@diskstats',
+        f'   8       0 sda {reads} 0 {read_sectors} 40 {writes} 0 {write_sectors} 60 0 100 100 0 0 0 0',
+        f'   8       1 sda1 {reads} 0 {read_sectors} 40 {writes} 0 {write_sectors} 60 0 100 100 0 0 0 0',
+        '   7       0 loop0 1 0 8 0 0 0 0 0 0 0 0 0 0 0 0',
+        '@@net_dev',
+        f'  eth0: {rx} 10 0 0 0 0 0 0 {tx} 20 0 0 0 0 0 0',
+        '    lo: 500 5 0 0 0 0 0 0 500 5 0 0 0 0 0 0',
+        '@@df', '/dev/sda1 100000 25000 75000 25% /',
+        '@@end',
+    ])
+
+
+@pytest.fixture
+def scheduler(server):
+    scheduler = server.PollScheduler(default_interval=10, max_backoff=300, jitter=0)
+    scheduler.add('web1', 10)
+    return scheduler
+
+
+def pop(scheduler):
+    (server_id, due_time), = scheduler.pop_due(now=time.monotonic() + 3600)
+    return due_time
+
+
+def test_scheduler_backoff(scheduler):
+    intervals = []
+    for _ in range(6):
+        scheduler.complete('web1', pop(scheduler), success=False, duration=0.1)
+        intervals.append(scheduler.snapshot()['web1']['current_interval'])
+    assert intervals == [20, 40, 80, 160, 300, 300]  # 按2的幂增长，上限 max_backoff
+    assert scheduler.snapshot()['web1']['failures'] == 6
+
+    scheduler.complete('web1', pop(scheduler), success=True, duration=0.1, value=10.0)
+    state = scheduler.snapshot()['web1']
+    assert state['current_interval'] == 10 and state['failures'] == 0
+
+
+def test_scheduler_overrun_skips_to_next_slot(scheduler):
+    pop(scheduler)
+    due_time = time.monotonic() - 35  # 已经错过3个时间槽
+    assert scheduler.complete('web1', due_time, success=True, duration=0.1)
+    state = scheduler.snapshot()['web1']
+    assert state['overruns'] == 1
+    # 下一个对齐的时间槽是 due_time + 40，大约5秒后，而不是立即重试
+    assert 4 <= state['next_due_in'] <= 5.5
+
+
+def test_scheduler_skips_running_servers(scheduler):
+    pop(scheduler)
+    assert scheduler.pop_due(now=time.monotonic() + 3600) == []
+
+
+def test_proc_parse(server):
+    snapshot = server.ProcMetricsScript.parse(proc_output(1000, (100, 100, 700, 100), (100, 2000, 200, 4000), (1000, 2000)))
+    assert snapshot['uptime'] == 1000.0
+    assert set(snapshot['cpus']) == {'cpu', 'cpu0'}
+    assert list(snapshot['disks']) == ['sda']  # 分区和loop设备被忽略
+    assert list(snapshot['interfaces']) == ['eth0']  # lo被忽略
+    assert snapshot['meminfo']['MemAvailable'] == 4000000
+    assert (snapshot['disk_used_kb'], snapshot['disk_available_kb']) == (25000, 75000)
+
+    assert server.ProcMetricsScript.disk_counters(snapshot['disks']) == {
+        'sda': (100, 200, 2000 * 512, 4000 * 512, 40, 60, 100),
+    }
+    assert server.ProcMetricsScript.interface_counters(snapshot['interfaces']) == {
+        'eth0': (1000, 2000, 10, 20, 0, 0, 0, 0),
+    }
+
+
+@pytest.mark.parametrize('output, message', [
+    ('@@monitor-proc v0\n@@end', '版本不匹配'),
+    ('@@monitor-proc v1\n@@uptime\n1 1', '缺少结束标记'),
+    ('@@monitor-proc v1\n@@uptime\n1 1\n@@end', '缺少段'),
+    ('@@monitor-proc v1\n@@bogus\nx\n@@end', '无法识别的段'),
+])
+def test_proc_parse_rejects_bad_output(server, output, message):
+    with pytest.raises(ValueError, match=message):
+        server.ProcMetricsScript.parse(output)
+
+
+def test_proc_derive(server):
+    script = server.ProcMetricsScript
+    first = script.parse(proc_output(1000, (100, 100, 700, 100), (100, 2000, 200, 4000), (1000, 2000)))
+    second = script.parse(proc_output(1010, (150, 150, 1200, 100), (150, 4000, 300, 8000), (11000, 7000)))
+
+    warmup = script.derive(None, first)
+    assert warmup['warmup'] and warmup['network_interfaces'] == {}
+
+    metrics = script.derive(first, second)
+    assert not metrics['warmup']
+    assert metrics['cpu'] == 16.7  # (50+50) / (50+50+500)
+    assert metrics['memory_percent'] == 50.0
+    assert metrics['disk_percent'] == 25.0
+    assert metrics['disk_read'] == 2000 * 512 / 10
+    assert metrics['disk_write'] == 4000 * 512 / 10
+    assert metrics['disk_read_iops'] == 5.0 and metrics['disk_write_iops'] == 10.0
+    assert metrics['network_recv'] == 1000.0 and metrics['network_sent'] == 500.0
+    assert metrics['load_avg'] == 0.5
@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+"""
+agent推送接口测试
+验证 /api/ingest 的令牌校验、服务器登记检查和按序号去重
+
+运行: python -m pytest -q test_ingest.py
+"""
+
+import gzip
+import json
+
+import pytest
+
+
+def batch(server_id, seqs, agent_id='agent-a', batch_seq=1):
+    samples = [{'seq': seq, 'ts': 1700000000 + seq, 'cpu': float(seq), 'memory': 50.0} for seq in seqs]
+    lines = [{'server_id': server_id, 'agent_id': agent_id, 'batch_seq': batch_seq, 'count': len(samples)}] + samples
+    return gzip.compress('\n'.join(json.dumps(line) for line in lines).encode())
+
+
+def post(client, body, token='secret'):
+    headers = {'Content-Encoding': 'gzip'}
+    if token is not None:
+        headers['Authorization'] = f'Bearer {token}'
+    return client.post('/api/ingest', data=body, headers=headers)
+
+
+@pytest.fixture
+def client(server, monkeypatch):
+    monkeypatch.setattr(server, 'INGEST_TOKEN', 'secret')
+    client = server.app.test_client()
+    client.post('/api/servers', json={
+        'id': 'push1', 'name': 'push1', 'host': '10.0.0.9', 'port': 22, 'username': 'root', 'collector': 'agent',
+    })
+    yield client
+    client.delete('/api/servers/push1')
+
+
+def test_ingest_disabled_without_token(server, client, monkeypatch):
+    monkeypatch.setattr(server, 'INGEST_TOKEN', '')
+    response = post(client, batch('push1', [1]))
+    assert response.status_code == 403
+
+
+@pytest.mark.parametrize('token', [None, 'wrong', ''])
+def test_ingest_rejects_bad_token(client, token):
+    response = post(client, batch('push1', [1]), token=token)
+    assert response.status_code == 401
+    assert response.get_json()['success'] is False
+
+
+def test_ingest_rejects_unregistered_server(client):
+    response = post(client, batch('unknown', [1]))
+    assert response.status_code == 404
+
+
+def test_ingest_rejects_malformed_batch(client):
+    response = post(client, gzip.compress(b'{"server_id": "push1"}'))
+    assert response.status_code == 400
+
+
+def test_ingest_deduplicates_by_seq(server, client):
+    first = post(client, batch('push1', [1, 2, 3])).get_json()['data']
+    assert (first['accepted'], first['duplicates'], first['acked_seq']) == (3, 0, 3)
+
+    # 重传整批：只确认，不重复写入
+    resent = post(client, batch('push1', [1, 2, 3])).get_json()['data']
+    assert (resent['accepted'], resent['duplicates'], resent['acked_seq']) == (0, 3, 3)
+
+    # 与上一批部分重叠
+    overlap = post(client, batch('push1', [3, 4, 5], batch_seq=2)).get_json()['data']
+    assert (overlap['accepted'], overlap['duplicates'], overlap['acked_seq']) == (2, 1, 5)
+
+    state = server.server_monitor.ingest_state['push1']
+    assert (state['samples'], state['duplicates'], state['batches']) == (5, 4, 3)
+
+    # agent状态被清空后以新的agent_id重新计数
+    restarted = post(client, batch('push1', [1], agent_id='agent-b')).get_json()['data']
+    assert (restarted['accepted'], restarted['acked_seq']) == (1, 1)
@@ -0,0 +1,29 @@
+#!/usr/bin/env python3
+"""
+计数器增量测试
+验证counter_delta对32/64位回绕和计数器重置的判断
+
+运行: python -m pytest -q test_metric_counters.py
+"""
+
+from metric_counters import COUNTER_32_MAX, COUNTER_64_MAX, counter_delta
+
+
+def test_increasing_counter():
+    assert counter_delta(100, 250) == 150
+    assert counter_delta(7, 7) == 0
+
+
+def test_32bit_wrap():
+    assert counter_delta(COUNTER_32_MAX - 100, 50) == 150
+
+
+def test_64bit_wrap():
+    # 旧值超出32位范围，只能是64位计数器回绕
+    assert counter_delta(COUNTER_64_MAX - 10, 5) == 15
+
+
+def test_reset_returns_none():
+    # 32位范围内变小但回绕增量超过半个量程：接口重建或主机重启
+    assert counter_delta(1_000_000, 10) is None
+    assert counter_delta(COUNTER_32_MAX + 1_000_000, 10) is None
@@ -0,0 +1,98 @@
+#!/usr/bin/env python3
+"""
+分段压缩编解码测试
+验证SegmentCodec对单条记录、NaN/inf、极大浮点数和varint边界值都能无损往返
+
+运行: python -m pytest -q test_segment_codec.py
+"""
+
+import numpy as np
+import pytest
+
+INT64_MIN = -(2 ** 63)
+INT64_MAX = 2 ** 63 - 1
+
+
+def make_records(server, ts, **columns):
+    records = np.zeros(len(ts), dtype=server.RECORD_DTYPE)
+    records['ts'] = ts
+    for field, values in columns.items():
+        records[field] = values
+    return records
+
+
+def roundtrip(server, records, dtype=None):
+    codec = server.SegmentCodec(dtype or records.dtype)
+    data = codec.encode(records)
+    assert server.SegmentCodec.is_encoded(data)
+    assert server.SegmentCodec.record_count(data[:server.SegmentCodec.HEADER_SIZE]) == len(records)
+    decoded = codec.decode(data)
+    assert decoded.dtype == records.dtype
+    for name in records.dtype.names:
+        np.testing.assert_array_equal(decoded[name], records[name], err_msg=name)
+    return decoded
+
+
+def test_single_record(server):
+    roundtrip(server, make_records(server, [1700000000], cpu=[12.5], memory=[40.0], network_recv=[123456.0]))
+
+
+def test_empty_segment(server):
+    roundtrip(server, make_records(server, []))
+
+
+def test_regular_series(server):
+    rng = np.random.default_rng(0)
+    count = 1000
+    roundtrip(server, make_records(
+        server, 1700000000 + np.arange(count),
+        cpu=rng.uniform(0, 100, count),
+        memory=np.round(rng.uniform(0, 100, count), 1),
+        network_sent=np.cumsum(rng.integers(0, 10 ** 6, count)).astype(float),
+    ))
+
+
+def test_nan_and_inf(server):
+    values = [np.nan, 1.5, np.nan, np.inf, -np.inf, 0.0, np.nan]
+    decoded = roundtrip(server, make_records(server, np.arange(len(values)), cpu=values))
+    # NaN的位模式（含符号位和payload）也原样保留
+    original = np.array(values).view('<u8')
+    np.testing.assert_array_equal(decoded['cpu'].view('<u8'), original)
+
+
+@pytest.mark.parametrize('values', [
+    [1e308, -1e308, np.finfo(float).max, -np.finfo(float).max],
+    [5e-324, -5e-324, np.finfo(float).tiny, 1.0],
+    # 2**53 以内的整数值走增量编码，超过后改用XOR，两侧都要无损
+    [2.0 ** 53 - 1, -(2.0 ** 53 - 1), 0.0, 2.0 ** 53 - 1],
+    [2.0 ** 53, 2.0 ** 53 + 2, -(2.0 ** 53), 2.0 ** 63],
+])
+def test_large_and_tiny_floats(server, values):
+    roundtrip(server, make_records(server, np.arange(len(values)), disk_read=values, network_recv=values))
+
+
+def test_timestamp_extremes(server):
+    # delta-of-delta在int64上回绕，解码时的累加同样回绕，结果必须还原
+    roundtrip(server, make_records(server, [INT64_MIN, INT64_MAX, 0, INT64_MIN + 1, INT64_MAX - 1]))
+
+
+def test_integer_column_extremes(server):
+    rows = np.zeros(4, dtype=server.ROLLUP_DTYPE)
+    rows['ts'] = [0, 60, 120, 180]
+    rows['count'] = [INT64_MAX, INT64_MIN, 0, -1]
+    roundtrip(server, rows)
+
+
+def test_varint_extremes(server):
+    values = np.array([0, 1, 127, 128, 16383, 16384, 2 ** 63, 2 ** 64 - 1], dtype=np.uint64)
+    data = server._encode_varints(values)
+    # 每字节7位：2**64-1 需要10个字节
+    assert len(server._encode_varints(values[-1:])) == 10
+    np.testing.assert_array_equal(server._decode_varints(data, len(values)), values)
+
+
+def test_zigzag_extremes(server):
+    values = np.array([INT64_MIN, -1, 0, 1, INT64_MAX], dtype=np.int64)
+    encoded = server._zigzag(values)
+    np.testing.assert_array_equal(encoded, np.array([2 ** 64 - 1, 1, 0, 2, 2 ** 64 - 2], dtype=np.uint64))
+    np.testing.assert_array_equal(server._unzigzag(encoded), values)
@@ -0,0 +1,145 @@
+#!/usr/bin/env python3
+"""
+服务器增删测试
+验证删除服务器时连接、调度、流式会话和采集状态都被清理，以及agent推送的服务器只从推送数据读取
+
+运行: python -m pytest -q test_server_lifecycle.py
+"""
+
+import gzip
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+
+class FakeSampler:
+    """代替StreamingSampler，只记录是否被停止"""
+
+    def __init__(self):
+        self.stopped = False
+
+    def stop(self):
+        self.stopped = True
+
+
+def test_delete_server_cleans_up(server):
+    monitor = server.server_monitor
+    client = server.app.test_client()
+
+    response = client.post('/api/servers', json={
+        'id': 'web1', 'name': 'web1', 'host': '10.0.0.1', 'port': 22,
+        'username': 'root', 'retention': {'raw': '72h'},
+    })
+    assert response.get_json()['success']
+    assert 'web1' in monitor.scheduler.snapshot()
+
+    # 模拟运行过一段时间后留下的状态
+    monitor.connections._entry(monitor.servers['web1'])
+    sampler = monitor.streams['web1'] = FakeSampler()
+    monitor.proc_snapshots['web1'] = ({}, {}, 1)
+    monitor.script_counters['web1'] = {}
+    monitor.collection_status['web1'] = {'last_success': None}
+
+    assert 'web1' in monitor.connections.stats()['connections']
+
+    response = client.delete('/api/servers/web1')
+    assert response.get_json() == {'success': True}
+
+    assert 'web1' not in monitor.servers
+    assert 'web1' not in monitor.scheduler.snapshot()
+    assert 'web1' not in monitor.streams and sampler.stopped
+    assert 'web1' not in monitor.proc_snapshots
+    assert 'web1' not in monitor.script_counters
+    assert 'web1' not in monitor.collection_status
+    assert 'web1' not in monitor.connections.stats()['connections']
+    assert monitor.persistence.retention.window('web1', 'raw') == monitor.persistence.retention.defaults['raw']
+
+
+def test_delete_unknown_server(server):
+    response = server.app.test_client().delete('/api/servers/missing')
+    assert response.get_json() == {'success': False, 'error': '服务器不存在'}
+
+
+def test_agent_server_served_from_pushed_data(server, monkeypatch):
+    monitor = server.server_monitor
+    client = server.app.test_client()
+    monkeypatch.setattr(server, 'INGEST_TOKEN', 'secret')
+
+    def no_ssh(*args, **kwargs):
+        raise AssertionError('agent服务器不应建立SSH连接')
+    monkeypatch.setattr(monitor.connections, 'run', no_ssh)
+
+    response = client.post('/api/servers', json={
+        'id': 'agent1', 'name': 'agent1', 'host': '10.0.0.2', 'port': 22,
+        'username': 'root', 'collector': 'agent',
+    })
+    assert response.get_json()['success']
+    assert 'agent1' not in monitor.scheduler.snapshot()
+
+    # 推送之前没有数据可用，也不回退到SSH采集
+    response = client.get('/api/servers/agent1/metrics?timeRange=1h')
+    assert response.get_json()['success'] is False
+
+    now = int(time.time())
+    samples = [{'seq': i + 1, 'ts': now - 20 + i * 10, 'cpu': 10.0 * (i + 1), 'memory': 50.0} for i in range(3)]
+    lines = [{'server_id': 'agent1', 'agent_id': 'a', 'batch_seq': 1, 'count': len(samples)}] + samples
+    body = gzip.compress('\n'.join(json.dumps(line) for line in lines).encode())
+    response = client.post('/api/ingest', data=body, headers={
+        'Authorization': 'Bearer secret', 'Content-Encoding': 'gzip',
+    })
+    assert response.get_json()['data']['accepted'] == 3
+    monitor.persistence.flush()
+
+    data = client.get('/api/servers/agent1/metrics?timeRange=1h').get_json()['data']
+    assert data['current']['cpu'] == 30.0
+    assert data['historical']['cpu'] == [10.0, 20.0, 30.0]
+    assert data['processes'] == []
+    assert data['cache_info']['cache_hit'] is False
+
+    data = client.get('/api/servers/agent1/metrics?timeRange=1h').get_json()['data']
+    assert data['cache_info']['cache_hit'] is True
+    assert data['current']['cpu'] == 30.0
+
+    client.delete('/api/servers/agent1')
+    assert 'agent1' not in monitor.ingest_state
+
+
+def test_stream_server_served_from_snapshot(server, monkeypatch):
+    monitor = server.server_monitor
+    client = server.app.test_client()
+    commands = []
+
+    def fake_run(server_config, command, timeout=30):
+        commands.append(command)
+        return '1 nginx 2.0 1.0 S\n', ''
+    monkeypatch.setattr(monitor.connections, 'run', fake_run)
+    monkeypatch.setattr(monitor, 'collector_pool', ThreadPoolExecutor(max_workers=1))
+    monkeypatch.setattr(server.ProcMetricsScript, 'derive',
+                        staticmethod(lambda previous, current: {'cpu': 42.0, 'memory_percent': 30.0}))
+
+    monitor.servers['stream1'] = {'id': 'stream1', 'host': '10.0.0.3', 'port': 22,
+                                  'username': 'root', 'collector': 'stream'}
+    monitor.streams['stream1'] = FakeSampler()
+
+    # 采样回调写入实时数据，并在后台单独刷新进程列表
+    monitor._on_stream_sample('stream1', {}, 1)
+    monitor.collector_pool.shutdown(wait=True)
+    assert commands == [commands[0]] and commands[0].startswith('ps ')
+
+    # 采样回调已重建历史缓存，请求直接命中且不是stale
+    for _ in range(2):
+        data = client.get('/api/servers/stream1/metrics?timeRange=1h').get_json()['data']
+        assert data['cache_info']['cache_hit'] is True
+        assert data['cache_info']['stale'] is False
+        assert data['current']['cpu'] == 42.0
+        assert data['processes'][0]['name'] == 'nginx'
+    assert len(commands) == 1  # 读取时不再另开一次性采集
+
+    # 缓存未命中时同样使用最近一次快照
+    monitor.performance_cache.pop('stream1_metrics_6h')
+    data = client.get('/api/servers/stream1/metrics?timeRange=6h').get_json()['data']
+    assert data['cache_info']['cache_hit'] is False
+    assert data['current']['cpu'] == 42.0
+    assert len(commands) == 1
+
+    monitor.delete_server('stream1')